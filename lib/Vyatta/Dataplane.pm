@@ -16,7 +16,7 @@ require Exporter;
 our @ISA = qw(Exporter);
 
 our @EXPORT =
-  qw(vplane_exec_cmd vplane_exec_pb_cmd get_vplane_info controller_command is_dp_connected);
+  qw(vplane_exec_cmd vplane_exec_cmd_parallel vplane_exec_pb_cmd get_vplane_info controller_command is_dp_connected);
 
 use Carp;
 use Config::Tiny;
@@ -73,11 +73,25 @@ sub new {
 
 sub execute {
     my ( $self, $cmd ) = @_;
+
+    $self->send_cmd($cmd);
+    return $self->response();
+}
+
+# Send a command without waiting for its response, which must then be read
+# with response()
+sub send_cmd {
+    my ( $self, $cmd ) = @_;
     my $sock = $$self;
 
     my $msg = zmq_msg_init_data($cmd);
     my $rv = zmq_msg_send( $msg, $sock );
     croak "zmq_msg_send failed: $!" if ( $rv == -1 );
+}
+
+sub response {
+    my $self = shift;
+    my $sock = $$self;
 
     my ( $status, $response ) = _recv_reply($sock);
 
@@ -237,6 +251,34 @@ sub vplane_exec_cmd {
     return ( \@resp_arr );
 }
 
+# Same as vplane_exec_cmd with a response expected, but the command is sent
+# to all the dataplanes before waiting for any of them, so they all process
+# it at the same time. The responses of all the dataplanes are read before
+# dying with the first error, so that the connections can be used again.
+sub vplane_exec_cmd_parallel {
+    my ( $cmd, $dp_ids, $dp_conns ) = @_;
+    my @resp_arr = ();
+    my @sent     = ();
+    my $err;
+
+    for my $dp_id ( sort @{$dp_ids} ) {
+        my $sock = ${$dp_conns}[$dp_id];
+
+        next unless $sock;
+
+        $sock->send_cmd($cmd);
+        push @sent, $dp_id;
+    }
+
+    for my $dp_id (@sent) {
+        eval { $resp_arr[$dp_id] = ${$dp_conns}[$dp_id]->response(); };
+        $err = $@ if ( $@ && !defined($err) );
+    }
+    die $err if defined($err);
+
+    return ( \@resp_arr );
+}
+
 sub vplane_exec_pb_cmd {
     my ( $cmd, $pb, $dp_ids, $dp_conns, $expect_response ) = @_;
     my @resp_arr = ();
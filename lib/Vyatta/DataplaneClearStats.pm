@@ -0,0 +1,254 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+#
+# Module: DataplaneClearStats.pm
+# Store of the dataplane interface counters baselines taken by "clear"
+#
+# All the baselines live in a single binary file, shared with the Python
+# vplaned.clearstats module: a header followed by fixed width records, one
+# per (interface, dataplane id, kind, counter), sorted on their bytes so the
+# baselines of an interface are found with a binary search of the memory
+# mapped file. Updates rewrite the file and rename it over the old one.
+
+package Vyatta::DataplaneClearStats;
+
+use strict;
+use warnings;
+
+use Fcntl qw( :flock );
+use File::Map qw( map_file unmap );
+use File::Temp qw( tempfile );
+
+use base 'Exporter';
+
+our @EXPORT_OK = qw(clear_stats_get clear_stats_update);
+
+# Locations of the store and of the legacy files, set elsewhere by tests
+our $store      = '/var/run/vyatta/dataplane-clear-stats';
+our $legacy_dir = '/var/run/vyatta';
+
+my $magic        = 'VCLRSTS1';
+my $legacy_magic = 'XYZZYX';
+
+# magic, record size, record count
+my $header_fmt  = 'a8 N N';
+my $header_size = 16;
+
+# interface, dataplane id, kind (e.g. "stats"), counter, value
+my $record_fmt  = 'a32 N a16 a36 Q>';
+my $record_size = 96;
+
+# bytes of the record identifying the baselines of an interface
+my $key_size = 32 + 4 + 16;
+
+sub _key {
+    my ( $ifname, $dp_id, $which ) = @_;
+
+    return pack( 'a32 N a16', $ifname, $dp_id, $which );
+}
+
+# Record of a counter baseline, dies if the counter name does not fit in its
+# field, as vplaned.clearstats does
+sub _record {
+    my ( $ifname, $dp_id, $which, $var, $val ) = @_;
+    my $name = $var;
+
+    utf8::encode($name);
+    die "counter name too long: $var\n" if length($name) > 36;
+    return pack( $record_fmt, $ifname, $dp_id, $which, $name, $val );
+}
+
+# The store stays mapped until it is replaced by an update
+my $map;
+my $map_count;
+my $map_ino;
+
+# Map the store, returns the mapping and its record count or nothing if
+# there is no valid store
+sub _map_store {
+    my @st = stat($store);
+    return unless @st && $st[7];
+
+    return ( \$map, $map_count )
+      if ( defined($map_ino) && $map_ino == $st[1] );
+
+    if ( defined($map_ino) ) {
+        unmap($map);
+        $map_ino = undef;
+    }
+    map_file( $map, $store, '<' );
+
+    my ( $file_magic, $size, $count ) = unpack( $header_fmt, $map );
+    if (   $file_magic ne $magic
+        || $size != $record_size
+        || length($map) < $header_size + $count * $record_size )
+    {
+        print "bad magic [$store]\n";
+        unmap($map);
+        unlink $store;
+        return;
+    }
+
+    $map_count = $count;
+    $map_ino   = $st[1];
+    return ( \$map, $map_count );
+}
+
+# Index of the first record not below key
+sub _search {
+    my ( $map, $count, $key ) = @_;
+    my ( $lo, $hi ) = ( 0, $count );
+
+    while ( $lo < $hi ) {
+        my $mid = int( ( $lo + $hi ) / 2 );
+        my $rec_key =
+          substr( $$map, $header_size + $mid * $record_size, $key_size );
+        if ( $rec_key lt $key ) {
+            $lo = $mid + 1;
+        } else {
+            $hi = $mid;
+        }
+    }
+    return $lo;
+}
+
+sub _read_legacy {
+    my $filename = shift;
+    my %stats    = ();
+
+    open( my $f, '<', $filename )
+      or return;
+
+    my $file_magic = <$f>;
+    unless ( defined($file_magic) ) {
+        close($f);
+        return;
+    }
+    chomp $file_magic;
+    if ( $file_magic ne $legacy_magic ) {
+        close($f);
+        return;
+    }
+
+    while (<$f>) {
+        chomp;
+        my ( $var, $val ) = split(/,/);
+        $stats{$var} = $val;
+    }
+    close($f);
+    return \%stats;
+}
+
+# Baselines of the interface on the dataplane as a hash of counter name to
+# value, empty if the interface was never cleared
+sub clear_stats_get {
+    my ( $ifname, $dp_id, $which ) = @_;
+    my %stats = ();
+
+    $which = "stats" if !defined($which);
+
+    # Not migrated yet
+    unless ( -e $store ) {
+        my $legacy = _read_legacy("$legacy_dir/$ifname.dp$dp_id.$which");
+        return defined($legacy) ? %$legacy : %stats;
+    }
+
+    my ( $map, $count ) = _map_store();
+    return %stats unless defined($map);
+
+    my $key = _key( $ifname, $dp_id, $which );
+    for ( my $i = _search( $map, $count, $key ) ; $i < $count ; $i++ ) {
+        my $record = substr( $$map, $header_size + $i * $record_size,
+            $record_size );
+        last if substr( $record, 0, $key_size ) ne $key;
+
+        my ( undef, undef, undef, $var, $val ) = unpack( $record_fmt, $record );
+        $var =~ s/\0+$//;
+        $stats{$var} = $val;
+    }
+    return %stats;
+}
+
+# Atomically replace the baselines of the interfaces, given as a hash of
+# interface name to dataplane id to kind to hash of counter name to value,
+# or to undef to delete them. Creating the store first imports the per
+# interface text files of the previous releases.
+sub clear_stats_update {
+    my $updates = shift;
+    my %replace = ();
+    my @records = ();
+    my @migrated;
+
+    mkdir $legacy_dir unless ( -d $legacy_dir );
+
+    open( my $lock, '>>', "$store.lock" )
+      or die "Couldn't open $store.lock [$!]\n";
+    flock( $lock, LOCK_EX )
+      or die "Couldn't lock $store.lock [$!]\n";
+
+    foreach my $ifname ( keys %$updates ) {
+        foreach my $dp_id ( keys %{ $updates->{$ifname} } ) {
+            foreach my $which ( keys %{ $updates->{$ifname}->{$dp_id} } ) {
+                $replace{ _key( $ifname, $dp_id, $which ) } = 1;
+
+                my $stats = $updates->{$ifname}->{$dp_id}->{$which};
+                next unless defined($stats);
+
+                foreach my $var ( keys %$stats ) {
+                    push @records,
+                      _record( $ifname, $dp_id, $which, $var,
+                        $stats->{$var} );
+                }
+            }
+        }
+    }
+
+    if ( -e $store ) {
+        my ( $map, $count ) = _map_store();
+        if ( defined($map) ) {
+            for my $i ( 0 .. $count - 1 ) {
+                my $record = substr( $$map, $header_size + $i * $record_size,
+                    $record_size );
+                push @records, $record
+                  unless $replace{ substr( $record, 0, $key_size ) };
+            }
+        }
+    } else {
+        opendir( my $dir, $legacy_dir )
+          or die "Couldn't open $legacy_dir [$!]\n";
+        foreach my $name ( readdir($dir) ) {
+            my ( $ifname, $dp_id, $which ) = $name =~ /^(.+)\.dp(\d+)\.(\w+)$/
+              or next;
+
+            my $stats = _read_legacy("$legacy_dir/$name");
+            next unless defined($stats);
+
+            push @migrated, "$legacy_dir/$name";
+            next if $replace{ _key( $ifname, $dp_id, $which ) };
+
+            foreach my $var ( keys %$stats ) {
+                push @records,
+                  _record( $ifname, $dp_id, $which, $var, $stats->{$var} );
+            }
+        }
+        closedir($dir);
+    }
+
+    @records = sort @records;
+
+    my ( $f, $tmp ) = tempfile( '.clear-statsXXXXXX', DIR => $legacy_dir );
+    binmode($f);
+    print $f pack( $header_fmt, $magic, $record_size, scalar(@records) ),
+      @records;
+    close($f)
+      or die "Couldn't write $tmp [$!]\n";
+    chmod 0664, $tmp;
+    rename( $tmp, $store )
+      or die "Couldn't rename $tmp to $store [$!]\n";
+
+    unlink @migrated;
+    close($lock);
+}
+
+1;
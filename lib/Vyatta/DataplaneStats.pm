@@ -24,6 +24,7 @@ use Time::Duration;
 use Time::HiRes qw( clock_gettime CLOCK_REALTIME );
 use Vyatta::Misc;
 use Vyatta::Dataplane;
+use Vyatta::DataplaneClearStats qw(clear_stats_get clear_stats_update);
 use Vyatta::PCIid;
 use Vyatta::Interface;
 use Vyatta::InterfaceStats;
@@ -62,20 +63,16 @@ my @perf_counters = (
     { tag => 'tx_bps', display => '         bits/sec' },
 );
 
-my $clear_stats_dir  = '/var/run/vyatta';
-my $clear_file_magic = 'XYZZYX';
-
 my $dp_ids;
 my $dp_conns;
 
-sub get_intf_statsfile {
-    my $intf  = shift;
-    my $dp_id = shift;
-    my $which = shift;
+# Baselines of the interfaces cleared by clear_dataplane_interfaces(), saved
+# all at once when they are all cleared
+my $pending_clear;
 
-    $which = "stats" if !defined($which);
-    return "$clear_stats_dir/$intf.dp$dp_id.$which";
-}
+# From this many interfaces on, fetch all the interfaces of each dataplane
+# with a single ifconfig instead of one ifconfig per interface
+my $BULK_IFCONFIG = 8;
 
 sub get_dataplane_clear_stats {
     my $intf   = shift;
@@ -83,42 +80,27 @@ sub get_dataplane_clear_stats {
     my $ifstat = shift;
     my $which  = shift;
 
-    my %stats = ();
-    my $filename = get_intf_statsfile( $intf, $dp_id, $which );
-
-    open( my $f, '<', $filename )
-      or return %stats;
+    $which = "stats" if !defined($which);
 
-    my $magic = <$f>;
-    chomp $magic;
-    if ( $magic ne $clear_file_magic ) {
-        print "bad magic [$intf]\n";
-        close($f);
-        unlink $filename;
-        return %stats;
-    }
+    my %stats = clear_stats_get( $intf, $dp_id, $which );
 
-    while (<$f>) {
-        chop;
-        my ( $var, $val ) = split(/,/);
+    foreach my $var ( keys %stats ) {
+        my $val = $stats{$var};
 
         # sanity check: if unknown stats field is in the clear file,
         # or clear value is greater than current one then don't trust the file,
         # shouldn't need to worry about wrap with 64bit counters
         # skip qstats, they are in clear file for future use.
+        # The baseline is ignored, not removed, as show runs unprivileged:
+        # the next clear replaces it.
 
         if (($var !~ 'q([0-9]|[1-9][0-9]+)_\w+') &&
             (!defined( $ifstat->{$var} ) ||
              ($val > $ifstat->{$var} ))) {
             print "bad stat [$var, $intf]\n";
-            close($f);
-            unlink $filename;
             return ();
         }
-
-        $stats{$var} = $val;
     }
-    close($f);
     return %stats;
 }
 
@@ -146,15 +128,11 @@ sub clear_interface_for_vplane {
     my $statistics = shift;
     my $which      = shift;
 
-    my $filename = get_intf_statsfile( $ifname, $dp_id, $which );
-
-    mkdir $clear_stats_dir unless ( -d $clear_stats_dir );
+    my %clear = ();
 
-    open( my $f, '>', $filename )
-      or die "Couldn't open $filename [$!]\n";
+    $which = "stats" if !defined($which);
 
     print "Clearing $ifname (dataplane)\n";
-    print $f $clear_file_magic, "\n";
 
     if ( defined $statistics ) {
 
@@ -165,7 +143,7 @@ sub clear_interface_for_vplane {
             next unless defined($val);
             next if ( $val eq 0 && $st->{hide} );
 
-            print $f $var, ",", $val, "\n";
+            $clear{$var} = $val;
         }
     } else {
 
@@ -175,7 +153,7 @@ sub clear_interface_for_vplane {
             next unless defined($val);
             next if ( ( $key =~ '^[tr]x_[pb]ps' ) || ( $key =~ '^qstats' ) );
 
-            print $f $key, ",", $val, "\n";
+            $clear{$key} = $val;
         }
 
         # Clear qstats
@@ -185,13 +163,18 @@ sub clear_interface_for_vplane {
                 my $val = $qstat->{$key};
                 next unless defined($val);
                 next if ( $val eq 0 );
-                print $f "q", $qid, "_", $key, ",", $val, "\n";
+                $clear{"q${qid}_$key"} = $val;
             }
             $qid++;
         }
     }
 
-    close($f);
+    if ( defined($pending_clear) ) {
+        $pending_clear->{$ifname}->{$dp_id}->{$which} = \%clear;
+    } else {
+        clear_stats_update(
+            { $ifname => { $dp_id => { $which => \%clear } } } );
+    }
 }
 
 sub show_interface_platform_state {
@@ -552,14 +535,63 @@ sub show_interface_stats {
     }
 }
 
+# Get the response of each dataplane to the command for the interfaces,
+# returned as a hash of interface name to array of interface info indexed
+# by dataplane id. If a dataplane answers the bulk ifconfig with an error,
+# e.g. as it only knows ifconfig for a single interface, the interfaces are
+# asked for one at a time instead.
+sub get_dataplane_interfaces {
+    my ( $intf_list_ref, $vplane_cmd, $dp_ids, $dp_conns ) = @_;
+    my %results;
+
+    my $response;
+    if ( $vplane_cmd eq 'ifconfig' && @{$intf_list_ref} >= $BULK_IFCONFIG ) {
+        $response =
+          eval { vplane_exec_cmd_parallel( $vplane_cmd, $dp_ids, $dp_conns ) };
+    }
+    if ( defined($response) ) {
+        my %wanted = map { $_ => 1 } @{$intf_list_ref};
+
+        for my $dp_id ( @{$dp_ids} ) {
+            next unless defined( $response->[$dp_id] );
+
+            my $decoded = decode_json( $response->[$dp_id] );
+            foreach my $ifinfo ( @{ $decoded->{interfaces} } ) {
+                next unless $wanted{ $ifinfo->{name} };
+
+                $results{ $ifinfo->{name} }->[$dp_id] = $ifinfo;
+            }
+        }
+        return \%results;
+    }
+
+    foreach my $ifname ( @{$intf_list_ref} ) {
+        $response =
+          vplane_exec_cmd_parallel( "$vplane_cmd $ifname", $dp_ids,
+            $dp_conns );
+
+        for my $dp_id ( @{$dp_ids} ) {
+            next unless defined( $response->[$dp_id] );
+
+            my $decoded = decode_json( $response->[$dp_id] );
+            my $ifinfo  = $decoded->{interfaces}->[0];
+            next unless defined($ifinfo);
+
+            $results{$ifname}->[$dp_id] = $ifinfo;
+        }
+    }
+    return \%results;
+}
+
 sub iterate_dataplanes {
     my ( $intf_list_ref, $func, $vplane_cmd ) = @_;
 
-    my @intf_list = @{$intf_list_ref};
+    my @intfs = ();
+    my %seen;
 
-    ( $dp_ids, $dp_conns ) = Vyatta::Dataplane::setup_fabric_conns();
+    foreach my $ifname ( @{$intf_list_ref} ) {
+        next if $seen{$ifname}++;
 
-    foreach my $ifname (@intf_list) {
         my $intf = new Vyatta::Interface($ifname);
         die "$ifname is not a known interface\n"
           unless defined($intf);
@@ -567,24 +599,22 @@ sub iterate_dataplanes {
         die "$ifname is not a valid dataplane interface\n"
           unless defined( $intf->dpid() );
 
-        my $response =
-          vplane_exec_cmd( "$vplane_cmd $ifname", $dp_ids, $dp_conns, 1 );
-        my @results;
+        push @intfs, $intf;
+    }
 
-        for my $dp_id ( @{$dp_ids} ) {
-            next unless defined( $response->[$dp_id] );
+    ( $dp_ids, $dp_conns ) = Vyatta::Dataplane::setup_fabric_conns();
 
-            my $decoded = decode_json( $response->[$dp_id] );
-            my $ifinfo  = $decoded->{interfaces}->[0];
-            next unless defined($ifinfo);
+    my @intf_list = map { $_->{name} } @intfs;
+    my $results =
+      get_dataplane_interfaces( \@intf_list, $vplane_cmd, $dp_ids, $dp_conns );
 
-            $results[$dp_id] = $ifinfo;
-        }
+    foreach my $intf (@intfs) {
+        my $ifname = $intf->{name};
 
         die "interface $ifname does not exist on system\n"
-          if ( $#results < 0 );
+          unless defined( $results->{$ifname} );
 
-        &$func( \@results, $intf, ${$dp_conns}[0] );
+        &$func( $results->{$ifname}, $intf, ${$dp_conns}[0] );
     }
 
     Vyatta::Dataplane::close_fabric_conns( $dp_ids, $dp_conns );
@@ -594,7 +624,17 @@ sub iterate_dataplanes {
 sub clear_dataplane_interfaces {
     my $intf_list_ref = shift;
 
-    &iterate_dataplanes( $intf_list_ref, \&clear_interface, "ifconfig" );
+    $pending_clear = {};
+    eval {
+        &iterate_dataplanes( $intf_list_ref, \&clear_interface, "ifconfig" );
+    };
+    my $err     = $@;
+    my $cleared = $pending_clear;
+    $pending_clear = undef;
+
+    # Save the interfaces cleared before any error
+    clear_stats_update($cleared) if %$cleared;
+    die $err if $err;
 }
 
 sub show_dataplane_interfaces {
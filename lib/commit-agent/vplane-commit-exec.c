@@ -0,0 +1,204 @@
+/*
+ * Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+ *
+ * SPDX-License-Identifier: LGPL-2.1-only
+ *
+ * Thin entry point of the configd scripts: "vplane-commit-exec SCRIPT ARGS"
+ * hands SCRIPT, its arguments, the environment (COMMIT_ACTION and the
+ * configd session included), the working directory, the umask and the
+ * standard input, output and error of the caller to the resident commit
+ * agent, vplaned.commitagent, which runs the script in a process forked
+ * from it with its modules already imported. The script writes to the
+ * caller's output directly, and the exit status of the script is the exit
+ * status of vplane-commit-exec.
+ *
+ * When the agent is not running, or does not serve the script, the script
+ * is executed as if vplane-commit-exec was not there.
+ */
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/un.h>
+#include <unistd.h>
+
+#define AGENT_SOCKET "/var/run/vyatta/vplane-commit-agent.socket"
+#define AGENT_SOCKET_ENV "VPLANE_COMMIT_AGENT_SOCKET"
+
+/* Status the agent replies for the scripts it does not run */
+#define NOT_SERVED (-1)
+
+extern char **environ;
+
+struct request_header {
+	uint32_t argc;
+	uint32_t envc;
+	uint32_t umask;
+};
+
+struct buffer {
+	char *data;
+	size_t len;
+	size_t size;
+};
+
+static void __attribute__((noreturn)) exec_script(char **argv)
+{
+	execvp(argv[0], argv);
+	fprintf(stderr, "vplane-commit-exec: %s: %s\n", argv[0],
+		strerror(errno));
+	exit(errno == ENOENT ? 127 : 126);
+}
+
+static int append(struct buffer *buf, const void *data, size_t len)
+{
+	if (buf->len + len > buf->size) {
+		size_t size = (buf->size + len) * 2;
+		char *p = realloc(buf->data, size);
+
+		if (!p)
+			return -1;
+		buf->data = p;
+		buf->size = size;
+	}
+	memcpy(buf->data + buf->len, data, len);
+	buf->len += len;
+	return 0;
+}
+
+static int append_string(struct buffer *buf, const char *s)
+{
+	return append(buf, s, strlen(s) + 1);
+}
+
+/*
+ * The request: its header, then the working directory, the arguments and
+ * the environment as NUL terminated strings
+ */
+static int build_request(struct buffer *buf, char **argv)
+{
+	struct request_header header = { 0, 0, 0 };
+	char cwd[PATH_MAX];
+	mode_t mask;
+	char **p;
+
+	if (!getcwd(cwd, sizeof(cwd)))
+		return -1;
+	for (p = argv; *p; p++)
+		header.argc++;
+	for (p = environ; *p; p++)
+		header.envc++;
+	mask = umask(0);
+	umask(mask);
+	header.umask = mask;
+
+	if (append(buf, &header, sizeof(header)) < 0 ||
+	    append_string(buf, cwd) < 0)
+		return -1;
+	for (p = argv; *p; p++)
+		if (append_string(buf, *p) < 0)
+			return -1;
+	for (p = environ; *p; p++)
+		if (append_string(buf, *p) < 0)
+			return -1;
+	return 0;
+}
+
+static int connect_agent(void)
+{
+	struct sockaddr_un addr = { .sun_family = AF_UNIX };
+	const char *path = getenv(AGENT_SOCKET_ENV);
+	int sock;
+
+	if (!path)
+		path = AGENT_SOCKET;
+	if (strlen(path) >= sizeof(addr.sun_path))
+		return -1;
+	strcpy(addr.sun_path, path);
+
+	sock = socket(AF_UNIX, SOCK_SEQPACKET | SOCK_CLOEXEC, 0);
+	if (sock < 0)
+		return -1;
+	if (connect(sock, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+		close(sock);
+		return -1;
+	}
+	return sock;
+}
+
+/* Send the request with the standard descriptors, in a single message */
+static int send_request(int sock, const struct buffer *buf)
+{
+	int fds[3] = { STDIN_FILENO, STDOUT_FILENO, STDERR_FILENO };
+	char control[CMSG_SPACE(sizeof(fds))];
+	struct iovec iov = { .iov_base = buf->data, .iov_len = buf->len };
+	struct msghdr msg = {
+		.msg_iov = &iov,
+		.msg_iovlen = 1,
+		.msg_control = control,
+		.msg_controllen = sizeof(control),
+	};
+	struct cmsghdr *cmsg;
+	ssize_t rc;
+
+	memset(control, 0, sizeof(control));
+	cmsg = CMSG_FIRSTHDR(&msg);
+	cmsg->cmsg_level = SOL_SOCKET;
+	cmsg->cmsg_type = SCM_RIGHTS;
+	cmsg->cmsg_len = CMSG_LEN(sizeof(fds));
+	memcpy(CMSG_DATA(cmsg), fds, sizeof(fds));
+
+	do {
+		rc = sendmsg(sock, &msg, MSG_NOSIGNAL);
+	} while (rc < 0 && errno == EINTR);
+	return rc == (ssize_t)buf->len ? 0 : -1;
+}
+
+int main(int argc, char **argv)
+{
+	struct buffer buf = { NULL, 0, 0 };
+	int32_t status;
+	ssize_t rc;
+	int sock;
+	int fd;
+
+	if (argc < 2) {
+		fprintf(stderr, "usage: vplane-commit-exec SCRIPT [ARGS...]\n");
+		return 2;
+	}
+	argv++;
+
+	/* Closed standard descriptors are passed as /dev/null */
+	for (fd = STDIN_FILENO; fd <= STDERR_FILENO; fd++)
+		if (fcntl(fd, F_GETFD) < 0 && open("/dev/null", O_RDWR) != fd)
+			exec_script(argv);
+
+	sock = connect_agent();
+	if (sock < 0)
+		exec_script(argv);
+	if (build_request(&buf, argv) < 0 || send_request(sock, &buf) < 0) {
+		close(sock);
+		exec_script(argv);
+	}
+	free(buf.data);
+
+	do {
+		rc = recv(sock, &status, sizeof(status), 0);
+	} while (rc < 0 && errno == EINTR);
+	close(sock);
+
+	if (rc != sizeof(status)) {
+		/* The script may have run, so it is not run again */
+		fprintf(stderr, "vplane-commit-exec: %s: no status from the "
+			"commit agent\n", argv[0]);
+		return 1;
+	}
+	if (status == NOT_SERVED)
+		exec_script(argv);
+	return status;
+}
@@ -0,0 +1,289 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""asyncio flavour of the Python3 vplane-controller API.
+
+This module exports AsyncController and AsyncDataplane, which mirror
+Controller and Dataplane with coroutines in place of blocking calls.
+Requests are sent on DEALER sockets and tagged with a request id, so any
+number of commands can be in flight on the same connection, and on as many
+dataplanes as needed, at the same time. Example:
+
+import asyncio
+from vplaned.aio import AsyncController
+
+async def main():
+    async with AsyncController() as controller:
+        async for dp in controller.get_dataplanes():
+            async with dp:
+                flows, stats = await asyncio.gather(
+                    dp.json_command("netflow show"),
+                    dp.json_command("ifconfig dp0s3"))
+
+asyncio.run(main())
+
+In case of errors with the controller or dataplane runtime commands,
+ControllerException or DataplaneException will be raised respectively.
+A request that is not answered within the timeout (in milliseconds, as the
+blocking API's RCVTIMEO) raises zmq.Again.
+
+AsyncController.subscribe() returns an AsyncSubscription to events, see
+vplaned.events:
+
+async with controller.subscribe(["link"]) as events:
+    async for event in events:
+        print(event.topic, event.json())
+"""
+import asyncio
+import itertools
+import json
+import struct
+import zmq
+import zmq.asyncio
+
+from vplaned.events import (EVENTS_ENDPOINT, SNAPSHOT_ENDPOINT, Event,
+                            Subscription, _decode)
+from vplaned.vplaned import (ControllerException, Dataplane,
+                             DataplaneException, _LOCAL_CONTROL,
+                             _dataplane_envelope, _open_envelope,
+                             _store_leaf, _to_tree)
+
+
+class _Channel:
+
+    """DEALER socket multiplexing requests to one endpoint. Every request is
+    prefixed with a request id frame and an empty delimiter, which REP and
+    ROUTER servers echo back, so replies are matched to their request
+    whatever order they arrive in."""
+
+    def __init__(self, ctx, endpoint, timeout):
+        self._sock = ctx.socket(zmq.DEALER)
+        self._sock.connect(endpoint)
+        self._timeout = timeout / 1000
+        self._ids = itertools.count()
+        self._pending = {}
+        self._reader = None
+
+    async def request(self, *frames):
+        """Send the request frames, and return the reply frames"""
+        reqid = struct.pack("!I", next(self._ids) & 0xffffffff)
+        reply = asyncio.get_running_loop().create_future()
+        self._pending[reqid] = reply
+        if self._reader is None:
+            self._reader = asyncio.ensure_future(self._read())
+        try:
+            await self._sock.send_multipart([reqid, b""] + list(frames))
+            return await asyncio.wait_for(reply, self._timeout)
+        except asyncio.TimeoutError:
+            raise zmq.Again()
+        finally:
+            del self._pending[reqid]
+
+    async def _read(self):
+        while True:
+            frames = await self._sock.recv_multipart()
+            # Replies to requests which already timed out are dropped
+            reply = self._pending.get(frames[0])
+            if reply is not None and not reply.done():
+                reply.set_result(frames[2:])
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        self._sock.close()
+
+
+class AsyncDataplane(Dataplane):
+
+    """Dataplane object with coroutine commands. Generated by
+    AsyncController.get_dataplanes(), and holds the same attributes as a
+    Dataplane.
+
+    Implements asynchronous ContextManager pattern, so use through
+    "async with" statement."""
+
+    def __init__(self, ctx, json, timeout=10000):
+        super().__init__(ctx, json)
+        self._timeout = timeout
+        self._channel = None
+
+    def __enter__(self):
+        raise TypeError("AsyncDataplane must be used through \"async with\"")
+
+    async def __aenter__(self):
+        self._channel = _Channel(self._ctx,
+                                 getattr(self, "control", _LOCAL_CONTROL),
+                                 self._timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._channel.close()
+
+    async def _command(self, string):
+        rc, *reply = await self._channel.request(string.encode())
+        if rc != b"OK":
+            raise DataplaneException("Command {} returned {}".format(
+                string, rc.decode()))
+
+        return reply[0]
+
+    async def string_command(self, string):
+        """send a command and return the dataplane response as a string"""
+        return (await self._command(string)).decode()
+
+    async def json_command(self, string):
+        """send a command and return the dataplane response as a json object"""
+        return json.loads(await self._command(string))
+
+    async def pb_command(self, msg_type, msg, reply=None):
+        """send a protobuf command and return the message of the reply
+        envelope. Same arguments as Dataplane.pb_command()."""
+        frames = await self._channel.request(
+            b"protobuf", _dataplane_envelope(msg_type, msg))
+        return _open_envelope(frames[0], reply)
+
+
+class AsyncSubscription(Subscription):
+
+    """Subscription with coroutine methods and an asynchronous iterator.
+    Created through AsyncController.subscribe(), and used through
+    "async with" statement."""
+
+    def __enter__(self):
+        raise TypeError(
+            "AsyncSubscription must be used through \"async with\"")
+
+    async def __aenter__(self):
+        self._connect()
+        self._channel = None
+        if self._snapshot_endpoint is not None:
+            self._channel = _Channel(self._ctx, self._snapshot_endpoint,
+                                     self._timeout)
+        if self._initial:
+            self._pending.extend(await self._resync(self._topics or [""]))
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._channel is not None:
+            self._channel.close()
+        super().__exit__(*exc)
+
+    async def _snapshot(self, topic):
+        return self._sequencer.resynced(
+            await self._channel.request(b"SNAPSHOT", topic.encode()))
+
+    async def _resync(self, topics):
+        restarts = self._sequencer.restarts
+        events = []
+        for topic in topics:
+            events += await self._snapshot(topic)
+            if self._sequencer.restarts != restarts:
+                return await self._resync(self._topics or [""])
+        return events
+
+    async def recv(self, timeout=None):
+        """Next event, or None if none came within timeout seconds (forever
+        if None)"""
+        while not self._pending:
+            try:
+                frames = await asyncio.wait_for(self._sock.recv_multipart(),
+                                                timeout)
+            except asyncio.TimeoutError:
+                return None
+            topic, epoch, seq, body = _decode(frames)
+            status = self._sequencer.check(topic, epoch, seq)
+            if status == "stale":
+                continue
+            event = Event(topic, seq, body, False)
+            if status == "event" or self._channel is None:
+                return event
+            self._pending.append(event)
+            self._pending.extend(await self._resync(
+                [topic] if status == "gap" else self._topics or [""]))
+        return self._pending.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.recv()
+
+
+class AsyncController:
+
+    """Controller object with coroutine methods. Can be used to generate
+    AsyncDataplane objects or to store config.
+    Implements asynchronous ContextManager pattern, so use through
+    "async with" statement.
+    """
+
+    def __init__(self, store_endpoint="ipc:///var/run/vyatta/vplaned.socket",
+                 cfg_endpoint="ipc:///var/run/vyatta/vplaned-config.socket",
+                 timeout=10000):
+        self._ctx = None
+        self._store_channel = None
+        self._cfg_channel = None
+        self._store_endpoint = store_endpoint
+        self._cfg_endpoint = cfg_endpoint
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        self._ctx = zmq.asyncio.Context.instance()
+        self._ctx.IPV6 = 1
+        # All messages are ACK'ed so no need to wait when the socket is closed
+        self._ctx.LINGER = 0
+        self._store_channel = _Channel(self._ctx, self._store_endpoint,
+                                       self._timeout)
+        self._cfg_channel = _Channel(self._ctx, self._cfg_endpoint,
+                                     self._timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._store_channel.close()
+        self._cfg_channel.close()
+
+    async def get_dataplanes(self):
+        """Asynchronous generator for dataplanes. Will fetch info from the
+        controller about all dataplanes, and create an object each and yield
+        it.
+        """
+        rc, *reply = await self._cfg_channel.request(b"GETVPCONFIG")
+        if rc != b"OK":
+            raise ControllerException("GETVPCONFIG returned {}".format(
+                rc.decode()))
+
+        config = json.loads(reply[0]) if reply else None
+        if config is None:
+            raise ControllerException("GETVPCONFIG returned empty response")
+
+        for dp in config["dataplanes"]:
+            yield AsyncDataplane(self._ctx, dp, self._timeout)
+
+    async def store(self, path, cmd, interface="ALL",
+                    action=None, cmd_name=None):
+        """Send command to dataplane(s) and store it, associated with the path.
+        Same arguments as Controller.store().
+        """
+        leaf = _store_leaf(path, cmd, interface, action, cmd_name)
+        msg = _to_tree([(path, cmd, leaf)])
+        rc, *_ = await self._store_channel.request(json.dumps(msg).encode())
+        if rc != b"OK":
+            raise ControllerException("Config {} returned {}".format(
+                msg, rc.decode()))
+
+    def subscribe(self, topics, endpoint=EVENTS_ENDPOINT,
+                  snapshot_endpoint=SNAPSHOT_ENDPOINT, queue_size=1000,
+                  snapshot=False):
+        """AsyncSubscription to the events of topics. Same arguments as
+        Controller.subscribe()."""
+        return AsyncSubscription(self._ctx, topics, endpoint,
+                                 snapshot_endpoint, queue_size, snapshot,
+                                 self._timeout)
+
+    async def config(self, cmd):
+        frames = [part if isinstance(part, bytes) else part.encode()
+                  for part in cmd]
+        rc, *_ = await self._cfg_channel.request(*frames)
+        if rc != b"OK":
+            raise ControllerException("Config cmd returned {}".format(
+                rc.decode()))
@@ -0,0 +1,216 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Store of the dataplane interface counters baselines taken by "clear".
+
+The baselines of all the interfaces live in a single binary file, shared
+with the Vyatta::DataplaneClearStats perl module. It holds a header followed
+by fixed width records, one per (interface, dataplane id, kind, counter),
+sorted on their bytes so that the baselines of an interface are found with a
+binary search of the memory mapped file. Example:
+
+from vplaned.clearstats import ClearStats, update
+
+with ClearStats() as baselines:
+    baseline = baselines.get("dp0s3", 0)
+    rx_packets = ifstat["rx_packets"] - baseline.get("rx_packets", 0)
+
+update({("dp0s3", 0, "stats"): {"rx_packets": 42}})
+
+Updates rewrite the file and rename it over the old one, so readers always
+see a complete store. The one text file per interface and dataplane of the
+previous releases is migrated into the store when it is first written.
+"""
+import fcntl
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+STORE = "/var/run/vyatta/dataplane-clear-stats"
+LEGACY_DIR = "/var/run/vyatta"
+
+MAGIC = b"VCLRSTS1"
+LEGACY_MAGIC = "XYZZYX"
+
+# magic, record size, record count
+_HEADER = struct.Struct(">8sII")
+# interface, dataplane id, kind (e.g. "stats"), counter, value; the big
+# endian dataplane id keeps the records in (interface, dataplane id) order
+_RECORD = struct.Struct(">32sI16s36sQ")
+# bytes of the record identifying the baselines of an interface
+_KEY_SIZE = 32 + 4 + 16
+
+_LEGACY_NAME = re.compile(r"^(.+)\.dp(\d+)\.(\w+)$")
+
+
+class ClearStatsException(Exception):
+    pass
+
+
+def _key(ifname, dp_id, which):
+    return _RECORD.pack(ifname.encode(), dp_id, which.encode(), b"",
+                        0)[:_KEY_SIZE]
+
+
+def _records(baselines):
+    """Packed records of the {(ifname, dp_id, which): {counter: value}}"""
+    for (ifname, dp_id, which), counters in baselines.items():
+        for counter, value in counters.items():
+            name = counter.encode()
+            if len(name) > 36:
+                raise ClearStatsException(
+                    "counter name too long: {}".format(counter))
+            yield _RECORD.pack(ifname.encode(), int(dp_id), which.encode(),
+                               name, int(value))
+
+
+class ClearStats:
+
+    """Read only view of the baselines store, memory mapped. Implements the
+    ContextManager pattern."""
+
+    def __init__(self, path=STORE):
+        self._mm = None
+        self._count = 0
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        except FileNotFoundError:
+            return
+        if self._mm is None or len(self._mm) < _HEADER.size:
+            raise ClearStatsException("truncated store {}".format(path))
+        magic, size, count = _HEADER.unpack_from(self._mm)
+        if magic != MAGIC or size != _RECORD.size or \
+                len(self._mm) < _HEADER.size + count * size:
+            raise ClearStatsException("bad store {}".format(path))
+        self._count = count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _offset(self, index):
+        return _HEADER.size + index * _RECORD.size
+
+    def _search(self, key):
+        """Index of the first record not below key"""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self._offset(mid)
+            if self._mm[offset:offset + _KEY_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, ifname, dp_id, which="stats"):
+        """Baselines of the interface on the dataplane, as a dict of counter
+        name to value; empty if the interface was never cleared"""
+        key = _key(ifname, dp_id, which)
+        counters = {}
+        for index in range(self._search(key), self._count):
+            offset = self._offset(index)
+            if self._mm[offset:offset + _KEY_SIZE] != key:
+                break
+            _, _, _, counter, value = _RECORD.unpack_from(self._mm, offset)
+            counters[counter.rstrip(b"\0").decode()] = value
+        return counters
+
+    def items(self):
+        """Iterate over ((ifname, dp_id, which), {counter: value})"""
+        current, counters = None, None
+        for index in range(self._count):
+            ifname, dp_id, which, counter, value = _RECORD.unpack_from(
+                self._mm, self._offset(index))
+            key = (ifname.rstrip(b"\0").decode(), dp_id,
+                   which.rstrip(b"\0").decode())
+            if key != current:
+                if current is not None:
+                    yield current, counters
+                current, counters = key, {}
+            counters[counter.rstrip(b"\0").decode()] = value
+        if current is not None:
+            yield current, counters
+
+
+def read_legacy(filename):
+    """Counters of a per-interface text file, None if it is not one"""
+    counters = {}
+    try:
+        with open(filename) as f:
+            if f.readline().rstrip("\n") != LEGACY_MAGIC:
+                return None
+            for line in f:
+                counter, value = line.rstrip("\n").split(",")
+                counters[counter] = int(value)
+    except (OSError, UnicodeDecodeError, ValueError):
+        return None
+    return counters
+
+
+def update(baselines, path=STORE, legacy_dir=LEGACY_DIR):
+    """Atomically replace the baselines of the (ifname, dp_id, which) keys of
+    baselines by their {counter: value}, or delete them where it is None.
+    Creating the store first imports the per-interface text files found in
+    legacy_dir, which are removed once the store is written."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        migrated = []
+        merged = {}
+        if os.path.exists(path):
+            # a damaged store is replaced, as the text files used to be
+            try:
+                with ClearStats(path) as store:
+                    merged.update(store.items())
+            except ClearStatsException:
+                pass
+        elif legacy_dir is not None and os.path.isdir(legacy_dir):
+            for name in os.listdir(legacy_dir):
+                match = _LEGACY_NAME.match(name)
+                if not match:
+                    continue
+                filename = os.path.join(legacy_dir, name)
+                counters = read_legacy(filename)
+                if counters is None:
+                    continue
+                key = (match.group(1), int(match.group(2)), match.group(3))
+                merged[key] = counters
+                migrated.append(filename)
+
+        for key, counters in baselines.items():
+            if counters is None:
+                merged.pop(key, None)
+            else:
+                merged[key] = counters
+
+        records = sorted(_records(merged))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".clear-stats")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, _RECORD.size, len(records)))
+                f.writelines(records)
+            os.chmod(tmp, 0o664)
+            os.rename(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        for filename in migrated:
+            os.unlink(filename)
@@ -0,0 +1,405 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Resident agent running the configd scripts of the dataplane.
+
+Each configuration node a commit changes runs a script, which used to start
+an interpreter and import zmq, the protobuf modules, vyatta.configd and
+vplaned for a few milliseconds of work. The agent imports these modules
+once and serves a unix socket, to which vplane-commit-exec, the entry point
+the nodes call, sends the script, its arguments, environment, working
+directory and umask, with its standard input, output and error. For each
+request the agent forks, the child runs the script as __main__ on the
+descriptors of the caller, and the agent replies the exit status of the
+child. The compiled scripts are cached by the agent as well.
+
+Every script runs in a new process, so nothing a script does is seen by the
+next one; the zmq and configd connections are opened by each script as
+before, as they cannot be shared across a fork. Only python3 scripts of the
+script directories are run, and only for clients of the user of the agent.
+Other requests are answered NOT_SERVED and the entry point executes the
+script itself, as it does when the agent is not running. Example:
+
+from vplaned.commitagent import CommitAgent, run
+
+CommitAgent().serve()
+...
+status = run(["/opt/vyatta/sbin/vplane-storm-control", "--action", "SET",
+              "--update", "x"],
+             env=dict(os.environ, COMMIT_ACTION="SET"))
+
+On SIGTERM the agent stops accepting requests, waits for the scripts
+running, then returns. In the children, serve() raises SystemExit with the
+exit status of the script instead, which the caller must let through for
+the interpreter to shut down as at the end of the script: waiting for its
+threads, running its exit functions and flushing its output.
+"""
+import builtins
+import gc
+import importlib
+import os
+import pkgutil
+import re
+import selectors
+import shutil
+import signal
+import socket
+import struct
+import sys
+import traceback
+import types
+
+SOCKET = "/var/run/vyatta/vplane-commit-agent.socket"
+SCRIPT_DIRS = ["/opt/vyatta/sbin", "/opt/vyatta/bin"]
+# Modules of the configd scripts imported by the agent, along with all the
+# modules of PROTO_PACKAGE
+PRELOAD = ["argparse", "getopt", "json", "logging", "subprocess", "zmq",
+           "google.protobuf.message", "vyatta.configd", "vplaned",
+           "vplaned.reconcile"]
+PROTO_PACKAGE = "vyatta.proto"
+
+# Exit status replied for the requests the agent does not run
+NOT_SERVED = -1
+
+# argument count, environment variable count, umask; then the working
+# directory, the arguments and the environment as NUL terminated strings
+_HEADER = struct.Struct("=III")
+_STATUS = struct.Struct("=i")
+_MAX_REQUEST = 1 << 18
+_PYTHON3 = re.compile(rb"#![ \t]*\S*(?:/python3|/env[ \t]+python3)\b")
+
+
+class CommitAgentException(Exception):
+    pass
+
+
+def _pack_request(argv, env, cwd, umask):
+    strings = [cwd] + list(argv) + \
+        ["{}={}".format(key, value) for key, value in env.items()]
+    return _HEADER.pack(len(argv), len(env), umask) + \
+        b"".join(os.fsencode(s) + b"\0" for s in strings)
+
+
+def _unpack_request(data):
+    """(argv, env, cwd, umask) of a request"""
+    argc, envc, umask = _HEADER.unpack_from(data)
+    strings = [os.fsdecode(s) for s in data[_HEADER.size:].split(b"\0")]
+    if argc < 1 or len(strings) != argc + envc + 2 or strings[-1]:
+        raise ValueError("malformed request")
+    env = dict(s.split("=", 1) for s in strings[argc + 1:-1] if "=" in s)
+    return strings[1:argc + 1], env, strings[0], umask
+
+
+def run(argv, env=None, cwd=None, fds=(0, 1, 2), path=SOCKET):
+    """Run a script through the agent serving path, as vplane-commit-exec
+    does, on the given standard input, output and error descriptors. Return
+    its exit status, or None if the agent is not running or does not serve
+    the script."""
+    env = os.environ if env is None else env
+    cwd = os.getcwd() if cwd is None else cwd
+    umask = os.umask(0)
+    os.umask(umask)
+    request = _pack_request(argv, env, cwd, umask)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as sock:
+        try:
+            sock.connect(path)
+            socket.send_fds(sock, [request], list(fds))
+        except OSError:
+            return None
+        reply = sock.recv(_STATUS.size)
+    if len(reply) != _STATUS.size:
+        raise CommitAgentException("no status from the commit agent")
+    status = _STATUS.unpack(reply)[0]
+    return None if status == NOT_SERVED else status
+
+
+class CommitAgent:
+
+    """Runs the scripts requested on the unix socket at path in processes
+    forked from it, once it has imported the preload modules"""
+
+    def __init__(self, path=SOCKET, script_dirs=SCRIPT_DIRS, preload=PRELOAD):
+        self.path = path
+        self.script_dirs = {os.path.realpath(d) for d in script_dirs}
+        self.preload = preload
+        # path -> ((mtime, size), code object, None if not served)
+        self._code = {}
+        # pid -> connection of the client, for each running script
+        self._children = {}
+        self._selector = None
+        self._listener = None
+        self._wakeup = ()
+        self._stopping = False
+
+    def import_modules(self):
+        """Import the preload modules, and return the names of those which
+        could not be imported"""
+        missing = []
+        for name in self.preload:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                missing.append(name)
+        try:
+            package = importlib.import_module(PROTO_PACKAGE)
+        except Exception:
+            return missing + [PROTO_PACKAGE]
+        for module in pkgutil.iter_modules(package.__path__,
+                                           PROTO_PACKAGE + "."):
+            try:
+                importlib.import_module(module.name)
+            except Exception:
+                missing.append(module.name)
+        return missing
+
+    def script(self, name, env, cwd):
+        """Path of the script a request names, None if it is not served"""
+        if "/" not in name:
+            name = shutil.which(name, path=env.get("PATH", os.defpath))
+            if name is None:
+                return None
+        path = os.path.join(cwd, name)
+        if os.path.dirname(os.path.realpath(path)) not in self.script_dirs:
+            return None
+        return path
+
+    def compile(self, path):
+        """Code of the script at path, None if it is not a python3 script"""
+        try:
+            st = os.stat(path)
+            version = (st.st_mtime_ns, st.st_size)
+            cached = self._code.get(path)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            with open(path, "rb") as f:
+                source = f.read()
+        except OSError:
+            return None
+        code = None
+        if _PYTHON3.match(source):
+            try:
+                code = compile(source, path, "exec", dont_inherit=True)
+            except (SyntaxError, ValueError):
+                # left to the interpreter to report
+                pass
+        self._code[path] = (version, code)
+        return code
+
+    def serve(self):
+        """Serve the socket until SIGTERM, then wait for the running
+        scripts. Raises SystemExit in the children running the scripts."""
+        self.import_modules()
+        # the objects of the agent are left out of the collections of the
+        # children, which would otherwise copy the pages holding them
+        gc.freeze()
+        self._stopping = False
+        self._wakeup = socket.socketpair()
+        for sock in self._wakeup:
+            sock.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        handlers = {}
+        try:
+            signal.set_wakeup_fd(self._wakeup[1].fileno(),
+                                 warn_on_full_buffer=False)
+            # a handler, as ignoring SIGCHLD would reap the children
+            for sig in (signal.SIGCHLD, signal.SIGTERM):
+                handlers[sig] = signal.signal(sig, self._signal)
+
+            self._listener = socket.socket(socket.AF_UNIX,
+                                           socket.SOCK_SEQPACKET)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            umask = os.umask(0o177)
+            try:
+                self._listener.bind(self.path)
+            finally:
+                os.umask(umask)
+            self._listener.listen(128)
+            self._selector.register(self._listener, selectors.EVENT_READ)
+            self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+            while self._children or not self._stopping:
+                if self._stopping and self._listener is not None:
+                    self._close_listener()
+                for key, _ in self._selector.select():
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    elif key.fileobj is self._wakeup[0]:
+                        self._drain()
+                    else:
+                        self._hangup(key.fileobj, key.data)
+                    self._reap()
+        finally:
+            self._close_listener()
+            self._selector.close()
+            for sock in self._wakeup:
+                sock.close()
+            signal.set_wakeup_fd(-1)
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+
+    def _drain(self):
+        try:
+            while self._wakeup[0].recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _signal(self, sig, frame):
+        if sig == signal.SIGTERM:
+            self._stopping = True
+
+    def _close_listener(self):
+        if self._listener is None:
+            return
+        try:
+            self._selector.unregister(self._listener)
+        except KeyError:
+            pass
+        self._listener.close()
+        self._listener = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _accept(self):
+        try:
+            conn, _ = self._listener.accept()
+        except OSError:
+            return
+        fds = []
+        try:
+            conn.settimeout(1.0)
+            data, fds, flags, _ = socket.recv_fds(conn, _MAX_REQUEST, 3)
+            pid = None
+            if len(fds) == 3 and not flags & socket.MSG_TRUNC and \
+                    self._peer_allowed(conn):
+                pid = self._start(conn, data, fds)
+        except (OSError, ValueError, struct.error):
+            pid = None
+        for fd in fds:
+            os.close(fd)
+        if pid is None:
+            try:
+                conn.send(_STATUS.pack(NOT_SERVED))
+            except OSError:
+                pass
+            conn.close()
+            return
+        conn.setblocking(False)
+        self._children[pid] = conn
+        self._selector.register(conn, selectors.EVENT_READ, pid)
+
+    def _peer_allowed(self, conn):
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        return uid == os.geteuid()
+
+    def _start(self, conn, data, fds):
+        """Fork the child running the script of a request, return its pid or
+        None if the script is not served"""
+        argv, env, cwd, umask = _unpack_request(data)
+        path = self.script(argv[0], env, cwd)
+        if path is None:
+            return None
+        code = self.compile(path)
+        if code is None:
+            return None
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run(conn, fds, path, code, [path] + argv[1:], env, cwd,
+                      umask)
+        return pid
+
+    def _hangup(self, conn, pid):
+        """The client of a running script went away: the script is
+        terminated, as it would have been with the client"""
+        try:
+            if conn.recv(1):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+        self._selector.unregister(conn)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            conn = self._children.pop(pid, None)
+            if conn is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            try:
+                conn.send(_STATUS.pack(code if code >= 0 else 128 - code))
+            except OSError:
+                pass
+            try:
+                self._selector.unregister(conn)
+            except KeyError:
+                pass
+            conn.close()
+
+    def _run(self, conn, fds, path, code, argv, env, cwd, umask):
+        """Run a script in the child, as the interpreter would run it on
+        the descriptors of the client. Raises SystemExit with its exit
+        status, for serve() to let through."""
+        try:
+            # nothing of the agent is left open to the script, nor removed
+            # by serve() on the way out
+            signal.set_wakeup_fd(-1)
+            for sig in (signal.SIGCHLD, signal.SIGTERM):
+                signal.signal(sig, signal.SIG_DFL)
+            self._selector.close()
+            self._listener.close()
+            self._listener = None
+            for sock in self._wakeup:
+                sock.close()
+            for client in self._children.values():
+                client.close()
+            conn.close()
+            for std, fd in enumerate(fds):
+                os.dup2(fd, std)
+            for fd in fds:
+                if fd > 2:
+                    os.close(fd)
+
+            os.umask(umask)
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env)
+            sys.stdin = sys.__stdin__ = open(0, closefd=False)
+            sys.stdout = sys.__stdout__ = open(1, "w", closefd=False)
+            sys.stderr = sys.__stderr__ = open(
+                2, "w", buffering=1, errors="backslashreplace",
+                closefd=False)
+            sys.argv = argv
+            sys.path[0] = os.path.dirname(path)
+            vplaned = sys.modules.get("vplaned.vplaned")
+            if vplaned is not None:
+                vplaned._command_stats_from_environment()
+
+            main = types.ModuleType("__main__")
+            main.__file__ = path
+            main.__builtins__ = builtins
+            sys.modules["__main__"] = main
+            exec(code, main.__dict__)
+        except SystemExit:
+            raise
+        except BaseException:
+            traceback.print_exc()
+            raise SystemExit(1)
+        raise SystemExit(0)
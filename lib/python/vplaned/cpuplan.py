@@ -0,0 +1,395 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""CPU affinity planning for the dataplane.
+
+CPUTopology reads the online CPUs with their package, core, SMT siblings,
+last level cache and NUMA node, the isolated CPUs, the CPUs kernel
+interrupts are steered to, and the NUMA node of the PCI device of each
+port, from sysfs and procfs under a root directory. The root is "/" by
+default, but can be a tree recorded by record_topology(), which copies the
+files read from one root to another.
+
+propose() picks cpumask and control_cpumask values for a topology: the
+control threads on the first core, and one forwarding thread per core of
+the NUMA nodes of the ports, away from the CPUs handling interrupts.
+check() reports the problems of given values as a list of findings, each a
+dict of "level" (error, warning or info), "code", "message" and the "cpus"
+concerned. Example:
+
+topology = CPUTopology.read(ports=["dp0p1s0", "dp0p2s0=0000:02:00.0"])
+plan = propose(topology)
+plan["cpumask"], plan["control_cpumask"]
+for finding in check(topology, "0-7", "0"):
+    print(finding["level"], finding["message"])
+"""
+import glob
+import os
+import shutil
+
+# Limited by CPU_SETSIZE (sched.h) and pthread_setaffinity_np
+MAX_CPUS = 1024
+
+_CPU_DIR = "sys/devices/system/cpu"
+_NODE_DIR = "sys/devices/system/node"
+
+
+def parse_cpus(text):
+    """Set of the CPUs of a list of ranges ("0-3,7") or of a hex mask
+    ("0x8f"). Raises ValueError if text is neither."""
+    text = text.strip()
+    if text.startswith("0x"):
+        mask = int(text.replace(",", ""), 16)
+        return {cpu for cpu in range(mask.bit_length()) if mask >> cpu & 1}
+
+    cpus = set()
+    for token in text.split(","):
+        if "-" in token:
+            start, stop = token.split("-")
+            cpus.update(range(int(start), int(stop) + 1))
+        elif token:
+            cpus.add(int(token))
+    return cpus
+
+
+def format_cpus(cpus):
+    """List of ranges of a set of CPUs, e.g. "1-3,8" """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(start) if start == stop else
+                    "{}-{}".format(start, stop) for start, stop in ranges)
+
+
+def _parse_mask(text):
+    """Set of the CPUs of a comma separated hex mask, as in
+    /proc/irq/default_smp_affinity"""
+    return parse_cpus("0x" + text.strip())
+
+
+class CPU:
+
+    """A logical CPU"""
+
+    __slots__ = ("id", "package", "core", "node", "siblings", "llc")
+
+    def __init__(self, cpu_id, package, core, node, siblings, llc):
+        self.id = cpu_id
+        self.package = package
+        self.core = core
+        self.node = node
+        # logical CPUs of the same core, this one included
+        self.siblings = siblings
+        # logical CPUs sharing the last level cache
+        self.llc = llc
+
+
+class Port:
+
+    """A port and the NUMA node of its PCI device, None if unknown"""
+
+    __slots__ = ("name", "pci", "node")
+
+    def __init__(self, name, pci, node):
+        self.name = name
+        self.pci = pci
+        self.node = node
+
+
+class _Reader:
+
+    """Reads the files of a root directory, copying them to a record
+    directory if given"""
+
+    def __init__(self, root, record=None):
+        self.root = root
+        self.record = record
+
+    def path(self, relpath):
+        return os.path.join(self.root, relpath)
+
+    def read(self, relpath, default=None):
+        try:
+            with open(self.path(relpath)) as f:
+                text = f.read().strip()
+        except OSError:
+            return default
+        if self.record is not None:
+            dest = os.path.join(self.record, relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "w") as f:
+                f.write(text + "\n")
+        return text
+
+    def readlink(self, relpath):
+        try:
+            target = os.readlink(self.path(relpath))
+        except OSError:
+            return None
+        if self.record is not None:
+            dest = os.path.join(self.record, relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            os.symlink(target, dest)
+        return target
+
+    def glob(self, pattern):
+        return sorted(os.path.relpath(path, self.root)
+                      for path in glob.glob(self.path(pattern)))
+
+
+class CPUTopology:
+
+    """CPUs, interrupt steering and port locality of a system. Use read()
+    to build it."""
+
+    def __init__(self, cpus, isolated=(), irq_cpus=(), ports=()):
+        # CPU id -> CPU
+        self.cpus = cpus
+        self.isolated = set(isolated)
+        self.irq_cpus = set(irq_cpus)
+        self.ports = list(ports)
+
+    @classmethod
+    def read(cls, root="/", ports=(), record=None):
+        """Read the topology from the sysfs and procfs trees under root.
+        ports are port names, whose PCI device is found through
+        /sys/class/net, or "name=PCI address" strings. When record is given,
+        the files read are copied to that directory, which can then be used
+        as root."""
+        reader = _Reader(root, record)
+
+        online = reader.read(os.path.join(_CPU_DIR, "online"))
+        if online is not None:
+            cpu_ids = parse_cpus(online)
+        else:
+            cpu_ids = {int(os.path.basename(path)[3:])
+                       for path in reader.glob(os.path.join(_CPU_DIR,
+                                                            "cpu[0-9]*"))}
+
+        nodes = {}
+        for path in reader.glob(os.path.join(_NODE_DIR, "node[0-9]*")):
+            cpulist = reader.read(os.path.join(path, "cpulist"), "")
+            for cpu in parse_cpus(cpulist):
+                nodes[cpu] = int(os.path.basename(path)[4:])
+
+        cpus = {}
+        for cpu_id in sorted(cpu_ids):
+            base = os.path.join(_CPU_DIR, "cpu{}".format(cpu_id))
+            siblings = reader.read(os.path.join(base, "topology",
+                                                "thread_siblings_list"))
+            cpus[cpu_id] = CPU(
+                cpu_id,
+                int(reader.read(os.path.join(
+                    base, "topology", "physical_package_id"), 0)),
+                int(reader.read(os.path.join(base, "topology", "core_id"),
+                                cpu_id)),
+                nodes.get(cpu_id, 0),
+                frozenset(parse_cpus(siblings) if siblings else {cpu_id}),
+                frozenset(cls._llc(reader, base) or {cpu_id}))
+
+        isolated = parse_cpus(reader.read(os.path.join(_CPU_DIR, "isolated"),
+                                          ""))
+
+        return cls(cpus, isolated, cls._irq_cpus(reader, set(cpus)),
+                   [cls._port(reader, port) for port in ports])
+
+    @staticmethod
+    def _llc(reader, base):
+        """CPUs sharing the highest level data or unified cache"""
+        best = (-1, None)
+        for index in reader.glob(os.path.join(base, "cache", "index[0-9]*")):
+            if reader.read(os.path.join(index, "type")) == "Instruction":
+                continue
+            level = int(reader.read(os.path.join(index, "level"), 0))
+            shared = reader.read(os.path.join(index, "shared_cpu_list"))
+            if shared is not None and level > best[0]:
+                best = (level, parse_cpus(shared))
+        return best[1]
+
+    @staticmethod
+    def _irq_cpus(reader, online):
+        """CPUs interrupts are steered to: those of the affinity of the
+        interrupts not spread over all CPUs, and of the default affinity if
+        it is not all CPUs"""
+        irq_cpus = set()
+        default = reader.read("proc/irq/default_smp_affinity")
+        if default is not None and online - _parse_mask(default):
+            irq_cpus |= _parse_mask(default) & online
+        for path in reader.glob("proc/irq/[0-9]*"):
+            affinity = reader.read(os.path.join(path, "smp_affinity_list"))
+            if affinity is None:
+                continue
+            cpus = parse_cpus(affinity) & online
+            if cpus != online:
+                irq_cpus |= cpus
+        return irq_cpus
+
+    @staticmethod
+    def _port(reader, port):
+        name, _, pci = port.partition("=")
+        if not pci:
+            device = reader.readlink(os.path.join("sys/class/net", name,
+                                                  "device"))
+            pci = os.path.basename(device) if device else None
+        node = None
+        if pci:
+            node = int(reader.read(os.path.join("sys/bus/pci/devices", pci,
+                                                "numa_node"), -1))
+        return Port(name, pci, node if node is not None and node >= 0
+                    else None)
+
+    def nodes(self):
+        return sorted({cpu.node for cpu in self.cpus.values()})
+
+    def cores(self):
+        """Sibling sets of the cores, ordered by their first CPU"""
+        return sorted({cpu.siblings & set(self.cpus)
+                       for cpu in self.cpus.values()}, key=min)
+
+    def port_nodes(self):
+        return {port.node for port in self.ports if port.node is not None}
+
+    def to_json(self):
+        return {
+            "cpus": format_cpus(self.cpus),
+            "nodes": {str(node): format_cpus(
+                cpu.id for cpu in self.cpus.values() if cpu.node == node)
+                for node in self.nodes()},
+            "cores": [format_cpus(core) for core in self.cores()],
+            "llc": sorted({format_cpus(cpu.llc)
+                           for cpu in self.cpus.values()}),
+            "isolated": format_cpus(self.isolated),
+            "irq_cpus": format_cpus(self.irq_cpus),
+            "ports": [{"name": port.name, "pci": port.pci,
+                       "node": port.node} for port in self.ports]}
+
+
+def record_topology(dest, root="/", ports=()):
+    """Copy the files the topology is read from under root to dest, and
+    return the topology"""
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    return CPUTopology.read(root, ports, record=dest)
+
+
+def _finding(level, code, message, cpus=(), **extra):
+    finding = {"level": level, "code": code, "message": message,
+               "cpus": format_cpus(cpus)}
+    finding.update(extra)
+    return finding
+
+
+def check(topology, cpumask, control_cpumask=None):
+    """Findings on the cpumask and control_cpumask values, as strings. CPUs
+    of cpumask not in control_cpumask run the forwarding threads."""
+    findings = []
+    try:
+        cpus = parse_cpus(cpumask)
+        control = parse_cpus(control_cpumask or "")
+    except ValueError as e:
+        return [_finding("error", "invalid-mask",
+                         "Invalid CPU affinity: {}".format(e))]
+
+    if any(cpu >= MAX_CPUS for cpu in cpus | control):
+        findings.append(_finding(
+            "error", "cpu-limit", "CPU affinity exceeds the {} supported "
+            "CPUs".format(MAX_CPUS),
+            {cpu for cpu in cpus | control if cpu >= MAX_CPUS}))
+    if not control <= cpus:
+        findings.append(_finding(
+            "error", "control-not-subset", "Control CPU affinity must be a "
+            "subset of the general CPU affinity", control - cpus))
+    offline = (cpus | control) - set(topology.cpus)
+    if offline:
+        findings.append(_finding(
+            "error", "offline-cpu", "CPUs are not online", offline))
+
+    forwarding = {cpu for cpu in cpus - control if cpu in topology.cpus}
+    if not forwarding:
+        findings.append(_finding(
+            "warning", "no-forwarding-cpu", "No CPU is left for forwarding "
+            "threads outside of the control CPUs"))
+        return findings
+
+    fwd_nodes = {topology.cpus[cpu].node for cpu in forwarding}
+    for port in topology.ports:
+        if port.node is None:
+            findings.append(_finding(
+                "info", "unknown-port-node", "NUMA node of port {} is "
+                "unknown".format(port.name), port=port.name))
+        elif port.node not in fwd_nodes:
+            findings.append(_finding(
+                "warning", "cross-numa-port", "Port {} is on NUMA node {}, "
+                "which has no forwarding CPU".format(port.name, port.node),
+                port=port.name, node=port.node))
+
+    port_nodes = topology.port_nodes()
+    if port_nodes:
+        remote = {cpu for cpu in forwarding
+                  if topology.cpus[cpu].node not in port_nodes}
+        if remote:
+            findings.append(_finding(
+                "warning", "remote-core", "Forwarding CPUs are on NUMA nodes "
+                "without ports", remote))
+
+    contended = {cpu for cpu in forwarding
+                 if len(topology.cpus[cpu].siblings & forwarding) > 1}
+    if contended:
+        findings.append(_finding(
+            "warning", "smt-contention", "Forwarding CPUs share cores with "
+            "other forwarding CPUs", contended))
+    shared = {cpu for cpu in forwarding
+              if topology.cpus[cpu].siblings & control}
+    if shared:
+        findings.append(_finding(
+            "warning", "control-sibling", "Forwarding CPUs share cores with "
+            "control CPUs", shared))
+
+    irq = forwarding & topology.irq_cpus
+    if irq:
+        findings.append(_finding(
+            "warning", "irq-cpu", "Forwarding CPUs handle kernel "
+            "interrupts", irq))
+
+    llcs = {topology.cpus[cpu].llc for cpu in forwarding}
+    if len(llcs) > 1:
+        findings.append(_finding(
+            "info", "llc-span", "Forwarding CPUs span {} last level "
+            "caches".format(len(llcs)), forwarding))
+    return findings
+
+
+def propose(topology, control_cores=1, smt=False):
+    """Propose cpumask and control_cpumask values: the control threads on
+    all the threads of the first control_cores cores, and the forwarding
+    threads on one thread of every other core (all threads if smt) of the
+    NUMA nodes of the ports (of all nodes if none is known). The isolated
+    CPUs are preferred, if any, and the cores handling interrupts avoided,
+    unless that leaves no forwarding CPU. Returns a dict of the masks, the
+    forwarding CPUs and the findings of check() on the masks."""
+    cores = topology.cores()
+    control = set().union(*cores[:control_cores])
+
+    nodes = topology.port_nodes() or set(topology.nodes())
+    candidates = [core for core in cores[control_cores:]
+                  if topology.cpus[min(core)].node in nodes]
+    for prefer in (lambda core: core <= topology.isolated,
+                   lambda core: not core & topology.irq_cpus):
+        preferred = [core for core in candidates if prefer(core)]
+        if preferred:
+            candidates = preferred
+
+    forwarding = set()
+    for core in candidates:
+        forwarding |= core if smt else {min(core)}
+
+    cpumask = format_cpus(control | forwarding)
+    control_cpumask = format_cpus(control)
+    return {"cpumask": cpumask, "control_cpumask": control_cpumask,
+            "forwarding": format_cpus(forwarding),
+            "findings": check(topology, cpumask, control_cpumask)}
@@ -0,0 +1,493 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""History of the digital optical monitoring (DOM) readings of transceivers.
+
+The readings of "sfp-monitor show" are sampled every interval seconds by the
+resident vyatta-xcvr cache and kept per interface, in one memory mapped file
+each. A file holds two rings: the samples of the last days, and their hourly
+means over months. Each ring is stored by column, one array of capacity
+entries per measure, so that a query only maps in the columns and the time
+range it asks for. Example:
+
+from vplaned.domhistory import DOMHistory, summary
+
+history = DOMHistory()
+history.record(sfp_status)     # the "sfp_status" list of sfp-monitor show
+with history.open("dp0xe1") as dom:
+    times, rx = dom.read([("rx_power", 0)], since=time.time() - 86400)
+for entry in summary(history):
+    print(entry["ifname"], entry["channel"], entry["time-to-alarm"])
+
+A module has either channel 0 (SFP) or channels 1-4 (QSFP); powers are kept
+in mW and bias currents in mA, as read, and converted to dBm by dbm(). The
+analysis functions work a column at a time on the arrays read: rolling
+least squares trends, projection of the time to the alarm thresholds of the
+module, and outliers across the ports of the trends. They use the array
+module rather than NumPy, which is not a dependency of this package.
+
+The size of the files is bounded by the capacity of their rings, and the
+files of interfaces which have not been sampled for the retention period
+of the hourly ring are removed by prune().
+"""
+import array
+import bisect
+import math
+import mmap
+import operator
+import os
+import statistics
+import struct
+import sys
+import time
+
+HISTORY_DIR = "/var/lib/vyatta/xcvr-history"
+# Seconds between two samples
+SAMPLE_INTERVAL = 300
+# Samples: 7 days of samples, then 6 months of hourly means
+RAW_CAPACITY = 7 * 24 * 3600 // SAMPLE_INTERVAL
+HOURLY_CAPACITY = 183 * 24
+HOUR = 3600
+
+MAGIC = b"VDOMHST1"
+RAW, HOURLY = range(2)
+
+MODULE_MEASURES = ["temperature", "voltage"]
+CHANNEL_MEASURES = ["rx_power", "tx_power", "bias"]
+MEASURES = MODULE_MEASURES + CHANNEL_MEASURES
+
+# Threshold keys of the xcvr_info of sfp-monitor show, per measure, in the
+# order low alarm, low warning, high warning, high alarm
+_THRESHOLDS = {
+    "temperature": "temp", "voltage": "voltage", "bias": "bias",
+    "rx_power": "rx_power", "tx_power": "tx_power"}
+_THRESHOLD_KEYS = ["low_{}_alarm_thresh", "low_{}_warn_thresh",
+                   "high_{}_warn_thresh", "high_{}_alarm_thresh"]
+
+# magic, channels, first channel, then per ring its capacity, count and
+# head, then the thresholds of the measures
+_HEADER = struct.Struct("<8sII6I{}f".format(4 * len(MEASURES)))
+_RINGS_OFFSET = 16
+_THRESHOLDS_OFFSET = 16 + 6 * 4
+_CELL = 4
+# Trends per day too small to matter, whatever the other ports
+_MIN_TREND = {"temperature": 0.5, "voltage": 0.01, "bias": 0.1,
+              "rx_power": 0.02, "tx_power": 0.02}
+_SWAP = sys.byteorder != "little"
+
+
+class DOMHistoryException(Exception):
+    pass
+
+
+def dbm(values):
+    """dBm of the powers in mW, -40 dBm for no power as convert_mW_2_dbm()
+    of vyatta-xcvr"""
+    if len(values) and min(values) > 0:
+        return array.array("d", map((10.0).__mul__, map(math.log10, values)))
+    log10 = math.log10
+    return array.array("d", [10 * log10(mw) if mw > 0 else -40.0
+                             for mw in values])
+
+
+def _columns(channels):
+    """(measure, channel) of the columns after the time, for channels"""
+    return [(m, None) for m in MODULE_MEASURES] + \
+        [(m, c) for c in channels for m in CHANNEL_MEASURES]
+
+
+def _sample(xcvr_info):
+    """(channels, values in _columns() order, thresholds) of the DOM readings
+    of a transceiver, None if it has none"""
+    if "temperature_C" not in xcvr_info or "voltage_V" not in xcvr_info:
+        return None
+    if "rx_power_mW" in xcvr_info:
+        measured = [dict(xcvr_info, channel=0)]
+    elif "measured_values" in xcvr_info:
+        measured = sorted(xcvr_info["measured_values"],
+                          key=lambda v: int(v["channel"]))
+    else:
+        return None
+    values = [xcvr_info["temperature_C"], xcvr_info["voltage_V"]]
+    for value in measured:
+        values += [value["rx_power_mW"], value["tx_power_mW"],
+                   value["laser_bias"]]
+    thresholds = [xcvr_info.get(key.format(_THRESHOLDS[measure]), math.nan)
+                  for measure in MEASURES for key in _THRESHOLD_KEYS]
+    return [int(v["channel"]) for v in measured], values, thresholds
+
+
+class DOMFile:
+
+    """The history of one interface, memory mapped. Implements the
+    ContextManager pattern."""
+
+    def __init__(self, path, channels=None, capacities=None):
+        """Open the history at path, or create it for channels with the
+        (raw, hourly) ring capacities. An existing history of other channels
+        is replaced, the module having been swapped."""
+        self.path = path
+        self._mm = None
+        flags = os.O_RDWR | os.O_CREAT if channels else os.O_RDONLY
+        fd = os.open(path, flags, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            header = os.pread(fd, _HEADER.size, 0)
+            if size >= _HEADER.size and header[:8] == MAGIC:
+                fields = _HEADER.unpack(header)
+                first, count = fields[2], fields[1]
+                if channels is None or \
+                        list(range(first, first + count)) == list(channels):
+                    self._map(fd, fields, channels is not None)
+                    return
+            if channels is None:
+                raise DOMHistoryException("bad history {}".format(path))
+            capacities = capacities or (RAW_CAPACITY, HOURLY_CAPACITY)
+            fields = (MAGIC, len(channels), channels[0],
+                      capacities[0], 0, 0, capacities[1], 0, 0) + \
+                (math.nan,) * (4 * len(MEASURES))
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, _HEADER.size + sum(capacities) * _CELL *
+                         (1 + len(_columns(channels))))
+            os.pwrite(fd, _HEADER.pack(*fields), 0)
+            self._map(fd, fields, True)
+        finally:
+            os.close(fd)
+
+    def _map(self, fd, fields, writable):
+        self.channels = list(range(fields[2], fields[2] + fields[1]))
+        self.columns = _columns(self.channels)
+        self._capacities = [fields[3], fields[6]]
+        # time column first
+        width = 1 + len(self.columns)
+        self._bases = [_HEADER.size,
+                       _HEADER.size + fields[3] * _CELL * width]
+        size = self._bases[1] + fields[6] * _CELL * width
+        if os.fstat(fd).st_size < size:
+            raise DOMHistoryException("truncated history {}".format(
+                self.path))
+        self._mm = mmap.mmap(fd, size, access=mmap.ACCESS_WRITE if writable
+                             else mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _ring(self, ring):
+        """count, head of ring"""
+        return struct.unpack_from("<II", self._mm,
+                                  _RINGS_OFFSET + ring * 12 + 4)
+
+    def __len__(self):
+        return self._ring(RAW)[0]
+
+    def thresholds(self, measure):
+        """(low alarm, low warning, high warning, high alarm) of the
+        measure, NaN where the module gives none"""
+        index = MEASURES.index(measure)
+        return struct.unpack_from("<4f", self._mm,
+                                  _THRESHOLDS_OFFSET + index * 16)
+
+    def set_thresholds(self, thresholds):
+        struct.pack_into("<{}f".format(len(thresholds)), self._mm,
+                         _THRESHOLDS_OFFSET, *thresholds)
+
+    def _column(self, ring, column):
+        """Offset of column of ring, 0 being the time"""
+        return self._bases[ring] + column * self._capacities[ring] * _CELL
+
+    def _physical(self, ring, index):
+        """Slot of the index-th oldest sample of ring"""
+        count, head = self._ring(ring)
+        capacity = self._capacities[ring]
+        return (head - count + index) % capacity
+
+    def _time(self, ring, index):
+        offset = self._column(ring, 0) + \
+            self._physical(ring, index) * _CELL
+        return struct.unpack_from("<I", self._mm, offset)[0]
+
+    def _search(self, ring, when):
+        """Index of the first sample of ring not older than when"""
+        lo, hi = 0, self._ring(ring)[0]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(ring, mid) < when:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _slice(self, ring, column, first, last, typecode):
+        """Array of the column of the samples first to last of ring"""
+        values = array.array(typecode)
+        capacity = self._capacities[ring]
+        base = self._column(ring, column)
+        start = self._physical(ring, first)
+        remaining = last - first
+        while remaining > 0:
+            size = min(remaining, capacity - start)
+            values.frombytes(self._mm[base + start * _CELL:
+                                      base + (start + size) * _CELL])
+            remaining -= size
+            start = 0
+        if _SWAP:
+            values.byteswap()
+        return values
+
+    def last_time(self, ring=RAW):
+        count = self._ring(ring)[0]
+        return self._time(ring, count - 1) if count else None
+
+    def read(self, columns, since=0, until=None, ring=RAW):
+        """Times and arrays of the (measure, channel) columns of the samples
+        of ring taken from since and before until"""
+        first = self._search(ring, since)
+        last = self._ring(ring)[0] if until is None else \
+            self._search(ring, until)
+        times = self._slice(ring, 0, first, last, "I")
+        return times, [self._slice(ring, 1 + self.columns.index(c), first,
+                                   last, "f") for c in columns]
+
+    def append(self, ring, when, values):
+        """Add the sample taken at when, with values in the order of
+        columns"""
+        count, head = self._ring(ring)
+        capacity = self._capacities[ring]
+        struct.pack_into("<I", self._mm,
+                         self._column(ring, 0) + head * _CELL, int(when))
+        for column, value in enumerate(values, 1):
+            struct.pack_into("<f", self._mm,
+                             self._column(ring, column) + head * _CELL,
+                             value)
+        struct.pack_into("<II", self._mm, _RINGS_OFFSET + ring * 12 + 4,
+                         min(count + 1, capacity), (head + 1) % capacity)
+
+    def add(self, when, values):
+        """Add a sample, and the hourly means of the previous hour when
+        this sample starts a new one"""
+        last = self.last_time()
+        if last is not None and last // HOUR != when // HOUR:
+            start = last // HOUR * HOUR
+            times, columns = self.read(self.columns, start, start + HOUR)
+            if times:
+                self.append(HOURLY, start,
+                            [math.fsum(c) / len(c) for c in columns])
+        self.append(RAW, when, values)
+
+
+class DOMHistory:
+
+    """The histories of all the interfaces, in directory. Samples are
+    recorded every interval seconds at most."""
+
+    def __init__(self, directory=HISTORY_DIR, interval=SAMPLE_INTERVAL,
+                 capacities=(RAW_CAPACITY, HOURLY_CAPACITY)):
+        self.directory = directory
+        self.interval = interval
+        self.capacities = capacities
+        self._files = {}
+
+    def _path(self, ifname):
+        return os.path.join(self.directory, ifname + ".dom")
+
+    def interfaces(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n[:-4] for n in names if n.endswith(".dom"))
+
+    def open(self, ifname):
+        """History of the interface, read only"""
+        return DOMFile(self._path(ifname))
+
+    def record(self, sfp_status, now=None):
+        """Add the DOM readings of the "sfp_status" of sfp-monitor show to
+        the histories of the interfaces, unless sampled less than interval
+        seconds ago"""
+        now = int(time.time() if now is None else now)
+        for intf in sfp_status:
+            sample = _sample(intf.get("xcvr_info", {}))
+            if sample is None:
+                continue
+            channels, values, thresholds = sample
+            dom = self._files.get(intf["name"])
+            if dom is None or dom.channels != channels:
+                if dom is not None:
+                    dom.close()
+                os.makedirs(self.directory, exist_ok=True)
+                dom = DOMFile(self._path(intf["name"]), channels,
+                              self.capacities)
+                self._files[intf["name"]] = dom
+            last = dom.last_time()
+            if last is not None and last <= now < last + self.interval:
+                continue
+            dom.set_thresholds(thresholds)
+            dom.add(now, values)
+
+    def prune(self, max_age=None, now=None):
+        """Remove the histories of the interfaces not sampled for max_age
+        seconds, by default the retention of the hourly ring"""
+        now = time.time() if now is None else now
+        max_age = self.capacities[HOURLY] * HOUR if max_age is None \
+            else max_age
+        for ifname in self.interfaces():
+            try:
+                with self.open(ifname) as dom:
+                    last = dom.last_time()
+            except DOMHistoryException:
+                last = None
+            if last is None or last < now - max_age:
+                dom = self._files.pop(ifname, None)
+                if dom is not None:
+                    dom.close()
+                os.unlink(self._path(ifname))
+
+    def close(self):
+        for dom in self._files.values():
+            dom.close()
+        self._files = {}
+
+
+def _dbm(mw):
+    return mw if math.isnan(mw) else dbm([mw])[0]
+
+
+def trend(times, values):
+    """(slope per second, value at the last time) of the least squares line
+    through the samples, None for less than two samples"""
+    n = len(times)
+    if n < 2:
+        return None
+    # times from the last one, whose sums are exact integers
+    xs = list(map(times[-1].__rsub__, times))
+    sx = sum(xs)
+    den = n * sum(map(operator.mul, xs, xs)) - sx * sx
+    if den == 0:
+        return None
+    sy = math.fsum(values)
+    slope = (n * math.fsum(map(operator.mul, xs, values)) - sx * sy) / den
+    return slope, (sy - slope * sx) / n
+
+
+def rolling_trend(times, values, window):
+    """Slope per second of the least squares line through the samples of
+    the window seconds up to each sample, NaN where there are less than two
+    samples, computed from running sums"""
+    t0 = times[0] if len(times) else 0
+    sx = sy = sxx = sxy = 0.0
+    acc = []
+    for t, y in zip(times, values):
+        x = t - t0
+        sx += x
+        sy += y
+        sxx += x * x
+        sxy += x * y
+        acc.append((sx, sy, sxx, sxy))
+    slopes = array.array("d")
+    first = 0
+    for last, t in enumerate(times):
+        first = bisect.bisect_left(times, t - window, first, last)
+        n = last - first + 1
+        sx, sy, sxx, sxy = acc[last]
+        if first:
+            px, py, pxx, pxy = acc[first - 1]
+            sx, sy, sxx, sxy = sx - px, sy - py, sxx - pxx, sxy - pxy
+        den = n * sxx - sx * sx
+        slopes.append((n * sxy - sx * sy) / den if n > 1 and den > 0
+                      else math.nan)
+    return slopes
+
+
+def time_to_threshold(slope, value, thresholds):
+    """Seconds until the projection of value at slope per second crosses
+    the low or high threshold it moves towards: 0 if already past it, None
+    if it moves towards none"""
+    low, high = thresholds
+    if (not math.isnan(low) and value <= low) or \
+            (not math.isnan(high) and value >= high):
+        return 0.0
+    if slope < 0 and not math.isnan(low):
+        return (low - value) / slope
+    if slope > 0 and not math.isnan(high):
+        return (high - value) / slope
+    return None
+
+
+def outliers(values, threshold=3.5, min_deviation=0.0):
+    """Keys of the {key: value} whose value is an outlier: a robust z-score,
+    from the median absolute deviation, above threshold, and a deviation
+    from the median above min_deviation"""
+    finite = [v for v in values.values() if not math.isnan(v)]
+    if len(finite) < 3:
+        return set()
+    median = statistics.median(finite)
+    mad = statistics.median(abs(v - median) for v in finite)
+    return {k for k, v in values.items()
+            if abs(v - median) > min_deviation and
+            (mad == 0 or 0.6745 * abs(v - median) / mad > threshold)}
+
+
+def summary(history, ifname=None, window=7 * 24 * 3600, now=None):
+    """Per interface and channel, the last readings (powers in dBm) and
+    their trends over window seconds (per day, dB for the powers), the
+    shortest projected time in seconds to an alarm threshold and the
+    measures whose trend is an outlier across the ports. The trends are
+    those of the hourly means once there are a day of them."""
+    now = time.time() if now is None else now
+    entries = []
+    slopes = {}
+    for name in [ifname] if ifname is not None else history.interfaces():
+        try:
+            dom = history.open(name)
+        except (OSError, DOMHistoryException):
+            continue
+        with dom:
+            last = dom.last_time()
+            if last is None or last < now - window:
+                continue
+            for channel in dom.channels:
+                columns = [(m, None) for m in MODULE_MEASURES] + \
+                    [(m, channel) for m in CHANNEL_MEASURES]
+                _, readings = dom.read(columns, last)
+                times, arrays = dom.read(columns, now - window, ring=HOURLY)
+                if len(times) < 24:
+                    times, arrays = dom.read(columns, now - window)
+                entry = {"ifname": name, "channel": channel,
+                         "time-to-alarm": None, "alarm-measure": None,
+                         "outliers": []}
+                for measure, values, reading in zip(MEASURES, arrays,
+                                                    readings):
+                    low, _, _, high = dom.thresholds(measure)
+                    if measure in ("rx_power", "tx_power"):
+                        values, reading = dbm(values), dbm(reading)
+                        low, high = _dbm(low), _dbm(high)
+                    entry[measure] = reading[-1]
+                    fit = trend(times, values)
+                    if fit is None:
+                        slope, value = 0.0, reading[-1]
+                    else:
+                        slope, value = fit
+                        value += slope * (last - times[-1])
+                    entry[measure + "-trend"] = slope * 86400
+                    slopes[(len(entries), measure)] = slope * 86400
+                    eta = time_to_threshold(slope, value, (low, high))
+                    if eta is not None and (entry["time-to-alarm"] is None or
+                                            eta < entry["time-to-alarm"]):
+                        entry["time-to-alarm"] = eta
+                        entry["alarm-measure"] = measure
+                entries.append(entry)
+    for measure in MEASURES:
+        for index, _ in sorted(outliers(
+                {k: v for k, v in slopes.items() if k[1] == measure},
+                min_deviation=_MIN_TREND[measure])):
+            entries[index]["outliers"].append(measure)
+    return entries
@@ -0,0 +1,239 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Subscriptions to dataplane events, pushed by a publisher rather than
+polled with json_command().
+
+The publisher sends every event on a PUB or XPUB socket as four frames:
+its topic, the epoch of the publisher, its sequence number and its body.
+The epoch, a little endian uint64, grows with every restart of the
+publisher, e.g. its start time; the sequence number, another one, counts
+the events of the topic since then. Subscribers filter on topic prefixes.
+ZMQ queues at most queue_size events per subscriber, on both ends, and
+drops the events that do not fit; subscribers find out from the gaps in the
+sequence numbers, count the events missed as dropped, and resynchronise the
+topic from a snapshot: they send the SNAPSHOT and topic frames to the
+snapshot endpoint, a REP socket, which answers with the epoch, then, for
+every topic starting with the one asked for, the topic, the sequence number
+of its last event, the number of bodies making up its current state and
+these bodies. They are delivered as events flagged as snapshot, after the
+event which revealed the gap, and the live events they already cover are
+skipped. When the epoch grows, the publisher restarted and numbers the
+events from scratch: every topic subscribed to is resynchronised, and the
+events left over from the previous epoch are skipped. Events which are not
+part of the state of their topic, such as alarms, are lost if dropped.
+Example:
+
+with Controller() as controller:
+    with controller.subscribe(["link", "sfp"], snapshot=True) as events:
+        for event in events:
+            print(event.topic, event.json())
+
+Subscription is the blocking flavour, iterated over or polled with recv();
+vplaned.aio.AsyncSubscription the asyncio one, iterated over with
+"async for".
+"""
+import collections
+import json
+import struct
+import zmq
+
+# Publisher of the events and snapshot server of the controller
+EVENTS_ENDPOINT = "ipc:///var/run/vyatta/vplaned-events.socket"
+SNAPSHOT_ENDPOINT = "ipc:///var/run/vyatta/vplaned-snapshot.socket"
+
+_SEQ = struct.Struct("<Q")
+
+
+class Event(collections.namedtuple("Event",
+                                   ["topic", "seq", "body", "snapshot"])):
+
+    """An event: its topic, sequence number and body (bytes), and whether
+    it comes from a snapshot"""
+
+    __slots__ = ()
+
+    def json(self):
+        return json.loads(self.body)
+
+
+def pack_event(topic, epoch, seq, body):
+    """Frames of an event, as a publisher sends them"""
+    return [topic.encode(), _SEQ.pack(epoch), _SEQ.pack(seq), body]
+
+
+def pack_snapshot(epoch, topics):
+    """Frames of a snapshot reply, topics being (topic, seq, bodies)"""
+    frames = [_SEQ.pack(epoch)]
+    for topic, seq, bodies in topics:
+        bodies = list(bodies)
+        frames += [topic.encode(), _SEQ.pack(seq), _SEQ.pack(len(bodies))]
+        frames += bodies
+    return frames
+
+
+class _Sequencer:
+
+    """Tracks the sequence numbers of the topics of a subscription, and
+    the events dropped before it"""
+
+    def __init__(self):
+        self.epoch = None
+        self.last = {}
+        self.dropped = 0
+        self.snapshots = 0
+        self.restarts = 0
+        self.events = 0
+
+    def _update_epoch(self, epoch):
+        """True if the publisher restarted, as epoch grew, forgetting the
+        sequence numbers of the previous epoch"""
+        if self.epoch is None:
+            self.epoch = epoch
+        if epoch <= self.epoch:
+            return False
+        self.epoch = epoch
+        self.last = {}
+        self.restarts += 1
+        return True
+
+    def check(self, topic, epoch, seq):
+        """"event" if the event with that sequence number is the next one
+        of topic, "stale" if a snapshot or a restart of the publisher
+        covered it already, "gap" if events were dropped before it,
+        "restart" if the publisher restarted since the previous one"""
+        if self.epoch is not None and epoch < self.epoch:
+            return "stale"
+        if self._update_epoch(epoch):
+            self.last[topic] = seq
+            self.events += 1
+            return "restart"
+        last = self.last.get(topic)
+        if last is not None and seq <= last:
+            return "stale"
+        self.last[topic] = seq
+        self.events += 1
+        if last is None or seq == last + 1:
+            return "event"
+        self.dropped += seq - last - 1
+        return "gap"
+
+    def resynced(self, frames):
+        """Events of a snapshot reply, each of its topics up to the
+        sequence number it reports"""
+        self.snapshots += 1
+        self._update_epoch(_SEQ.unpack(frames[0])[0])
+        events = []
+        idx = 1
+        while idx < len(frames):
+            topic = frames[idx].decode()
+            seq, count = (_SEQ.unpack(frame)[0]
+                          for frame in frames[idx + 1:idx + 3])
+            idx += 3
+            self.last[topic] = max(seq, self.last.get(topic, 0))
+            events += [Event(topic, seq, body, True)
+                       for body in frames[idx:idx + count]]
+            idx += count
+        return events
+
+    def stats(self):
+        return {"events": self.events, "dropped": self.dropped,
+                "snapshots": self.snapshots, "restarts": self.restarts}
+
+
+def _decode(frames):
+    return (frames[0].decode(), _SEQ.unpack(frames[1])[0],
+            _SEQ.unpack(frames[2])[0], frames[3])
+
+
+class Subscription:
+
+    """Events of the topics subscribed to. Created through
+    Controller.subscribe(), and used through a "with" statement.
+    Without a snapshot endpoint, gaps are counted but not resynchronised.
+    With snapshot set, a snapshot of every topic is delivered first."""
+
+    def __init__(self, ctx, topics, endpoint=EVENTS_ENDPOINT,
+                 snapshot_endpoint=SNAPSHOT_ENDPOINT, queue_size=1000,
+                 snapshot=False, timeout=10000):
+        self._ctx = ctx
+        self._topics = list(topics)
+        self._endpoint = endpoint
+        self._snapshot_endpoint = snapshot_endpoint
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._sock = None
+        self._sequencer = _Sequencer()
+        self._pending = collections.deque()
+        self._initial = snapshot
+
+    def __enter__(self):
+        self._connect()
+        # Subscribed first, so that no event is missed after the snapshot
+        if self._initial:
+            self._pending.extend(self._resync(self._topics or [""]))
+        return self
+
+    def _connect(self):
+        self._sock = self._ctx.socket(zmq.SUB)
+        # Events are waited for as long as asked, whatever the context says
+        self._sock.setsockopt(zmq.RCVTIMEO, -1)
+        self._sock.setsockopt(zmq.RCVHWM, self._queue_size)
+        for topic in self._topics or [""]:
+            self._sock.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        self._sock.connect(self._endpoint)
+
+    def __exit__(self, *exc):
+        self._sock.close()
+        self._sock = None
+
+    def _snapshot(self, topic):
+        sock = self._ctx.socket(zmq.REQ)
+        sock.setsockopt(zmq.RCVTIMEO, self._timeout)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect(self._snapshot_endpoint)
+        try:
+            sock.send_multipart([b"SNAPSHOT", topic.encode()])
+            frames = sock.recv_multipart()
+        finally:
+            sock.close()
+        return self._sequencer.resynced(frames)
+
+    def _resync(self, topics):
+        """Events of the snapshots of topics, or of every topic subscribed
+        to if they reveal a restart of the publisher"""
+        restarts = self._sequencer.restarts
+        events = []
+        for topic in topics:
+            events += self._snapshot(topic)
+            if self._sequencer.restarts != restarts:
+                return self._resync(self._topics or [""])
+        return events
+
+    def recv(self, timeout=None):
+        """Next event, or None if none came within timeout seconds (forever
+        if None)"""
+        while not self._pending:
+            if timeout is not None and \
+                    not self._sock.poll(timeout * 1000, zmq.POLLIN):
+                return None
+            topic, epoch, seq, body = _decode(self._sock.recv_multipart())
+            status = self._sequencer.check(topic, epoch, seq)
+            if status == "stale":
+                continue
+            event = Event(topic, seq, body, False)
+            if status == "event" or self._snapshot_endpoint is None:
+                return event
+            self._pending.append(event)
+            self._pending.extend(self._resync(
+                [topic] if status == "gap" else self._topics or [""]))
+        return self._pending.popleft()
+
+    def __iter__(self):
+        while True:
+            yield self.recv()
+
+    def stats(self):
+        """Live events delivered, events dropped, snapshots taken and
+        restarts of the publisher"""
+        return self._sequencer.stats()
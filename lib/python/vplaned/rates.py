@@ -0,0 +1,319 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""High resolution dataplane interface rates.
+
+RateSampler polls the counters of the interfaces of every dataplane at a
+fixed interval, down to 100ms, and keeps the rates between two polls in a
+RateHistory. The history is made of fixed size ring buffers: a shared ring
+of sample times, and per interface one float32 ring for each of rx_pps,
+rx_bps, tx_pps and tx_bps. It holds depth samples, so it takes about
+16 * depth bytes per interface, for at most max_interfaces interfaces.
+
+The peak, mean, percentiles and EWMA of the rates over any window the
+history covers are returned by RateHistory.query(), and served by
+RateSampler.serve() on a local unix socket, to which query_rates() is the
+client. Example:
+
+from vplaned import Controller
+from vplaned.rates import RateSampler, query_rates
+
+with Controller() as controller:
+    RateSampler(controller, interval=0.1, depth=600).run()
+
+rates = query_rates(interfaces=["dp0s3"], window=10, percentiles=[50, 99])
+rates["interfaces"]["dp0s3"]["rx_bps"]["p99"]
+"""
+import json
+import logging
+import math
+import os
+import socket
+import socketserver
+import threading
+import time
+from array import array
+
+SOCKET = "/var/run/vyatta/dataplane-rates.socket"
+
+# counters of the ifconfig statistics sampled, and the rate kept for each
+COUNTERS = ("rx_packets", "rx_bytes", "tx_packets", "tx_bytes")
+RATES = ("rx_pps", "rx_bps", "tx_pps", "tx_bps")
+
+_NAN = float("nan")
+
+logger = logging.getLogger(__name__)
+
+
+class _Ring:
+
+    """Rings of the rates of one interface, from sample number first on"""
+
+    __slots__ = ("first", "rates")
+
+    def __init__(self, depth, first):
+        self.first = first
+        self.rates = [array("f", [_NAN]) * depth for _ in RATES]
+
+
+class RateHistory:
+
+    """Fixed size history of the rates of the interfaces"""
+
+    def __init__(self, depth=300, max_interfaces=16384):
+        self.depth = depth
+        self.max_interfaces = max_interfaces
+        # number of samples added so far
+        self.samples = 0
+        self._times = array("d", [0.0]) * depth
+        self._rings = {}
+
+    def __len__(self):
+        return len(self._rings)
+
+    def __contains__(self, ifname):
+        return ifname in self._rings
+
+    def add(self, timestamp, rates):
+        """Add the sample taken at timestamp, a dict of interface name to
+        (rx_pps, rx_bps, tx_pps, tx_bps). Interfaces missing from it have no
+        rate for that sample."""
+        slot = self.samples % self.depth
+        for ifname, ring in self._rings.items():
+            if ifname not in rates:
+                for values in ring.rates:
+                    values[slot] = _NAN
+        for ifname, sample in rates.items():
+            ring = self._rings.get(ifname)
+            if ring is None:
+                if len(self._rings) >= self.max_interfaces:
+                    continue
+                ring = self._rings[ifname] = _Ring(self.depth, self.samples)
+            for values, rate in zip(ring.rates, sample):
+                values[slot] = rate
+        self._times[slot] = timestamp
+        self.samples += 1
+
+    def retain(self, interfaces):
+        """Drop the history of the interfaces not in interfaces"""
+        for ifname in [ifname for ifname in self._rings
+                       if ifname not in interfaces]:
+            del self._rings[ifname]
+
+    def _window(self, window):
+        """Sample numbers within window seconds of the last sample, oldest
+        first"""
+        last = self.samples - 1
+        if last < 0:
+            return range(0)
+        end = self._times[last % self.depth]
+        first = last
+        while first > 0 and last - first + 1 < self.depth and \
+                end - self._times[(first - 1) % self.depth] <= window:
+            first -= 1
+        return range(first, last + 1)
+
+    def query(self, interfaces=None, window=10.0, percentiles=(50, 95, 99),
+              tau=None):
+        """Statistics of the rates of the interfaces (all by default) over
+        the last window seconds, as a dict of interface name to rate name to
+        {"current", "peak", "mean", "p<N>" for each percentile, "ewma"}.
+        The EWMA time constant tau defaults to the window. Statistics of an
+        interface with no sample in the window are None."""
+        samples = self._window(window)
+        tau = tau or window
+        weights = []
+        for n in samples[1:]:
+            dt = self._times[n % self.depth] - \
+                self._times[(n - 1) % self.depth]
+            weights.append(1 - math.exp(-dt / tau) if tau > 0 else 1.0)
+
+        if interfaces is None:
+            interfaces = list(self._rings)
+        result = {}
+        for ifname in interfaces:
+            ring = self._rings.get(ifname)
+            if ring is None:
+                continue
+            result[ifname] = {
+                name: _stats(values, samples, weights, ring.first,
+                             self.depth, percentiles)
+                for name, values in zip(RATES, ring.rates)}
+        return {"window": (self._times[samples[-1] % self.depth] -
+                           self._times[samples[0] % self.depth]
+                           if samples else 0.0),
+                "samples": len(samples), "interfaces": result}
+
+
+def _stats(values, samples, weights, first, depth, percentiles):
+    rates = []
+    ewma = None
+    for i, n in enumerate(samples):
+        rate = values[n % depth]
+        if n < first or rate != rate:
+            continue
+        rates.append(rate)
+        if ewma is None:
+            ewma = rate
+        else:
+            ewma += weights[i - 1] * (rate - ewma)
+    if not rates:
+        return None
+
+    stats = {"current": rates[-1], "peak": max(rates),
+             "mean": sum(rates) / len(rates), "ewma": ewma}
+    ordered = sorted(rates)
+    for p in percentiles:
+        # nearest rank
+        rank = max(1, math.ceil(p / 100 * len(ordered)))
+        stats["p{:g}".format(p)] = ordered[rank - 1]
+    return stats
+
+
+class RateSampler:
+
+    """Poll the interface counters of the dataplanes of controller every
+    interval seconds into a RateHistory. The rate of an interface is the
+    sum of its rates on each dataplane, each computed over the time between
+    the two replies of that dataplane."""
+
+    def __init__(self, controller, interval=1.0, depth=300,
+                 max_interfaces=16384):
+        self.controller = controller
+        self.interval = interval
+        self.history = RateHistory(depth, max_interfaces)
+        # (dp id, interface name) -> (reply time, counters)
+        self._last = {}
+
+    def poll(self):
+        """Sample the counters of every dataplane once. Return the list of
+        the DataplaneExceptions of the dataplanes that failed to reply."""
+        rates = {}
+        seen = set()
+        failures = []
+        for dp, reply in self.controller.broadcast_iter("ifconfig"):
+            if isinstance(reply, Exception):
+                failures.append(reply)
+                continue
+            now = time.monotonic()
+            for intf in reply.get("interfaces", ()):
+                stats = intf.get("statistics", {})
+                key = (dp.id, intf["name"])
+                counters = [stats.get(counter, 0) for counter in COUNTERS]
+                last = self._last.get(key)
+                self._last[key] = (now, counters)
+                seen.add(key)
+                if last is None or now <= last[0]:
+                    continue
+                dt = now - last[0]
+                sample = [(c - p) / dt if c >= p else 0.0
+                          for c, p in zip(counters, last[1])]
+                # bytes to bits
+                sample[1] *= 8
+                sample[3] *= 8
+                total = rates.get(intf["name"])
+                if total is None:
+                    rates[intf["name"]] = sample
+                else:
+                    rates[intf["name"]] = [a + b for a, b in zip(total, sample)]
+
+        # forget the interfaces which are gone, unless they may only be
+        # missing from a dataplane which did not answer
+        if not failures:
+            for key in [key for key in self._last if key not in seen]:
+                del self._last[key]
+            self.history.retain({ifname for _, ifname in seen})
+        self.history.add(time.monotonic(), rates)
+        return failures
+
+    def _poll_forever(self):
+        deadline = time.monotonic()
+        errors = set()
+        while True:
+            deadline += self.interval
+            try:
+                failures = {str(e) for e in self.poll()}
+            except Exception as e:
+                failures = {str(e)}
+            # a failure is logged when it starts, not on every poll
+            for error in failures - errors:
+                logger.error("Error polling interface rates: {}".format(error))
+            if errors and not failures:
+                logger.info("Polling interface rates again")
+            errors = failures
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # missed polls are skipped, not made up for
+                deadline = time.monotonic()
+
+    def start(self):
+        """Start polling in a daemon thread"""
+        poller = threading.Thread(target=self._poll_forever, daemon=True)
+        poller.start()
+        return poller
+
+    def serve(self, path=SOCKET, sock=None, idle_timeout=None):
+        """Answer the queries sent on the unix socket at path, or on the
+        listening socket sock if given, e.g. one passed by systemd socket
+        activation. Serve forever or, with idle_timeout, until no query came
+        for that many seconds."""
+        history = self.history
+        last_query = [time.monotonic()]
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                last_query[0] = time.monotonic()
+                try:
+                    request = json.loads(self.rfile.read() or "{}")
+                    reply = history.query(
+                        request.get("interfaces"),
+                        request.get("window", 10.0),
+                        request.get("percentiles", (50, 95, 99)),
+                        request.get("tau"))
+                except (ValueError, TypeError, AttributeError) as e:
+                    reply = {"error": str(e)}
+                self.wfile.write(json.dumps(reply).encode())
+
+        if sock is None:
+            if os.path.exists(path):
+                os.unlink(path)
+            server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        else:
+            server = socketserver.ThreadingUnixStreamServer(
+                path, Handler, bind_and_activate=False)
+            server.socket.close()
+            server.socket = sock
+        with server:
+            server.daemon_threads = True
+            if idle_timeout is None:
+                server.serve_forever()
+                return
+            server.timeout = min(idle_timeout, 1.0)
+            while time.monotonic() - last_query[0] < idle_timeout:
+                server.handle_request()
+
+    def run(self, path=SOCKET, sock=None, idle_timeout=None):
+        """Poll in the background and serve, see serve()"""
+        self.start()
+        self.serve(path, sock, idle_timeout)
+
+
+def query_rates(interfaces=None, window=10.0, percentiles=(50, 95, 99),
+                tau=None, path=SOCKET, timeout=5):
+    """Query the rates served by a RateSampler on the unix socket at path"""
+    request = {"window": window, "percentiles": list(percentiles)}
+    if interfaces is not None:
+        request["interfaces"] = list(interfaces)
+    if tau is not None:
+        request["tau"] = tau
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode())
+        sock.shutdown(socket.SHUT_WR)
+        reply = json.loads(b"".join(iter(lambda: sock.recv(65536), b"")))
+    if "error" in reply:
+        raise ValueError(reply["error"])
+    return reply
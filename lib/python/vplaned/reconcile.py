@@ -0,0 +1,56 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Reconciliation of configuration lists between the RUNNING and CANDIDATE
+configd databases.
+
+Scripts run at the end of a list commit used to query the status of every
+entry in both databases, then the value of every changed one, at one
+synchronous configd call each. read_list() instead reads the whole list
+of one database in a single tree_get_dict(), and diff() compares the two
+in memory. Example:
+
+client = configd.Client()
+running, candidate = read_lists(client, path, "vlan-id", "profile")
+changes = diff(running, candidate)
+with Controller() as controller, controller.batch():
+    for vlan, profile in changes.deleted.items():
+        ...
+"""
+import collections
+
+Changes = collections.namedtuple("Changes", ["added", "changed", "deleted"])
+Changes.__doc__ = """Differences between two lists. added and deleted map
+keys to their value in the list they are in, changed maps keys to the pair
+of their old and new values."""
+
+
+def read_list(client, path, db, key, value):
+    """Map of the key leaf to the value leaf of the entries of the list at
+    path in the db database which have that leaf; empty if the list does not
+    exist. The last element of path is the list name."""
+    name = path.split(" ")[-1]
+    try:
+        entries = client.tree_get_dict(path, db)[name]
+    except Exception:
+        return {}
+    return {entry[key]: entry[value] for entry in entries if value in entry}
+
+
+def read_lists(client, path, key, value):
+    """read_list() of the RUNNING and CANDIDATE databases"""
+    return (read_list(client, path, client.RUNNING, key, value),
+            read_list(client, path, client.CANDIDATE, key, value))
+
+
+def diff(old, new):
+    """Changes from the old to the new map"""
+    added = {}
+    changed = {}
+    for key, value in new.items():
+        if key not in old:
+            added[key] = value
+        elif old[key] != value:
+            changed[key] = (old[key], value)
+    deleted = {key: value for key, value in old.items() if key not in new}
+    return Changes(added, changed, deleted)
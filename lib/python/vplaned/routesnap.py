@@ -0,0 +1,362 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Snapshots of the programming state of the dataplane route tables, and
+their differences.
+
+A snapshot holds, for each route of an object (route, route6, mroute,
+mroute6 or mpls-route), the subset of "pd show dataplane <obj> <subset>"
+it was listed in: full, partial, no_resource and so on, and a digest of its
+next hops. It is a single file: a header, a directory of sections, one per
+dataplane, VRF (or label space) and table, a table of the distinct next hop
+sets, then the records of each section. Records are fixed width: the route
+as a binary key (address then prefix length, big endian so that the bytes
+sort like the routes), the state and the next hop digest, sorted on the key.
+Example:
+
+from vplaned.routesnap import Snapshot, SnapshotWriter, diff
+
+writer = SnapshotWriter("route")
+for subset in STATES:
+    writer.add_reply(dp_id, subset, text)    # the json text of the reply
+writer.write("/tmp/before.snap")
+...
+with Snapshot("/tmp/before.snap") as old, Snapshot("/tmp/after.snap") as new:
+    for change in diff(old, new):
+        print(change.route, change.old_state, change.new_state)
+
+The difference of two snapshots is computed in linear time: sections
+which are byte for byte the same are skipped, the others are compared as
+sets of records.
+"""
+import collections
+import hashlib
+import json
+import mmap
+import os
+import socket
+import struct
+import tempfile
+
+from vplaned.vplaned import json_iter
+
+STATES = ['full', 'partial', 'no_resource', 'no_support', 'not_needed',
+          'error']
+OBJECTS = ['route', 'route6', 'mroute', 'mroute6', 'mpls-route']
+
+MAGIC = b"VRTSNAP1"
+
+# magic, object, key size, section count, next hop set count
+_HEADER = struct.Struct(">8s16sIII")
+# dataplane id, vrf id (label space), table, offset, record count
+_SECTION = struct.Struct(">IIIQI")
+# digest, size of the json text of the next hops
+_NEXTHOPS = struct.Struct(">8sI")
+_DIGEST_SIZE = 8
+# key, then state and next hop digest
+_VALUE_SIZE = 1 + _DIGEST_SIZE
+
+_FAMILIES = {"route": (socket.AF_INET, 4), "route6": (socket.AF_INET6, 16),
+             "mroute": (socket.AF_INET, 4), "mroute6": (socket.AF_INET6, 16)}
+
+Section = collections.namedtuple("Section", ["dp_id", "vrf_id", "table"])
+
+Change = collections.namedtuple(
+    "Change", ["section", "route", "old_state", "new_state", "old_next_hop",
+               "new_next_hop"])
+Change.__doc__ = """A route added (no old state), removed (no new state),
+or whose state or next hops changed between two snapshots"""
+
+
+class SnapshotException(Exception):
+    pass
+
+
+def key_size(obj):
+    if obj == "mpls-route":
+        return 4
+    family, size = _FAMILIES[obj]
+    if obj.startswith("mroute"):
+        return 2 * size
+    return size + 1
+
+
+def _address(family, size, address):
+    try:
+        return socket.inet_pton(family, address)
+    except OSError:
+        # "*" sources of mroutes
+        return bytes(size)
+
+
+# prefix length bytes
+_LENGTHS = [bytes((n,)) for n in range(129)]
+
+
+def _prefix_key(family, size):
+    def encode(route):
+        address, _, length = route["prefix"].partition("/")
+        return socket.inet_pton(family, address) + \
+            _LENGTHS[int(length) if length else size * 8]
+    return encode
+
+
+def _mroute_key(family, size):
+    def encode(route):
+        return _address(family, size, route["source"]) + \
+            _address(family, size, route["group"])
+    return encode
+
+
+def _mpls_key(route):
+    return struct.pack(">I", int(route["address"]))
+
+
+def _encoder(obj):
+    """The function returning the binary key of a route entry of obj"""
+    if obj == "mpls-route":
+        return _mpls_key
+    if obj.startswith("mroute"):
+        return _mroute_key(*_FAMILIES[obj])
+    return _prefix_key(*_FAMILIES[obj])
+
+
+def encode_key(obj, route):
+    """Binary key of a route entry of a reply"""
+    return _encoder(obj)(route)
+
+
+def decode_key(obj, key):
+    """The route of a binary key, as the replies show it"""
+    if obj == "mpls-route":
+        return str(struct.unpack(">I", key)[0])
+    family, size = _FAMILIES[obj]
+    if obj.startswith("mroute"):
+        source = key[:size]
+        return "{} {}".format(
+            socket.inet_ntop(family, source) if any(source) else "*",
+            socket.inet_ntop(family, key[size:]))
+    return "{}/{}".format(socket.inet_ntop(family, key[:size]), key[size])
+
+
+def _next_hop(obj, route):
+    if obj.startswith("mroute"):
+        return {"ifindex": route.get("ifindex"), "ifname": route.get("ifname")}
+    return route.get("next_hop", [])
+
+
+class SnapshotWriter:
+
+    """Collects the routes of the subset replies of an object, then writes
+    them as a snapshot"""
+
+    def __init__(self, obj):
+        if obj not in OBJECTS:
+            raise SnapshotException("unknown object {}".format(obj))
+        self.obj = obj
+        self._encode = _encoder(obj)
+        self._sections = {}
+        # repr of the next hops -> digest, json text by digest
+        self._digests = {}
+        self._next_hops = {}
+
+    def _digest(self, next_hop):
+        text = repr(next_hop)
+        digest = self._digests.get(text)
+        if digest is None:
+            data = json.dumps(next_hop, sort_keys=True).encode()
+            digest = hashlib.blake2b(data, digest_size=_DIGEST_SIZE).digest()
+            self._digests[text] = digest
+            self._next_hops[digest] = data
+        return digest
+
+    def _records(self, section):
+        records = self._sections.get(section)
+        if records is None:
+            records = self._sections[section] = []
+        return records
+
+    def add(self, section, route, state):
+        """Add a route entry of the reply of the state subset"""
+        self._records(section).append(
+            self._encode(route) + bytes((STATES.index(state),)) +
+            self._digest(_next_hop(self.obj, route)))
+
+    def add_reply(self, dp_id, state, text):
+        """Add the routes of the json text of a dataplane's reply to
+        "pd show dataplane <obj> <state>", decoded one at a time"""
+        if self.obj == "mpls-route":
+            for table in json_iter(text, ['objects']):
+                section = Section(dp_id, table.get('lblspc', 0), 0)
+                for route in table.get('mpls_routes', []):
+                    self.add(section, route, state)
+            return
+        if self.obj.startswith("mroute"):
+            section = Section(dp_id, 0, 0)
+            for field in json_iter(text, ['*']):
+                if 'vrf_id' in field:
+                    section = Section(dp_id, field['vrf_id'],
+                                      field.get('table', 0))
+                else:
+                    self.add(section, field, state)
+            return
+
+        # unicast tables run to millions of routes: the per-route work is
+        # kept to encoding the record
+        encode, digest = self._encode, self._digest
+        value = bytes((STATES.index(state),))
+        records = None
+        for field in json_iter(text, ['*']):
+            if 'vrf_id' in field:
+                records = self._records(Section(dp_id, field['vrf_id'],
+                                                field.get('table', 0)))
+            else:
+                if records is None:
+                    records = self._records(Section(dp_id, 0, 0))
+                records.append(encode(field) + value +
+                               digest(field.get("next_hop", [])))
+
+    def write(self, path):
+        """Write the snapshot, atomically replacing path"""
+        sections = sorted(self._sections.items())
+        width = key_size(self.obj) + _VALUE_SIZE
+        offset = _HEADER.size + len(sections) * _SECTION.size + \
+            sum(_NEXTHOPS.size + len(text)
+                for text in self._next_hops.values())
+        directory = os.path.dirname(path) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".route-snapshot")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, self.obj.encode(),
+                                     key_size(self.obj), len(sections),
+                                     len(self._next_hops)))
+                for section, records in sections:
+                    f.write(_SECTION.pack(*section, offset, len(records)))
+                    offset += len(records) * width
+                for digest, text in self._next_hops.items():
+                    f.write(_NEXTHOPS.pack(digest, len(text)) + text)
+                for _, records in sections:
+                    records.sort()
+                    f.write(b"".join(records))
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class Snapshot:
+
+    """A snapshot, memory mapped. Implements the ContextManager pattern."""
+
+    def __init__(self, path):
+        self._mm = None
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                raise SnapshotException("truncated snapshot {}".format(path))
+            self._mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        magic, obj, self.key_size, sections, next_hops = \
+            _HEADER.unpack_from(self._mm)
+        self.obj = obj.rstrip(b"\0").decode()
+        if magic != MAGIC or self.obj not in OBJECTS or \
+                self.key_size != key_size(self.obj):
+            self.close()
+            raise SnapshotException("bad snapshot {}".format(path))
+        self.width = self.key_size + _VALUE_SIZE
+        self.sections = {}
+        offset = _HEADER.size
+        for _ in range(sections):
+            dp_id, vrf_id, table, start, count = _SECTION.unpack_from(
+                self._mm, offset)
+            self.sections[Section(dp_id, vrf_id, table)] = (start, count)
+            offset += _SECTION.size
+        self._next_hops = {}
+        for _ in range(next_hops):
+            digest, length = _NEXTHOPS.unpack_from(self._mm, offset)
+            offset += _NEXTHOPS.size
+            self._next_hops[digest] = (offset, length)
+            offset += length
+        end = max([start + count * self.width
+                   for start, count in self.sections.values()], default=0)
+        if end > size:
+            self.close()
+            raise SnapshotException("truncated snapshot {}".format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def __len__(self):
+        return sum(count for _, count in self.sections.values())
+
+    def section_bytes(self, section):
+        """The records of the section, as one bytes object"""
+        start, count = self.sections.get(section, (0, 0))
+        return self._mm[start:start + count * self.width]
+
+    def next_hop(self, digest):
+        """The next hops of a digest, decoded"""
+        offset, length = self._next_hops[digest]
+        return json.loads(self._mm[offset:offset + length])
+
+    def routes(self, section):
+        """Iterate over the (route, state, next hops) of the section"""
+        data = self.section_bytes(section)
+        ks = self.key_size
+        for i in range(0, len(data), self.width):
+            record = data[i:i + self.width]
+            yield (decode_key(self.obj, record[:ks]), STATES[record[ks]],
+                   self.next_hop(record[ks + 1:]))
+
+    def counts(self):
+        """Number of routes per section and state"""
+        result = {}
+        ks = self.key_size
+        for section in self.sections:
+            data = self.section_bytes(section)
+            states = data[ks::self.width]
+            result[section] = {state: states.count(index)
+                               for index, state in enumerate(STATES)
+                               if states.count(index)}
+        return result
+
+
+def _records(data, width):
+    return [data[i:i + width] for i in range(0, len(data), width)]
+
+
+def diff(old, new):
+    """Iterate over the Changes from the old snapshot to the new one, by
+    section then route"""
+    if old.obj != new.obj:
+        raise SnapshotException(
+            "snapshots of {} and {}".format(old.obj, new.obj))
+    ks, width = old.key_size, old.width
+    for section in sorted(set(old.sections) | set(new.sections)):
+        before = old.section_bytes(section)
+        after = new.section_bytes(section)
+        if before == after:
+            continue
+        before, after = set(_records(before, width)), \
+            set(_records(after, width))
+        changes = {}
+        for record in before - after:
+            changes[record[:ks]] = [record, None]
+        for record in after - before:
+            changes.setdefault(record[:ks], [None, None])[1] = record
+        for key in sorted(changes):
+            was, now = changes[key]
+            yield Change(
+                section, decode_key(old.obj, key),
+                STATES[was[ks]] if was else None,
+                STATES[now[ks]] if now else None,
+                old.next_hop(was[ks + 1:]) if was else None,
+                new.next_hop(now[ks + 1:]) if now else None)
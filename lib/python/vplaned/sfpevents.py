@@ -0,0 +1,285 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Index of the SFP_MON events logged by the dataplane in the journal.
+
+Rather than decoding and grepping the journal of the whole boot for every
+"show" command, the events are read once, as the JSON lines journalctl
+outputs from the cursor where the previous read stopped, and kept in a binary
+file. It holds a header with that cursor, then fixed width records, one per
+event, sorted on (interface, time) so that the events of an interface and
+time range are found with a binary search of the memory mapped file, then
+the text of the events. Example:
+
+from vplaned.sfpevents import SFPEvents, format_event, index
+
+index()
+with SFPEvents() as events:
+    for event in events.events("dp0xe1", since=since_usec):
+        print(format_event(event))
+
+Events are attributed to the first dataplane interface name found in their
+message; the others are only listed with the events of all interfaces.
+Like clear stats, the index lives in /var/run and is rebuilt for each boot,
+and updates rewrite the file and rename it over the old one, so readers
+always see a complete index. The "show" commands run privileged to update
+it, the index being only readable by the group of its writer. Journal files are indexed with
+index(files=...), and exports of "journalctl --output=json" with
+update(stream).
+"""
+import collections
+import fcntl
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import subprocess
+import tempfile
+import time
+
+STORE = "/var/run/vyatta/sfp-monitor-events"
+UNIT = "vyatta-dataplane"
+TAG = b"SFP_MON"
+# Oldest events are dropped beyond this
+MAX_EVENTS = 100000
+
+MAGIC = b"VSFPEVT1"
+
+_CURSOR_SIZE = 256
+# magic, record size, record count, journal cursor
+_HEADER = struct.Struct(">8sII{}s".format(_CURSOR_SIZE))
+# interface, realtime (us), offset and size of the text; the big endian time
+# keeps the records of an interface in time order
+_RECORD = struct.Struct(">32sQII")
+_IFNAME_SIZE = 32
+
+_FIELDS = ["MESSAGE", "_HOSTNAME", "SYSLOG_IDENTIFIER", "_PID"]
+_IFNAME = re.compile(rb"(?<![\w.-])(dp\d+[\w.]*\w)")
+
+
+class SFPEventsException(Exception):
+    pass
+
+
+Event = collections.namedtuple("Event", ["time", "ifname", "text"])
+Event.__doc__ = """An event: its realtime in microseconds, interface (empty
+if none was found) and journal line, without the time"""
+
+
+def format_event(event):
+    """The event as journalctl prints it"""
+    stamp = time.strftime("%b %d %H:%M:%S",
+                          time.localtime(event.time / 1000000))
+    return "{} {}".format(stamp, event.text)
+
+
+def _bytes(value):
+    """Field value of a JSON journal entry, as bytes: a string, or an array
+    of bytes when it is not valid UTF-8"""
+    if isinstance(value, list):
+        return bytes(value)
+    return str(value).encode()
+
+
+def journal(cursor=None, files=None, unit=UNIT):
+    """Iterate over the entries of the journal of unit after cursor, one
+    JSON object per line. Only the current boot is read, unless reading the
+    given journal files."""
+    cmd = ["journalctl", "--output=json", "--no-pager", "--unit", unit,
+           "--output-fields=" + ",".join(_FIELDS)]
+    if files:
+        cmd += ["--file=" + f for f in files]
+    else:
+        cmd.append("--boot=0")
+    if cursor:
+        cmd.append("--after-cursor=" + cursor)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    try:
+        yield from proc.stdout
+    finally:
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise SFPEventsException("journalctl failed")
+
+
+def _event(entry):
+    """(ifname, time, text) of a journal entry, None if it is not an
+    SFP_MON event"""
+    message = _bytes(entry.get("MESSAGE", ""))
+    if TAG not in message:
+        return None
+    match = _IFNAME.search(message)
+    ident = _bytes(entry.get("SYSLOG_IDENTIFIER", ""))
+    if "_PID" in entry:
+        ident += b"[" + _bytes(entry["_PID"]) + b"]"
+    text = b"%s %s: %s" % (_bytes(entry.get("_HOSTNAME", "")), ident, message)
+    return (match.group(1) if match else b"",
+            int(entry["__REALTIME_TIMESTAMP"]), text)
+
+
+class SFPEvents:
+
+    """Read only view of the index, memory mapped. Implements the
+    ContextManager pattern."""
+
+    def __init__(self, path=STORE):
+        self._mm = None
+        self._count = 0
+        self.cursor = None
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        except FileNotFoundError:
+            return
+        if self._mm is None or len(self._mm) < _HEADER.size:
+            raise SFPEventsException("truncated index {}".format(path))
+        magic, size, count, cursor = _HEADER.unpack_from(self._mm)
+        if magic != MAGIC or size != _RECORD.size or \
+                len(self._mm) < _HEADER.size + count * size:
+            raise SFPEventsException("bad index {}".format(path))
+        self._count = count
+        self.cursor = cursor.rstrip(b"\0").decode() or None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _offset(self, index):
+        return _HEADER.size + index * _RECORD.size
+
+    def _search(self, key, lo=0):
+        """Index of the first record from lo whose start is not below key"""
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self._offset(mid)
+            if self._mm[offset:offset + len(key)] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _event(self, index):
+        ifname, usec, offset, size = _RECORD.unpack_from(
+            self._mm, self._offset(index))
+        return Event(usec, ifname.rstrip(b"\0").decode(),
+                     self._mm[offset:offset + size].decode(errors="replace"))
+
+    def _range(self, ifname, since, until, lo=0):
+        """Events of ifname (bytes, padded) from since up to until"""
+        first = self._search(ifname + struct.pack(">Q", since), lo)
+        last = self._search(ifname + struct.pack(">Q", until), first)
+        return (self._event(index) for index in range(first, last))
+
+    def events(self, ifname=None, since=0, until=None):
+        """Events of the interface, or of all interfaces, whose time in
+        microseconds is from since and before until, in time order"""
+        until = 2 ** 64 - 1 if until is None else until
+        if ifname is not None:
+            key = struct.pack("32s", ifname.encode())
+            return list(self._range(key, since, until))
+        ranges = []
+        index = 0
+        while index < self._count:
+            offset = self._offset(index)
+            key = self._mm[offset:offset + _IFNAME_SIZE]
+            ranges.append(self._range(key, since, until, index))
+            index = self._search(key + b"\xff" * 8, index)
+        return list(heapq.merge(*ranges))
+
+    def records(self):
+        """Iterate over the (ifname, time, text) of the events, as bytes"""
+        for index in range(self._count):
+            ifname, usec, offset, size = _RECORD.unpack_from(
+                self._mm, self._offset(index))
+            yield ifname.rstrip(b"\0"), usec, self._mm[offset:offset + size]
+
+
+def update(lines, path=STORE, max_events=MAX_EVENTS):
+    """Add the SFP_MON events of the journal entries, the lines of
+    "journalctl --output=json" following the cursor of the index, to the
+    index and move its cursor to the last entry, then return the number of
+    events added"""
+    return _update(lambda cursor: lines, path, max_events)
+
+
+def index(path=STORE, files=None, unit=UNIT, max_events=MAX_EVENTS):
+    """Index the events logged in the journal since the last update, and
+    return their number"""
+    return _update(lambda cursor: journal(cursor, files, unit), path,
+                   max_events)
+
+
+def _update(read, path, max_events):
+    """Update the index with the entries read(cursor) returns, the index
+    being locked from the read of its cursor. It is only rewritten when
+    events were added; otherwise the cursor is updated in place."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # a damaged index is rebuilt
+        try:
+            with SFPEvents(path) as store:
+                records = list(store.records())
+                cursor = store.cursor
+        except SFPEventsException:
+            records, cursor = [], None
+
+        # only the entries that may be events are decoded, and the last one
+        # for its cursor; binary messages are arrays of bytes
+        added = []
+        line = None
+        for line in read(cursor):
+            if TAG in line or b"[" in line:
+                event = _event(json.loads(line))
+                if event is not None:
+                    added.append(event)
+        if line is None:
+            return 0
+        last = json.loads(line)["__CURSOR"].encode()
+        if len(last) > _CURSOR_SIZE:
+            raise SFPEventsException("journal cursor too long")
+        if not added and cursor is not None:
+            with open(path, "r+b") as f:
+                f.seek(_HEADER.size - _CURSOR_SIZE)
+                f.write(struct.pack("{}s".format(_CURSOR_SIZE), last))
+            return 0
+
+        records += added
+        if len(records) > max_events:
+            records.sort(key=lambda r: r[1])
+            del records[:len(records) - max_events]
+        records.sort()
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".sfp-events")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, _RECORD.size, len(records), last))
+                offset = _HEADER.size + len(records) * _RECORD.size
+                for ifname, usec, text in records:
+                    f.write(_RECORD.pack(ifname, usec, offset, len(text)))
+                    offset += len(text)
+                f.writelines(text for _, _, text in records)
+            # the events are journal lines, only readable by the group of
+            # the writer, like the journal
+            os.chmod(tmp, 0o640)
+            os.rename(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return len(added)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark command throughput of the blocking Dataplane against the
+pipelined AsyncDataplane, polling local FakeDataplanes.
+
+Run from lib/python: python3 -m vplaned.tests.bench_aio
+"""
+import argparse
+import asyncio
+import contextlib
+import tempfile
+import time
+
+from vplaned import Controller
+from vplaned.aio import AsyncController
+from vplaned.tests.fakevplaned import FakeController, FakeDataplane
+
+REPLY = {"ifconfig": [{"name": "dp0s3", "statistics": {"rx_packets": 1}}]}
+
+
+def run_sync(fake, commands):
+    with Controller(fake.store_endpoint, fake.cfg_endpoint) as ctrl:
+        start = time.perf_counter()
+        for dp in ctrl.get_dataplanes():
+            with dp:
+                for _ in range(commands):
+                    dp.json_command("ifconfig dp0s3")
+        return time.perf_counter() - start
+
+
+async def run_async(fake, commands):
+    async with AsyncController(fake.store_endpoint, fake.cfg_endpoint) as ctrl:
+        start = time.perf_counter()
+        dps = [dp async for dp in ctrl.get_dataplanes()]
+        async with contextlib.AsyncExitStack() as stack:
+            for dp in dps:
+                await stack.enter_async_context(dp)
+            await asyncio.gather(*(dp.json_command("ifconfig dp0s3")
+                                   for dp in dps for _ in range(commands)))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataplanes', type=int, default=4)
+    parser.add_argument('--commands', type=int, nargs='+',
+                        default=[100, 1000])
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='dataplane round trip time (s)')
+    args = parser.parse_args()
+
+    print("{:>4} {:>9} {:>14} {:>14} {:>9}".format(
+        "dps", "commands", "sync (cmd/s)", "async (cmd/s)", "speedup"))
+    for commands in args.commands:
+        with tempfile.TemporaryDirectory() as tmp, \
+                contextlib.ExitStack() as stack:
+            dps = [stack.enter_context(FakeDataplane(
+                tmp, dp_id=i, latency=args.latency,
+                replies={None: REPLY})) for i in range(args.dataplanes)]
+            fake = stack.enter_context(
+                FakeController(tmp, dataplanes=[dp.info() for dp in dps]))
+            total = commands * args.dataplanes
+            blocking = run_sync(fake, commands)
+            pipelined = asyncio.run(run_async(fake, commands))
+            print("{:>4} {:>9} {:>14.0f} {:>14.0f} {:>8.1f}x".format(
+                args.dataplanes, total, total / blocking, total / pipelined,
+                blocking / pipelined))
+
+
+if __name__ == '__main__':
+    main()
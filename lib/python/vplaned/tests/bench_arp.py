@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark "show arp" (vplane-arp arp-all) on synthetic dataplane and
+control-plane tables, against the previous implementation which fetched the
+tables one after the other and printed with a keys() lookup per entry.
+
+The get-arp RPCs are answered by a stand-in configd client, after a delay.
+
+Run from lib/python: python3 -m vplaned.tests.bench_arp
+"""
+import argparse
+import contextlib
+import hashlib
+import os
+import runpy
+import sys
+import time
+import types
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..",
+                      "scripts", "vplane-arp")
+
+TABLES = {}
+
+
+class FakeClient:
+
+    """configd.Client answering get-arp from TABLES"""
+
+    latency = 0.0
+
+    def call_rpc_dict(self, module, rpc, input_arg):
+        time.sleep(self.latency)
+        return {"arp-entry-list": TABLES[input_arg["source"]]}
+
+
+def tables(entries):
+    """Dataplane and control-plane tables of entries addresses each, half
+    of them in both with the same MAC, the others in only one of them"""
+    dataplane = []
+    kernel = []
+    for n in range(entries):
+        ip = "10.{}.{}.{}".format(n >> 16 & 255, n >> 8 & 255, n & 255)
+        mac = "52:54:00:{:02x}:{:02x}:{:02x}".format(
+            n >> 16 & 255, n >> 8 & 255, n & 255)
+        ifname = "dp0p{}".format(n % 32)
+        if n % 4 != 3:
+            dataplane.append({"ip": ip, "hwaddr": mac, "ifname": ifname,
+                              "flags": "VALID", "state": "REACHABLE"})
+        if n % 4 != 2:
+            kernel.append({"ip": ip, "hwaddr": mac, "ifname": ifname,
+                           "flags": "VALID", "state": "STALE"})
+    return dataplane, kernel
+
+
+def legacy_show_arp_all(configd):
+    """show_arp_all() of vplane-arp, before the merge engine"""
+    zero_mac = "00:00:00:00:00:00"
+    output_format = "{:16} {:17} {:18} {:18} {}"
+
+    cfg = configd.Client()
+    data = cfg.call_rpc_dict("vyatta-arp-v1", "get-arp",
+                             {"source": "dataplane"})
+    arp_list_dp = data["arp-entry-list"]
+    data = cfg.call_rpc_dict("vyatta-arp-v1", "get-arp",
+                             {"source": "control-plane"})
+    arp_list_kernel = data["arp-entry-list"]
+
+    arp_dict_kernel = {value["ip"]: value for value in arp_list_kernel}
+
+    print(output_format.format("IP Address", "HW address",
+                               "Dataplane", "Controller", "Device"))
+
+    for entry in arp_list_dp:
+        kentry = arp_dict_kernel[entry["ip"]
+                                 ] if entry["ip"] in arp_dict_kernel.keys() else None
+
+        entry_flag_state = entry["flags"] + \
+            (" [" + entry["state"] + "]" if entry["state"] else "")
+
+        if kentry and (kentry["hwaddr"] == entry["hwaddr"] or
+                       kentry["hwaddr"] == zero_mac):
+            kentry_flag_state = kentry["flags"] + \
+                (" [" + kentry["state"] + "]" if kentry["state"] else "")
+
+            print(output_format.format(
+                entry["ip"], entry["hwaddr"], entry_flag_state,
+                kentry_flag_state, entry["ifname"]))
+            arp_dict_kernel.pop(entry["ip"])
+        else:
+            print(output_format.format(
+                entry["ip"], entry["hwaddr"], entry_flag_state, "",
+                entry["ifname"]))
+
+    for ip in arp_dict_kernel.keys():
+        kentry_flag_state = arp_dict_kernel[ip]["flags"] + \
+            (" [" + arp_dict_kernel[ip]["state"] +
+             "]" if arp_dict_kernel[ip]["state"] else "")
+        print(output_format.format(
+            ip, arp_dict_kernel[ip]["hwaddr"], "", kentry_flag_state,
+            arp_dict_kernel[ip]["ifname"]))
+
+
+class Digest:
+
+    """stdout replacement keeping only a digest of the output"""
+
+    def __init__(self):
+        self._hash = hashlib.sha1()
+
+    def write(self, text):
+        self._hash.update(text.encode())
+
+    def flush(self):
+        pass
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def timed(fn, *args):
+    out = Digest()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        fn(*args)
+    return time.perf_counter() - start, out.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, nargs='+',
+                        default=[100000, 1000000])
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='get-arp RPC time (s)')
+    args = parser.parse_args()
+
+    configd = types.ModuleType("vyatta.configd")
+    configd.Client = FakeClient
+    vyatta = types.ModuleType("vyatta")
+    vyatta.configd = configd
+    sys.modules.setdefault("vyatta", vyatta)
+    sys.modules.setdefault("vyatta.configd", configd)
+    FakeClient.latency = args.latency
+    script = runpy.run_path(SCRIPT, run_name="bench")
+
+    print("{:>9} {:>12} {:>12} {:>14} {:>9}".format(
+        "entries", "legacy (s)", "merge (s)", "prefix/16 (s)", "speedup"))
+    for entries in args.entries:
+        TABLES["dataplane"], TABLES["control-plane"] = tables(entries)
+        legacy, legacy_out = timed(legacy_show_arp_all, configd)
+        merged, merged_out = timed(script["show_arp_all"], None, None)
+        assert legacy_out == merged_out
+        prefix, _ = timed(script["show_arp_all"], None, None, "10.0.0.0/16")
+        print("{:>9} {:>12.3f} {:>12.3f} {:>14.3f} {:>8.1f}x".format(
+            entries, legacy, merged, prefix, legacy / merged))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark a commit of hundreds of configuration nodes, each running a
+configd script which, like vplane-storm-control, imports vplaned and the
+protobuf modules and stores one command to a local FakeController: with an
+interpreter started for every node, against the commit agent, called through
+vplane-commit-exec (built with cc when it is available) and through run().
+
+Run from lib/python: python3 -m vplaned.tests.bench_commitagent
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from vplaned.commitagent import run
+from vplaned.tests.fakevplaned import FakeController
+
+TOP = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..")
+AGENT = os.path.join(TOP, "scripts", "vplane-commit-agent")
+CLIENT = os.path.join(TOP, "lib", "commit-agent", "vplane-commit-exec.c")
+
+NODE = """#!{python}
+import argparse
+import logging
+import os
+import sys
+
+from vplaned import Controller
+try:
+    from vyatta.proto import MacLimitConfig_pb2  # noqa: F401
+except ImportError:
+    pass
+
+parser = argparse.ArgumentParser(description="bench node")
+parser.add_argument("--dev", required=True)
+parser.add_argument("--vlan", type=int, required=True)
+args = parser.parse_args()
+logging.basicConfig(level=logging.INFO, format="node: %(message)s")
+
+key = "storm-ctl {{}} vlan {{}}".format(args.dev, args.vlan)
+with Controller(os.environ["BENCH_STORE"], os.environ["BENCH_CFG"]) as ctrl:
+    ctrl.store(key, "storm-ctl SET {{}} vlan {{}} profile p1".format(
+        args.dev, args.vlan), args.dev, os.environ["COMMIT_ACTION"])
+sys.exit(0)
+"""
+
+
+def commit(fake, nodes, call):
+    """Run the script of every node with call(argv), return the time taken"""
+    fake.stored.clear()
+    start = time.perf_counter()
+    for vlan in range(1, nodes + 1):
+        status = call(["--dev", "dp0xe1", "--vlan", str(vlan)])
+        if status != 0:
+            raise RuntimeError("node failed with status {}".format(status))
+    elapsed = time.perf_counter() - start
+    if len(fake.stored) != nodes:
+        raise RuntimeError("{} keys stored".format(len(fake.stored)))
+    return elapsed
+
+
+def build_client(directory):
+    cc = shutil.which("cc") or shutil.which("gcc")
+    if cc is None:
+        return None
+    client = os.path.join(directory, "vplane-commit-exec")
+    subprocess.run([cc, "-O2", "-o", client, CLIENT], check=True)
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeController(tmp) as fake:
+        scripts = os.path.join(tmp, "sbin")
+        os.mkdir(scripts)
+        node = os.path.join(scripts, "vplane-bench-node")
+        with open(node, "w") as f:
+            f.write(NODE.format(python=sys.executable))
+        os.chmod(node, 0o755)
+        socket_path = os.path.join(tmp, "agent.socket")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path),
+                   COMMIT_ACTION="SET", BENCH_STORE=fake.store_endpoint,
+                   BENCH_CFG=fake.cfg_endpoint,
+                   VPLANE_COMMIT_AGENT_SOCKET=socket_path)
+
+        def interpreter(argv):
+            return subprocess.run([node] + argv, env=env).returncode
+
+        results = [("interpreter per node",
+                    commit(fake, args.nodes, interpreter))]
+
+        agent = subprocess.Popen([sys.executable, AGENT, "--socket",
+                                  socket_path, "--script-dir", scripts],
+                                 env=env)
+        try:
+            while not os.path.exists(socket_path):
+                if agent.poll() is not None:
+                    raise RuntimeError("the agent exited")
+                time.sleep(0.01)
+
+            client = build_client(tmp)
+            if client is not None:
+                def exec_client(argv):
+                    return subprocess.run([client, node] + argv,
+                                          env=env).returncode
+                results.append(("agent, vplane-commit-exec",
+                                commit(fake, args.nodes, exec_client)))
+
+            def run_client(argv):
+                return run([node] + argv, env=env, path=socket_path)
+            results.append(("agent, run()",
+                            commit(fake, args.nodes, run_client)))
+        finally:
+            agent.terminate()
+            agent.wait()
+
+    print("{} nodes".format(args.nodes))
+    base = results[0][1]
+    for name, elapsed in results:
+        print("{:26} {:7.2f} s {:7.2f} ms/node {:6.1f}x".format(
+            name, elapsed, elapsed * 1000 / args.nodes, base / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark Vyatta::DataplaneStats collecting interface statistics from
+local FakeDataplanes, one ifconfig per interface in lock-step against the
+bulk collection of get_dataplane_interfaces().
+
+Needs perl with the runtime dependencies of lib/Vyatta/DataplaneStats.pm.
+
+Run from lib/python: python3 -m vplaned.tests.bench_dataplane_stats
+"""
+import argparse
+import contextlib
+import os
+import subprocess
+import tempfile
+
+from vplaned.tests.fakevplaned import FakeDataplane
+
+PERL_LIB = os.path.join(os.path.dirname(__file__), "..", "..", "..")
+
+# Time both collections, reading the interface count and the dataplane
+# endpoints from the command line
+TIMER = r'''
+use strict;
+use warnings;
+use JSON qw( decode_json );
+use Time::HiRes qw( time );
+use Vyatta::Dataplane;
+use Vyatta::DataplaneStats;
+
+my ( $interfaces, @endpoints ) = @ARGV;
+my ( @dp_ids, @dp_conns );
+for my $dp_id ( 0 .. $#endpoints ) {
+    $dp_conns[$dp_id] = new Vyatta::Dataplane( undef, $endpoints[$dp_id] );
+    push @dp_ids, $dp_id;
+}
+my @names = map { "dp0p$_" } 0 .. $interfaces - 1;
+
+my $start = time;
+my %legacy;
+foreach my $ifname (@names) {
+    my $response = vplane_exec_cmd( "ifconfig $ifname", \@dp_ids, \@dp_conns, 1 );
+    for my $dp_id (@dp_ids) {
+        my $decoded = decode_json( $response->[$dp_id] );
+        $legacy{$ifname}->[$dp_id] = $decoded->{interfaces}->[0];
+    }
+}
+my $legacy = time - $start;
+
+$start = time;
+my $bulk = Vyatta::DataplaneStats::get_dataplane_interfaces( \@names,
+    "ifconfig", \@dp_ids, \@dp_conns );
+my $elapsed = time - $start;
+die "bulk collection missed interfaces\n"
+  unless keys %{$bulk} == keys %legacy;
+
+print "$legacy $elapsed\n";
+'''
+
+
+def ifinfo(port):
+    return {"name": "dp0p{}".format(port), "ifindex": 10 + port,
+            "port": port, "ether": "52:54:00:00:00:01",
+            "statistics": {"rx_bytes": port * 1000, "tx_bytes": port * 900,
+                           "rx_packets": port, "tx_packets": port,
+                           "rx_pps": 0, "rx_pps_avg": [0, 0, 0]},
+            "xstatistics": {"rx_missed": 0}}
+
+
+def ifconfig(interfaces):
+    """ifconfig replies, for one interface or all of them"""
+    def reply(cmd):
+        args = cmd.split()[1:]
+        if args:
+            return {"interfaces": [ifinfo(int(args[0][len("dp0p"):]))]}
+        return {"interfaces": [ifinfo(port) for port in range(interfaces)]}
+    return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataplanes', type=int, default=4)
+    parser.add_argument('--interfaces', type=int, nargs='+',
+                        default=[10, 100, 1000, 2000])
+    parser.add_argument('--latency', type=float, default=0.0005,
+                        help='dataplane round trip time (s)')
+    args = parser.parse_args()
+
+    print("{:>4} {:>10} {:>12} {:>12} {:>9}".format(
+        "dps", "interfaces", "legacy (s)", "bulk (s)", "speedup"))
+    for interfaces in args.interfaces:
+        with tempfile.TemporaryDirectory() as tmp, \
+                contextlib.ExitStack() as stack:
+            dps = [stack.enter_context(FakeDataplane(
+                tmp, dp_id=i, latency=args.latency,
+                replies={None: ifconfig(interfaces)}))
+                for i in range(args.dataplanes)]
+            out = subprocess.check_output(
+                ["perl", "-I", PERL_LIB, "-e", TIMER, str(interfaces)] +
+                [dp.control for dp in dps], universal_newlines=True)
+            legacy, bulk = (float(t) for t in out.split())
+            print("{:>4} {:>10} {:>12.3f} {:>12.3f} {:>8.1f}x".format(
+                args.dataplanes, interfaces, legacy, bulk, legacy / bulk))
+
+
+if __name__ == '__main__':
+    main()
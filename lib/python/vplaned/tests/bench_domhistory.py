@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark the DOM history of vyatta-xcvr for many ports: the cost of
+recording a poll of all of them, the disk used, and queries and the summary
+of the "show system sfp monitoring history" command over full rings (a week
+of samples and months of hourly means), with the memory they take.
+
+The rings are filled by writing their columns directly, recording months of
+polls one at a time would take as long as the polls themselves.
+
+Run from lib/python: python3 -m vplaned.tests.bench_domhistory
+"""
+import argparse
+import array
+import math
+import os
+import struct
+import tempfile
+import time
+import tracemalloc
+
+from vplaned.domhistory import DOMHistory, HOURLY, RAW, summary
+
+
+def status(ports, now):
+    return [{"name": "dp0xe{}".format(port), "xcvr_info": {
+        "temperature_C": 30.0 + math.sin(now / 86400), "voltage_V": 3.3,
+        "rx_power_mW": 0.5, "tx_power_mW": 0.6, "laser_bias": 6.0,
+        "low_rx_power_alarm_thresh": 0.05}} for port in range(ports)]
+
+
+def fill(dom, ring, end, period, port, origin):
+    """Fill the ring with samples every period seconds up to end"""
+    capacity = dom._capacities[ring]
+    times = array.array("I", range(end - capacity * period, end, period))
+    columns = [times]
+    for measure, _ in dom.columns:
+        if measure == "rx_power" and port == 0:
+            # a port degrading by 0.05 dB a day since origin
+            values = [0.5 * 10 ** (-0.005 * (t - origin) / 86400)
+                      for t in times]
+        else:
+            values = [{"temperature": 30.0, "voltage": 3.3, "rx_power": 0.5,
+                       "tx_power": 0.6, "bias": 6.0}[measure]] * capacity
+        columns.append(array.array("f", values))
+    for index, column in enumerate(columns):
+        offset = dom._column(ring, index)
+        dom._mm[offset:offset + capacity * 4] = column.tobytes()
+    struct.pack_into("<II", dom._mm, 16 + ring * 12 + 4, capacity, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ports', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        history = DOMHistory(tmp)
+        now = int(time.time()) // 3600 * 3600
+        start = time.perf_counter()
+        history.record(status(args.ports, now - 600), now=now - 600)
+        print("first poll, {} ports: {:.3f} s".format(
+            args.ports, time.perf_counter() - start))
+        start = time.perf_counter()
+        history.record(status(args.ports, now - 300), now=now - 300)
+        print("poll: {:.3f} s".format(time.perf_counter() - start))
+
+        for port, dom in enumerate(history._files.values()):
+            origin = now - dom._capacities[HOURLY] * 3600
+            fill(dom, HOURLY, now, 3600, port, origin)
+            fill(dom, RAW, now, history.interval, port, origin)
+        history.close()
+        size = sum(os.path.getsize(os.path.join(tmp, f))
+                   for f in os.listdir(tmp))
+        print("disk: {:.1f} MB, {:.0f} kB per port".format(
+            size / 1e6, size / args.ports / 1e3))
+
+        start = time.perf_counter()
+        with history.open("dp0xe0") as dom:
+            times, (rx,) = dom.read([("rx_power", 0)], now - 30 * 86400,
+                                    ring=HOURLY)
+        elapsed = time.perf_counter() - start
+        print("one port, 30 days hourly: {:.4f} s, {} samples".format(
+            elapsed, len(times)))
+
+        start = time.perf_counter()
+        entries = summary(history, now=now)
+        elapsed = time.perf_counter() - start
+        # memory measured separately, tracing slows the summary down
+        tracemalloc.start()
+        summary(history, now=now)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        degrading = [e for e in entries if e["outliers"]]
+        print("summary of {} ports: {:.2f} s, peak {:.1f} MB, outliers {}, "
+              "{} alarm in {:.0f} days".format(
+                  len(entries), elapsed, peak / 1e6,
+                  [e["ifname"] for e in degrading], entries[0]["ifname"],
+                  entries[0]["time-to-alarm"] / 86400))
+
+
+if __name__ == '__main__':
+    main()
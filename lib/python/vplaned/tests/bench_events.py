@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark watching interface state by polling json_command() against
+subscribing to pushed events, with a FakeDataplane and a FakePublisher.
+
+An interface flaps every --period seconds. Polling at --interval seconds
+sees the state transitions that outlast the interval and costs one request
+per poll; the subscription receives every transition, and the delay from
+publication to delivery is reported. The throughput case publishes as fast
+as possible to a subscriber with a bounded queue and reports the events
+delivered and dropped.
+
+Run from lib/python: python3 -m vplaned.tests.bench_events
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+
+from vplaned import Controller
+from vplaned.tests.fakevplaned import FakeController, FakeDataplane, \
+    FakePublisher
+
+
+def flap(pub, state, transitions, period):
+    """Toggle the interface state, publishing every transition"""
+    for n in range(1, transitions + 1):
+        state["transition"] = n
+        state["state"] = "up" if n % 2 else "down"
+        pub.publish("link", {"dp0s3": dict(state), "time": time.time()},
+                    key="dp0s3")
+        time.sleep(period)
+
+
+def poll(ctrl, state, transitions, interval):
+    """Transitions seen and requests made polling the dataplane"""
+    seen = set()
+    requests = 0
+    dp, = ctrl.get_dataplanes()
+    with dp:
+        while len(seen) < transitions and \
+                state["transition"] < transitions:
+            seen.add(dp.json_command("ifconfig dp0s3")["transition"])
+            requests += 1
+            time.sleep(interval)
+    return len(seen - {0}), requests
+
+
+def subscribe(ctrl, pub, transitions, start):
+    """Transitions seen and delivery delays of a subscription"""
+    delays = []
+    with ctrl.subscribe(["link"], pub.events_endpoint,
+                        pub.snapshot_endpoint) as events:
+        pub.wait_subscribed()
+        start.set()
+        for event in iter(lambda: events.recv(timeout=1), None):
+            delays.append(time.time() - event.json()["time"])
+            if event.json()["dp0s3"]["transition"] == transitions:
+                break
+    return len(delays), delays
+
+
+def throughput(ctrl, pub, count, queue_size):
+    """Events received per second by a subscriber reading while they are
+    published, and its statistics. A last event, once the others had time
+    to arrive, reveals the events dropped at the end."""
+    with ctrl.subscribe(["bench"], pub.events_endpoint,
+                        pub.snapshot_endpoint,
+                        queue_size=queue_size) as events:
+        pub.wait_subscribed()
+
+        def consume():
+            for event in iter(lambda: events.recv(timeout=5), None):
+                if event.body == b"end" and not event.snapshot:
+                    break
+
+        consumer = threading.Thread(target=consume)
+        body = b"x" * 100
+        start = time.perf_counter()
+        consumer.start()
+        for n in range(count):
+            pub.publish("bench", body, key=n % 16)
+        time.sleep(0.1)
+        pub.publish("bench", b"end")
+        consumer.join()
+        return events.stats(), time.perf_counter() - start - 0.1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transitions', type=int, default=500)
+    parser.add_argument('--period', type=float, default=0.002,
+                        help='time between state transitions (s)')
+    parser.add_argument('--interval', type=float, default=0.01,
+                        help='polling interval (s)')
+    parser.add_argument('--events', type=int, default=200000)
+    args = parser.parse_args()
+
+    state = {"transition": 0, "state": "up"}
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeDataplane(tmp, replies={"ifconfig dp0s3":
+                                        lambda cmd: dict(state)}) as dp, \
+            FakeController(tmp, dataplanes=[dp.info()]) as fake, \
+            FakePublisher(tmp) as pub, \
+            Controller(fake.store_endpoint, fake.cfg_endpoint) as ctrl:
+        flapper = threading.Thread(target=flap, args=(
+            pub, state, args.transitions, args.period))
+        flapper.start()
+        seen, requests = poll(ctrl, state, args.transitions, args.interval)
+        flapper.join()
+        print("poll every {:.0f} ms: {}/{} transitions seen, {} dataplane "
+              "requests".format(args.interval * 1000, seen, args.transitions,
+                                requests))
+
+        state["transition"] = 0
+        started = threading.Event()
+        flapper = threading.Thread(target=lambda: started.wait() and flap(
+            pub, state, args.transitions, args.period))
+        flapper.start()
+        seen, delays = subscribe(ctrl, pub, args.transitions, started)
+        flapper.join()
+        delays.sort()
+        print("subscription: {}/{} transitions seen, 0 dataplane requests, "
+              "delay p50 {:.3f} ms p99 {:.3f} ms".format(
+                  seen, args.transitions, statistics.median(delays) * 1000,
+                  delays[int(len(delays) * 0.99)] * 1000))
+
+        for queue_size in (1000, 100000):
+            stats, elapsed = throughput(ctrl, pub, args.events, queue_size)
+            print("throughput queue={}: {:.0f} events/s, {} delivered, {} "
+                  "dropped, {} snapshots".format(
+                      queue_size, stats["events"] / elapsed, stats["events"],
+                      stats["dropped"], stats["snapshots"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark the time and memory needed to build the Dataplane and Interface
+objects of a large synthetic GETVPCONFIG reply.
+
+Run from lib/python: python3 -m vplaned.tests.bench_model
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from vplaned import Dataplane
+from vplaned.tests.bench_topology import topology
+
+
+def build(raw, access, repeat=5):
+    """Parse the reply and build the dataplanes, then run access on them.
+    Return the best time taken, and the memory held by the objects built,
+    which is measured separately as tracing skews the timings."""
+    elapsed = []
+    for _ in range(repeat):
+        config = json.loads(raw)
+        start = time.perf_counter()
+        dps = [Dataplane(None, dp) for dp in config["dataplanes"]]
+        access(dps)
+        elapsed.append(time.perf_counter() - start)
+
+    config = json.loads(raw)
+    tracemalloc.start()
+    dps = [Dataplane(None, dp) for dp in config["dataplanes"]]
+    access(dps)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(elapsed), size
+
+
+def control_only(dps):
+    for dp in dps:
+        dp.control
+
+
+def one_interface(dps):
+    for dp in dps:
+        next(iter(dp.interfaces.values())).state
+
+
+def all_interfaces(dps):
+    for dp in dps:
+        for intf in dp.interfaces.values():
+            intf.state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataplanes', type=int, default=64)
+    parser.add_argument('--interfaces', type=int, default=10000)
+    args = parser.parse_args()
+
+    raw = json.dumps({"dataplanes": topology(args.dataplanes,
+                                             args.interfaces)})
+    print("{} dataplanes, {} interfaces".format(args.dataplanes,
+                                                args.interfaces))
+    print("{:<24} {:>10} {:>10}".format("", "ms", "KiB"))
+    for name, access in (("dp.control only", control_only),
+                         ("one interface per dp", one_interface),
+                         ("all interfaces", all_interfaces)):
+        elapsed, size = build(raw, access)
+        print("{:<24} {:>10.2f} {:>10.0f}".format(name, elapsed * 1000,
+                                                  size / 1024))
+
+
+if __name__ == '__main__':
+    main()
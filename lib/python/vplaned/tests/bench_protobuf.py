@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark bulk protobuf commits, as vyatta-mac-limit and
+vyatta-sfp-permit-list make them, against a local FakeTopology: the client
+CPU time and the bytes sent per message of store() with the previous
+envelope code, which imported the protobuf modules on every call, of
+store() and batches now, and of the same messages sent to the dataplane in
+raw frames by pb_command().
+
+Needs google.protobuf and the vyatta.proto modules.
+
+Run from lib/python: python3 -m vplaned.tests.bench_protobuf
+"""
+import argparse
+import tempfile
+import time
+import unittest.mock
+
+import vplaned.vplaned
+from vplaned import Controller
+from vplaned.tests.fakevplaned import FakeTopology
+from vyatta.proto import MacLimitConfig_pb2, SFPMonitor_pb2
+
+
+def legacy_store_leaf(path, cmd, interface, action, cmd_name):
+    """_store_leaf() before the envelope classes were cached"""
+    leaf = {'__INTERFACE__': interface}
+    if cmd_name is not None:
+        import base64
+        import google.protobuf  # noqa: F401
+        import vyatta.proto.DataplaneEnvelope_pb2
+        import vyatta.proto.VPlanedEnvelope_pb2
+
+        de = vyatta.proto.DataplaneEnvelope_pb2.DataplaneEnvelope()
+        de.type = cmd_name
+        de.msg = cmd.SerializeToString()
+
+        ve = vyatta.proto.VPlanedEnvelope_pb2.VPlanedEnvelope()
+        ve.key = path
+        ve.interface = interface
+        if action == "SET":
+            ve.action = vyatta.proto.VPlanedEnvelope_pb2.VPlanedEnvelope.SET
+        else:
+            ve.action = vyatta.proto.VPlanedEnvelope_pb2.VPlanedEnvelope.DELETE
+        ve.msg = de.SerializeToString()
+
+        cmd = 'protobuf ' + base64.b64encode(ve.SerializeToString()).decode()
+        leaf["__PROTOBUF__"] = True
+    leaf["__" + action + "__"] = cmd
+    return leaf
+
+
+def mac_limits(entries):
+    """(key, message, type) of the interface VLAN limits vyatta-mac-limit
+    stores"""
+    commits = []
+    for n in range(entries):
+        cfg = MacLimitConfig_pb2.MacLimitConfig()
+        cfg.ifvlan.action = MacLimitConfig_pb2.MacLimitConfig.SET
+        cfg.ifvlan.profile = "profile{}".format(n % 8)
+        cfg.ifvlan.vlan = n % 4094 + 1
+        cfg.ifvlan.ifname = "dp0p{}".format(n // 4094)
+        commits.append(("mac-limit profile dp0p{} {}".format(
+            n // 4094, n % 4094 + 1), cfg, "vyatta:maclimit"))
+    return commits
+
+
+def permit_lists(entries, sfps=16):
+    """(key, message, type) of the SFP permit lists vyatta-sfp-permit-list
+    stores"""
+    commits = []
+    for n in range(entries):
+        cfg = SFPMonitor_pb2.SfpPermitConfig()
+        cfg.list.action = SFPMonitor_pb2.SfpPermitConfig.SET
+        cfg.list.name = "list{}".format(n)
+        for index in range(sfps):
+            sfp = cfg.list.SFPs.add()
+            sfp.index = index + 1
+            sfp.part = "part-{}".format(index)
+            sfp.vendor = "vendor"
+            sfp.oui = "00:11:22"
+            sfp.rev = "A"
+        commits.append(("sfp permit list list{}".format(n), cfg,
+                        "vyatta:sfppermitlist"))
+    return commits
+
+
+def run(topology, commit):
+    """CPU time of the client thread and bytes received by the fake servers
+    of commit"""
+    before = topology.stats()["bytes_in"]
+    start = time.thread_time()
+    commit()
+    return time.thread_time() - start, topology.stats()["bytes_in"] - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mac-limits', type=int, default=4000)
+    parser.add_argument('--permit-lists', type=int, default=500)
+    args = parser.parse_args()
+
+    print("{:<26} {:<16} {:>14} {:>14}".format(
+        "commit", "mode", "cpu (us/msg)", "bytes/msg"))
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeTopology(tmp) as topology, \
+            Controller(topology.store_endpoint,
+                       topology.cfg_endpoint) as ctrl:
+        dp, = ctrl.get_dataplanes()
+
+        def store(commits):
+            for key, cfg, cmd_name in commits:
+                ctrl.store(key, cfg, "ALL", "SET", cmd_name=cmd_name)
+
+        def legacy(commits):
+            with unittest.mock.patch.object(vplaned.vplaned, "_store_leaf",
+                                            legacy_store_leaf):
+                store(commits)
+
+        def batch(commits):
+            with ctrl.batch():
+                store(commits)
+
+        def raw(commits):
+            with dp:
+                for _, cfg, cmd_name in commits:
+                    dp.pb_command(cmd_name, cfg)
+
+        for name, commits in (
+                ("mac-limit x{}".format(args.mac_limits),
+                 mac_limits(args.mac_limits)),
+                ("sfp permit-list x{}".format(args.permit_lists),
+                 permit_lists(args.permit_lists))):
+            for mode, commit in (("store, legacy", legacy), ("store", store),
+                                 ("store batch", batch),
+                                 ("pb_command", raw)):
+                cpu, size = run(topology, lambda: commit(commits))
+                print("{:<26} {:<16} {:>14.1f} {:>14.0f}".format(
+                    name, mode, cpu / len(commits) * 1e6,
+                    size / len(commits)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark the commit of interface VLAN lists by vplane-storm-control and
+vyatta-mac-limit against a local FakeTopology, with the configd calls
+answered by a stand-in client after a delay: reconciliation from one read
+of each database against the previous per-VLAN status and value queries,
+and against one script run per changed VLAN for mac-limit (without the
+interpreter start up of each run, so a lower bound).
+
+The resulting stores are checked to be the same. The mac-limit cases need
+the vyatta.proto modules.
+
+Run from lib/python: python3 -m vplaned.tests.bench_reconcile
+"""
+import argparse
+import os
+import runpy
+import sys
+import tempfile
+import time
+import types
+
+from vplaned import Controller, StoreShadow
+from vplaned.tests.fakevplaned import FakeTopology
+
+SCRIPTS = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..",
+                       "scripts")
+
+STORM_PATH = "interfaces dataplane dp0p1 storm-control vlan"
+MAC_PATH = ("interfaces dataplane dp0p1 switch-group port-parameters "
+            "vlan-parameters mac-limit vlan")
+
+
+class FakeClient:
+
+    """configd.Client answering from the VLAN lists of TREES, a map of
+    database to list path to {vlan: profile}"""
+
+    RUNNING, CANDIDATE = "running", "candidate"
+    UNCHANGED, CHANGED, ADDED, DELETED = range(4)
+    latency = 0.0
+    calls = 0
+    trees = {}
+
+    def _call(self):
+        FakeClient.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _split(self, path):
+        """List path and VLAN of a path to a profile leaf"""
+        items = path.split(" ")
+        return " ".join(items[:-2]), int(items[-2])
+
+    def tree_get_dict(self, path, db=CANDIDATE):
+        self._call()
+        if path.endswith(" profile"):
+            path, vlan = self._split(path)
+            return {"profile": self.trees[db][path][vlan]}
+        vlans = self.trees[db].get(path)
+        if not vlans:
+            raise Exception("{} does not exist".format(path))
+        return {"vlan": [{"vlan-id": vlan, "profile": profile}
+                         for vlan, profile in vlans.items()]}
+
+    def node_get_status(self, db, path):
+        self._call()
+        path, vlan = self._split(path)
+        running = self.trees[self.RUNNING].get(path, {}).get(vlan)
+        candidate = self.trees[self.CANDIDATE].get(path, {}).get(vlan)
+        if running == candidate:
+            return self.UNCHANGED
+        if running is None:
+            return self.ADDED
+        if candidate is None:
+            return self.DELETED
+        return self.CHANGED
+
+
+def legacy_storm_ctl_vlans(configd, ifname):
+    """process_storm_ctl_dev_vlan_cfg() of vplane-storm-control, before
+    reconciliation"""
+    CONFIG_CANDIDATE = configd.Client.CANDIDATE
+    CONFIG_RUNNING = configd.Client.RUNNING
+
+    client = configd.Client()
+    path = "interfaces dataplane {} storm-control vlan".format(ifname)
+    with Controller() as controller, controller.batch():
+        try:
+            vlans = client.tree_get_dict(path, CONFIG_RUNNING)['vlan']
+        except BaseException:
+            vlans = {}
+        for vlan in vlans:
+            vlan_id = vlan['vlan-id']
+            status = client.node_get_status(
+                CONFIG_RUNNING, "{} {} profile".format(path, vlan_id))
+            if status == client.DELETED or status == client.CHANGED:
+                key = "storm-ctl {} {}".format(ifname, vlan_id)
+                cmd = "storm-ctl DELETE {} vlan {}".format(ifname, vlan_id)
+                controller.store(key, cmd, ifname, "DELETE")
+
+        try:
+            vlans = client.tree_get_dict(path, CONFIG_CANDIDATE)['vlan']
+        except BaseException:
+            vlans = {}
+        for vlan in vlans:
+            vlan_id = vlan['vlan-id']
+            status = client.node_get_status(
+                CONFIG_CANDIDATE, "{} {} profile".format(path, vlan_id))
+            if status == client.CHANGED or status == client.ADDED:
+                profile = client.tree_get_dict(
+                    "{} {} profile".format(path, vlan_id))['profile']
+                key = "storm-ctl {} {}".format(ifname, vlan_id)
+                cmd = "storm-ctl SET {} vlan {} profile {}".format(
+                    ifname, vlan_id, profile)
+                controller.store(key, cmd, ifname, "SET")
+
+
+def legacy_mac_limit_vlans(script, ifname):
+    """The configd:update and configd:delete actions of the mac-limit VLAN
+    profile leaves, before reconciliation: one script run per changed VLAN"""
+    running = FakeClient.trees[FakeClient.RUNNING].get(MAC_PATH, {})
+    candidate = FakeClient.trees[FakeClient.CANDIDATE].get(MAC_PATH, {})
+    for vlan, profile in running.items():
+        if vlan not in candidate:
+            with Controller() as controller:
+                script["config_profile"](controller, "DELETE", ifname, vlan,
+                                         profile, None)
+    for vlan, profile in candidate.items():
+        if running.get(vlan) != profile:
+            with Controller() as controller:
+                script["config_profile"](controller, "SET", ifname, vlan,
+                                         profile, None)
+
+
+def workloads(vlans):
+    """(name, running, candidate) VLAN lists: a trunk of vlans VLANs
+    created, reshuffled and with a single VLAN changed"""
+    trunk = {vlan: "profile{}".format(vlan % 4) for vlan in range(1, vlans + 1)}
+    shuffled = {vlan: "profile{}".format(vlan % 3)
+                for vlan in range(vlans // 8, vlans + 1)}
+    single = dict(trunk)
+    single[1] = "profile9"
+    return [("create", {}, trunk), ("reshuffle", trunk, shuffled),
+            ("single change", trunk, single)]
+
+
+def install_configd():
+    configd = types.ModuleType("vyatta.configd")
+    configd.Client = FakeClient
+    try:
+        import vyatta
+    except ImportError:
+        vyatta = types.ModuleType("vyatta")
+        vyatta.__path__ = []
+        sys.modules["vyatta"] = vyatta
+    vyatta.configd = configd
+    sys.modules["vyatta.configd"] = configd
+    return configd
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vlans', type=int, default=4000)
+    parser.add_argument('--latency', type=float, default=0.0002,
+                        help='configd call time (s)')
+    args = parser.parse_args()
+
+    configd = install_configd()
+    FakeClient.latency = args.latency
+    storm = runpy.run_path(os.path.join(SCRIPTS, "vplane-storm-control"),
+                           run_name="bench")
+    try:
+        mac = runpy.run_path(os.path.join(SCRIPTS, "vyatta-mac-limit"),
+                             run_name="bench")
+    except ImportError as e:
+        print("Skipping mac-limit: {}".format(e))
+        mac = None
+
+    cases = [("storm-control", STORM_PATH,
+              lambda: legacy_storm_ctl_vlans(configd, "dp0p1"),
+              lambda: storm["process_storm_ctl_dev_vlan_cfg"]("dp0p1"))]
+    if mac is not None:
+        def mac_limit_vlans():
+            with Controller() as controller:
+                mac["config_vlans"](controller, "dp0p1")
+        cases.append(("mac-limit", MAC_PATH,
+                      lambda: legacy_mac_limit_vlans(mac, "dp0p1"),
+                      mac_limit_vlans))
+
+    fmt = "{:<14} {:<14} {:<10} {:>9} {:>9} {:>10}"
+    print(fmt.format("script", "workload", "mode", "time (s)",
+                     "configd", "messages"))
+    defaults = Controller.__init__.__defaults__
+    tmp = tempfile.TemporaryDirectory()
+    # Keep the store shadow of the scripts out of the system directory
+    StoreShadow.__init__.__defaults__ = (
+        os.path.join(tmp.name, "store.shadow"),) + \
+        StoreShadow.__init__.__defaults__[1:]
+    for script, path, legacy, reconcile in cases:
+        for workload, running, candidate in workloads(args.vlans):
+            FakeClient.trees = {FakeClient.RUNNING: {path: running},
+                                FakeClient.CANDIDATE: {path: candidate}}
+            stored = []
+            for mode, commit in (("legacy", legacy),
+                                 ("reconcile", reconcile)):
+                with FakeTopology(tmp.name) as topology:
+                    Controller.__init__.__defaults__ = (
+                        topology.store_endpoint,
+                        topology.cfg_endpoint) + defaults[2:]
+                    FakeClient.calls = 0
+                    before = topology.stats()["messages"]
+                    start = time.perf_counter()
+                    commit()
+                    elapsed = time.perf_counter() - start
+                    messages = topology.stats()["messages"] - before
+                    stored.append((topology.controller.stored,
+                                   topology.controller.envelopes))
+                Controller.__init__.__defaults__ = defaults
+                print(fmt.format(script, workload, mode,
+                                 "{:.3f}".format(elapsed), FakeClient.calls,
+                                 messages), flush=True)
+            assert stored[0] == stored[1], "{} {}".format(script, workload)
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark route programming snapshots on a synthetic table of 1M prefixes:
+building and writing a snapshot from the "pd show dataplane route <subset>"
+replies, and diffing two snapshots, against comparing the decoded replies as
+dictionaries of prefix to (subset, next hops).
+
+Run from lib/python: python3 -m vplaned.tests.bench_routesnap
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from vplaned.routesnap import STATES, Snapshot, SnapshotWriter, diff
+
+
+def replies(prefixes, vrfs, moved=0, step=0):
+    """Replies to each subset: the prefixes are spread over the VRFs and
+    programmed full, except one in every moved (from step) which is
+    no_resource"""
+    subsets = {state: {} for state in STATES}
+    for n in range(prefixes):
+        state = "no_resource" if moved and n % moved == step else "full"
+        vrf = subsets[state].setdefault(n % vrfs + 1, [])
+        vrf.append({"prefix": "{}.{}.{}.0/24".format(
+            n >> 16 & 255 | 1, n >> 8 & 255, n & 255),
+            "next_hop": [{"state": "gateway",
+                          "via": "192.0.2.{}".format(n % 8 + 1),
+                          "ifname": "dp0xe{}".format(n % 8)}]})
+    texts = {}
+    for state, tables in subsets.items():
+        fields = []
+        for vrf_id, routes in sorted(tables.items()):
+            fields.append({"vrf_id": vrf_id, "table": 254})
+            fields += routes
+        texts[state] = json.dumps({"route_show": fields})
+    return texts
+
+
+def legacy_diff(old, new):
+    """Decode the replies into dictionaries and compare them"""
+    def table(texts):
+        routes = {}
+        for state, text in texts.items():
+            vrf_id = None
+            for field in json.loads(text)["route_show"]:
+                if "vrf_id" in field:
+                    vrf_id = field["vrf_id"]
+                else:
+                    routes[(vrf_id, field["prefix"])] = (state,
+                                                         field["next_hop"])
+        return routes
+    before, after = table(old), table(new)
+    return [key for key in before.keys() | after.keys()
+            if before.get(key) != after.get(key)]
+
+
+def snapshot(texts, path):
+    writer = SnapshotWriter("route")
+    for state, text in texts.items():
+        writer.add_reply(0, state, text)
+    writer.write(path)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prefixes', type=int, default=1000000)
+    parser.add_argument('--vrfs', type=int, default=4)
+    parser.add_argument('--moved', type=int, default=1000,
+                        help='one prefix in every moved to no_resource')
+    args = parser.parse_args()
+
+    old = replies(args.prefixes, args.vrfs, args.moved)
+    new = replies(args.prefixes, args.vrfs, args.moved, 1)
+    print("replies: {} bytes".format(sum(len(t) for t in old.values())))
+
+    elapsed, changed = timed(lambda: len(legacy_diff(old, new)))
+    print("decoded dictionary diff: {:.3f} s, {} changes".format(
+        elapsed, changed))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in ("old", "new")]
+        for texts, path in zip((old, new), paths):
+            elapsed, _ = timed(lambda: snapshot(texts, path))
+            print("snapshot write: {:.3f} s, {} bytes".format(
+                elapsed, os.path.getsize(path)))
+
+        def run(first, second):
+            with Snapshot(first) as before, Snapshot(second) as after:
+                return sum(1 for _ in diff(before, after))
+        for name, first, second in (("changed", paths[0], paths[1]),
+                                    ("unchanged", paths[0], paths[0])):
+            elapsed, changed = timed(lambda: run(first, second))
+            print("snapshot diff, {}: {:.3f} s, {} changes".format(
+                name, elapsed, changed))
+
+
+if __name__ == '__main__':
+    main()
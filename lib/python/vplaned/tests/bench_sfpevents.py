@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark "show ... sfp-monitoring events" against a synthetic dataplane
+journal: grepping the text of the whole journal for every query, as the op
+command used to, against the SFP_MON index built from a JSON export of
+the journal, updated incrementally and queried by interface and time range.
+
+The grep of a text file stands in for journalctl decoding the journal of the
+boot, which is much slower; likewise the export is read from a file rather
+than from journalctl, so only the cost of the index is measured.
+
+Run from lib/python: python3 -m vplaned.tests.bench_sfpevents
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from vplaned import sfpevents
+from vplaned.sfpevents import SFPEvents
+
+
+def entries(count, every, interfaces, start=0):
+    """(usec, message) of a journal where one entry in every is SFP_MON"""
+    for n in range(start, start + count):
+        if n % every:
+            message = "dataplane: route table {} updated".format(n)
+        else:
+            message = "SFP_MON: dp0xe{}: rx power low warning".format(
+                n // every % interfaces)
+        yield n * 10000, message
+
+
+def line(usec, message):
+    return json.dumps({
+        "__CURSOR": "s=1;i={:x}".format(usec // 10000),
+        "__REALTIME_TIMESTAMP": str(usec), "_HOSTNAME": "vrouter",
+        "SYSLOG_IDENTIFIER": "dataplane", "_PID": "42",
+        "MESSAGE": message}).encode() + b"\n"
+
+
+def write(directory, count, every, interfaces, start=0):
+    """Write the journal as text and as a JSON export, return their
+    paths"""
+    text = os.path.join(directory, "journal.txt")
+    export = os.path.join(directory, "journal.json")
+    with open(text, "a") as t, open(export, "ab") as e:
+        for usec, message in entries(count, every, interfaces, start):
+            t.write("Oct 18 10:00:00 vrouter dataplane[42]: {}\n".format(
+                message))
+            e.write(line(usec, message))
+    return text, export
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--every', type=int, default=100,
+                        help='one SFP_MON entry in every')
+    parser.add_argument('--interfaces', type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sfp-events")
+        text, export = write(tmp, args.entries, args.every, args.interfaces)
+
+        elapsed, lines = timed(lambda: subprocess.run(
+            "grep SFP_MON {} | grep -w dp0xe1".format(text), shell=True,
+            stdout=subprocess.PIPE).stdout.count(b"\n"))
+        print("grep journal, one interface: {:.3f} s, {} events".format(
+            elapsed, lines))
+
+        with open(export, "rb") as f:
+            elapsed, added = timed(lambda: sfpevents.update(
+                f, path=path))
+        print("index build ({} entries): {:.3f} s, {} events, {} bytes".format(
+            args.entries, elapsed, added, os.path.getsize(path)))
+
+        more = io.BytesIO()
+        for usec, message in entries(1000, args.every, args.interfaces,
+                                     args.entries):
+            more.write(line(usec, message))
+        more.seek(0)
+        elapsed, added = timed(lambda: sfpevents.update(
+            more, path=path))
+        print("index update (1000 new entries): {:.4f} s, {} events".format(
+            elapsed, added))
+
+        middle = args.entries // 2 * 10000
+        for name, query in (
+                ("one interface", lambda s: s.events("dp0xe1")),
+                ("one interface, 1% of time",
+                 lambda s: s.events("dp0xe1", middle,
+                                    middle + args.entries * 100)),
+                ("all interfaces, 1% of time",
+                 lambda s: s.events(None, middle,
+                                    middle + args.entries * 100)),
+                ("all interfaces", lambda s: s.events())):
+            def run():
+                with SFPEvents(path) as store:
+                    return len(query(store))
+            elapsed, found = timed(run)
+            print("index query, {}: {:.4f} s, {} events".format(
+                name, elapsed, found))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark the "show platform dataplane" summary of
+vyatta-show-platform-dataplane.py on a synthetic response, against the
+previous implementation which rescanned the response for every
+(dataplane, feature) pair.
+
+Run from lib/python: python3 -m vplaned.tests.bench_show_platform
+"""
+import argparse
+import contextlib
+import io
+import os
+import runpy
+import time
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..",
+                      "scripts", "vyatta-show-platform-dataplane.py")
+
+
+def legacy_print_summary_data(data, print_summary_header):
+    """print_summary_data() before the objects were indexed"""
+    def find_dps(objects):
+        dps = []
+        for feat in objects:
+            for data in feat:
+                vals = feat[data]
+                for k in vals:
+                    if not k['dp'] in dps:
+                        dps.append(k['dp'])
+        return dps
+
+    def find_feats(objects):
+        feats = []
+        for feat in objects:
+            for f in feat:
+                if f not in feats:
+                    feats.append(f)
+        return sorted(feats)
+
+    def print_feat_summary_for_dp(obj, dp, in_feat):
+        for feat in obj:
+            for key in feat:
+                vals = feat[key]
+                for k in vals:
+                    if (k['dp'] == dp) and key == in_feat:
+                        print("  {:11} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+                            in_feat, k['full'], k['partial'], k['no_resource'],
+                            k['no_support'], k['not_needed'], k['error']))
+
+    obj = data['objects']
+    dps = find_dps(obj)
+    feats = find_feats(obj)
+
+    print_summary_header()
+    for dp in dps:
+        print("{}:".format(dp))
+        for feat in feats:
+            print_feat_summary_for_dp(obj, dp, feat)
+
+
+def summary(dataplanes, features):
+    """pd show dataplane response with one entry per (dataplane, feature)"""
+    objects = []
+    for feat in range(features):
+        objects.append({"feat{:02}".format(feat): [
+            {"dp": "dp{}".format(dp), "full": dp * feat, "partial": 0,
+             "no_resource": dp, "no_support": 0, "not_needed": feat,
+             "error": 0} for dp in range(dataplanes)]})
+    return {"objects": objects}
+
+
+def timed(fn, *args):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        fn(*args)
+    return time.perf_counter() - start, out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataplanes', type=int, nargs='+',
+                        default=[10, 100])
+    parser.add_argument('--features', type=int, default=20)
+    args = parser.parse_args()
+
+    script = runpy.run_path(SCRIPT, run_name="bench")
+    print("{:>5} {:>9} {:>14} {:>14} {:>14} {:>9}".format(
+        "dps", "entries", "legacy (ms)", "indexed (ms)", "json (ms)",
+        "speedup"))
+    for dataplanes in args.dataplanes:
+        data = summary(dataplanes, args.features)
+        legacy, legacy_out = timed(legacy_print_summary_data, data,
+                                   script["print_summary_header"])
+        indexed, indexed_out = timed(script["print_summary_data"], data)
+        assert legacy_out == indexed_out
+        as_json, _ = timed(
+            lambda: script["write_summary_records"](
+                script["index_summary"](data["objects"]), "json"))
+        print("{:>5} {:>9} {:>14.2f} {:>14.2f} {:>14.2f} {:>8.1f}x".format(
+            dataplanes, dataplanes * args.features, legacy * 1000,
+            indexed * 1000, as_json * 1000, legacy / indexed))
+
+
+if __name__ == '__main__':
+    main()
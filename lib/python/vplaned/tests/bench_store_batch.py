@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark Controller.store() against Controller.batch() for a storm-control
+VLAN commit, as issued by vplane-storm-control, using a local FakeController.
+
+Run from lib/python: python3 -m vplaned.tests.bench_store_batch
+"""
+import argparse
+import tempfile
+import time
+
+from vplaned import Controller
+from vplaned.tests.fakevplaned import FakeController
+
+
+def storm_ctl_commit(ctrl, ifname, vlans):
+    for vlan in vlans:
+        ctrl.store("storm-ctl {} {}".format(ifname, vlan),
+                   "storm-ctl SET {} vlan {} profile p1".format(ifname, vlan),
+                   ifname, "SET")
+
+
+def run(fake, vlans, batched):
+    with Controller(fake.store_endpoint, fake.cfg_endpoint) as ctrl:
+        start = time.perf_counter()
+        if batched:
+            with ctrl.batch():
+                storm_ctl_commit(ctrl, "dp0xe1", vlans)
+        else:
+            storm_ctl_commit(ctrl, "dp0xe1", vlans)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vlans', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.0001,
+                        help='controller processing time per message (s)')
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>9} {:>9}".format(
+        "vlans", "store (s)", "batch (s)", "speedup", "messages"))
+    for count in args.vlans:
+        vlans = range(1, count + 1)
+        with tempfile.TemporaryDirectory() as tmp, \
+                FakeController(tmp, latency=args.latency) as fake:
+            single = run(fake, vlans, False)
+            fake.messages = 0
+            batched = run(fake, vlans, True)
+            print("{:>8} {:>12.3f} {:>12.3f} {:>8.1f}x {:>9}".format(
+                count, single, batched, single / batched, fake.messages))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark repeated Controller.get_dataplanes() calls on a large synthetic
+topology, with and without a TopologyCache, using a local FakeController.
+
+Run from lib/python: python3 -m vplaned.tests.bench_topology
+"""
+import argparse
+import tempfile
+import time
+
+from vplaned import Controller, TopologyCache
+from vplaned.tests.fakevplaned import FakeController
+
+
+def topology(dataplanes, interfaces):
+    """GETVPCONFIG dataplanes list, with interfaces spread across them"""
+    dps = []
+    for dp_id in range(dataplanes):
+        intfs = []
+        for port in range(dp_id, interfaces, dataplanes):
+            intfs.append({"index": 10 + port,
+                          "name": "dp{}p{}p1.{}".format(dp_id, port % 64,
+                                                        port // 64),
+                          "state": "up", "mtu": 1500,
+                          "mac": "52:54:00:00:{:02x}:{:02x}".format(
+                              port // 256 % 256, port % 256)})
+        dps.append({"id": dp_id, "local": dp_id == 0, "connected": True,
+                    "control": "tcp://192.0.2.{}:5001".format(dp_id),
+                    "interfaces": intfs})
+    return dps
+
+
+def run(fake, calls, cache):
+    with Controller(fake.store_endpoint, fake.cfg_endpoint,
+                    topology_cache=cache) as ctrl:
+        start = time.perf_counter()
+        for _ in range(calls):
+            for dp in ctrl.get_dataplanes():
+                dp.control
+        return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataplanes', type=int, default=64)
+    parser.add_argument('--interfaces', type=int, default=10000)
+    parser.add_argument('--calls', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeController(tmp, dataplanes=topology(
+                args.dataplanes, args.interfaces)) as fake:
+        baseline = run(fake, args.calls, None)
+        print("{} dataplanes, {} interfaces, {} calls".format(
+            args.dataplanes, args.interfaces, args.calls))
+        print("{:<28} {:>12} {:>9}".format("", "ms/call", "speedup"))
+        for name, cache in (("no cache", None),
+                            ("cache, unchanged (ttl=0)", TopologyCache(0)),
+                            ("cache, within ttl", TopologyCache(60))):
+            per_call = run(fake, args.calls, cache)
+            print("{:<28} {:>12.3f} {:>8.1f}x".format(
+                name, per_call * 1000, baseline / per_call))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Benchmark suite of the vplaned client and of op scripts, over real ZMQ
+sockets to a local FakeTopology.
+
+Every case repeats one operation and reports its median and 99th percentile
+latency, its throughput and the bytes exchanged with the fake servers per
+operation; JSON command cases also report the time taken to decode the
+reply alone. --save records the results as a baseline, --compare checks them
+against one and exits with status 1 when a case regressed: its median
+latency or its message sizes grew by more than --tolerance.
+
+Run from lib/python: python3 -m vplaned.tests.bench_vplaned
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from vplaned import Controller, enable_command_stats
+from vplaned.tests.bench_show_platform import summary
+from vplaned.tests.fakevplaned import FakeTopology
+
+SCRIPTS = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..",
+                       "scripts")
+PYTHONPATH = os.path.join(os.path.dirname(__file__), "..", "..")
+
+# Run an op script with the vplaned clients pointed at the fake topology:
+# the store and config endpoints come first, then the script and its args
+BOOTSTRAP = '''
+import runpy, sys
+import vplaned.aio, vplaned.vplaned
+for cls in (vplaned.vplaned.Controller, vplaned.aio.AsyncController):
+    cls.__init__.__defaults__ = (tuple(sys.argv[1:3]) +
+                                 cls.__init__.__defaults__[2:])
+sys.argv = sys.argv[3:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+'''
+
+# Op scripts and the replies they need from the dataplanes
+OP_SCRIPTS = {
+    "vplane-show-debug": (
+        [], {"debug": {"debug": {"dp0": ["route", "lag", "qos"]}}}),
+    "vyatta-show-platform-dataplane.py": (
+        [], {"pd show dataplane  ": summary(1, 20)}),
+}
+
+# Metrics checked by --compare, and the least change counted as a regression
+REGRESSION_FLOORS = {"p50_ms": 0.05, "bytes_per_op": 1}
+
+
+def measure(topology, op, iterations, decode=None):
+    """Run op iterations times, after a warm up, and return its statistics.
+    decode, when given, is timed on its own as the serialization cost."""
+    for _ in range(min(iterations, 3)):
+        op()
+    before = topology.stats()
+    elapsed = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        op()
+        elapsed.append(time.perf_counter() - start)
+    after = topology.stats()
+
+    elapsed.sort()
+    result = {
+        "p50_ms": statistics.median(elapsed) * 1000,
+        "p99_ms": elapsed[min(len(elapsed) - 1,
+                              int(len(elapsed) * 0.99))] * 1000,
+        "ops_per_s": len(elapsed) / sum(elapsed),
+        "bytes_per_op": ((after["bytes_in"] + after["bytes_out"] -
+                          before["bytes_in"] - before["bytes_out"]) //
+                         iterations)}
+    if decode is not None:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode()
+        result["decode_ms"] = (time.perf_counter() - start) / iterations * 1000
+    return result
+
+
+def client_cases(args, tmp):
+    """Cases of the Python client"""
+    with FakeTopology(tmp, args.dataplanes, args.interfaces, args.latency,
+                      replies={"bench 0": {}}) as topology, \
+            Controller(topology.store_endpoint, topology.cfg_endpoint) as ctrl:
+        name = "get_dataplanes dps={} intfs={}".format(args.dataplanes,
+                                                       args.interfaces)
+        yield name, measure(topology, lambda: list(ctrl.get_dataplanes()),
+                            args.iterations)
+
+        yield "store", measure(
+            topology, lambda: ctrl.store("bench path", "bench cmd",
+                                         action="SET"),
+            args.iterations)
+
+        def batch():
+            with ctrl.batch():
+                for n in range(1000):
+                    ctrl.store("bench {}".format(n), "bench cmd {}".format(n),
+                               action="SET")
+        yield "store batch=1000", measure(
+            topology, batch, max(1, args.iterations // 100))
+
+        dps = list(ctrl.get_dataplanes())
+        yield "broadcast dps={}".format(args.dataplanes), measure(
+            topology, lambda: ctrl.broadcast("bench 0", dataplanes=dps),
+            args.iterations)
+
+    for size in args.payloads:
+        with FakeTopology(tmp, 1, latency=args.latency,
+                          payload_size=size) as topology, \
+                Controller(topology.store_endpoint,
+                           topology.cfg_endpoint) as ctrl:
+            dp = next(ctrl.get_dataplanes())
+            with dp:
+                raw = dp.string_command("bench")
+                yield "json_command payload={}".format(size), measure(
+                    topology, lambda: dp.json_command("bench"),
+                    max(10, min(args.iterations,
+                                args.iterations * 1000 // size)),
+                    decode=lambda: json.loads(raw))
+
+
+def script_cases(args, tmp):
+    """Cases of the op scripts, each run in a new interpreter"""
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(PYTHONPATH))
+    for script, (script_args, replies) in OP_SCRIPTS.items():
+        with FakeTopology(tmp, args.dataplanes, args.interfaces, args.latency,
+                          replies=replies) as topology:
+            cmd = [sys.executable, "-c", BOOTSTRAP, topology.store_endpoint,
+                   topology.cfg_endpoint, os.path.join(SCRIPTS, script)]
+            cmd += script_args
+
+            def run():
+                subprocess.run(cmd, env=env, check=True,
+                               stdout=subprocess.DEVNULL)
+            yield "script " + script, measure(topology, run,
+                                              args.script_runs)
+
+
+def compare(results, baseline, tolerance):
+    """Cases which regressed against baseline, with the reason"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, floor in REGRESSION_FLOORS.items():
+            if result[metric] > base[metric] * (1 + tolerance) and \
+                    result[metric] - base[metric] >= floor:
+                regressions.append("{}: {} {:.2f} -> {:.2f}".format(
+                    name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataplanes', type=int, default=4)
+    parser.add_argument('--interfaces', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='reply delay of the fake servers (s)')
+    parser.add_argument('--payloads', type=int, nargs='+',
+                        default=[100, 10000, 1000000],
+                        help='json_command reply sizes (bytes)')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--script-runs', type=int, default=10)
+    parser.add_argument('--no-scripts', action='store_true',
+                        help='only benchmark the Python client')
+    parser.add_argument('--command-stats', action='store_true',
+                        help='record the CommandStats of the client')
+    parser.add_argument('--save', metavar='FILE',
+                        help='record the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='check the results against a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.command_stats:
+        enable_command_stats()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    fmt = "{:<44} {:>9} {:>9} {:>9} {:>12} {:>9} {:>8}"
+    print(fmt.format("case", "p50 (ms)", "p99 (ms)", "ops/s", "bytes/op",
+                     "decode", "vs base"))
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = client_cases(args, tmp)
+        if not args.no_scripts:
+            cases = itertools.chain(cases, script_cases(args, tmp))
+        for name, result in cases:
+            results[name] = result
+            base = baseline.get(name)
+            print(fmt.format(
+                name, "{:.3f}".format(result["p50_ms"]),
+                "{:.3f}".format(result["p99_ms"]),
+                "{:.0f}".format(result["ops_per_s"]),
+                result["bytes_per_op"],
+                "{:.3f}".format(result["decode_ms"])
+                if "decode_ms" in result else "",
+                "{:+.0%}".format(result["p50_ms"] / base["p50_ms"] - 1)
+                if base else ""), flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,549 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Local stand-ins for vplane-controller and the dataplane control socket.
+
+FakeController serves the store and config sockets of vplaned, FakeDataplane
+the control socket of a dataplane. Both listen on ipc:// endpoints in a
+scratch directory and run from a background thread, so that the vplaned
+client can be exercised over real ZMQ sockets:
+
+with tempfile.TemporaryDirectory() as tmp, \\
+        FakeDataplane(tmp, replies={"netflow show": {}}) as dp, \\
+        FakeController(tmp, dataplanes=[dp.info()]) as fake:
+    with Controller(fake.store_endpoint, fake.cfg_endpoint) as ctrl:
+        ctrl.store("path to object", "command", action="SET")
+        for dataplane in ctrl.get_dataplanes():
+            with dataplane:
+                dataplane.json_command("netflow show")
+    fake.stored["path to object"]
+
+Requests are answered on ROUTER sockets, so any mix of REQ and DEALER
+clients is accepted. Replies are held back for "latency" seconds without
+blocking later requests, to model the round trip to the server. Both servers
+count the messages and bytes they receive and send.
+
+Protobuf store messages ("protobuf <base64 VPlanedEnvelope>" leaves) and
+dataplane protobuf commands (a "protobuf" frame followed by a
+DataplaneEnvelope) are decoded, with the generated vyatta.proto modules when
+they are installed, else with a minimal decoder of the protobuf wire format.
+
+FakePublisher publishes events and serves snapshots as described in
+vplaned.events, for Controller.subscribe():
+
+with FakePublisher(tmp) as pub, Controller() as ctrl:
+    with ctrl.subscribe(["link"], pub.events_endpoint,
+                        pub.snapshot_endpoint) as events:
+        pub.wait_subscribed()
+        pub.publish("link", {"dp0s3": "up"}, key="dp0s3")
+        events.recv()
+
+FakeTopology starts a controller and a set of dataplanes sharing their
+interfaces, whose replies can be padded to a given size. It can also be run
+on its own, to point op scripts or other clients at it:
+
+python3 -m vplaned.tests.fakevplaned --dir /tmp/fake --dataplanes 4 \\
+    --interfaces 256 --latency 0.001 --payload 4096
+"""
+import argparse
+import base64
+import heapq
+import itertools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import zmq
+
+from vplaned.events import pack_event, pack_snapshot
+
+# Field numbers of the envelopes, for decoding without the vyatta.proto
+# modules
+_DATAPLANE_ENVELOPE = {1: "type", 2: "msg"}
+_VPLANED_ENVELOPE = {1: "key", 2: "action", 3: "interface", 4: "msg"}
+_ACTIONS = {0: "SET", 1: "DELETE"}
+
+
+def _varint(data, idx):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[idx]
+        idx += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, idx
+        shift += 7
+
+
+def pb_decode(data, fields):
+    """Decode the scalar and bytes fields of a protobuf message into a dict
+    named after fields, a mapping of field number to name. Unknown fields
+    are skipped."""
+    msg = {}
+    idx = 0
+    while idx < len(data):
+        tag, idx = _varint(data, idx)
+        number, wire = tag >> 3, tag & 7
+        if wire == 0:
+            value, idx = _varint(data, idx)
+        elif wire == 2:
+            size, idx = _varint(data, idx)
+            value = bytes(data[idx:idx + size])
+            idx += size
+        elif wire == 1:
+            value = bytes(data[idx:idx + 8])
+            idx += 8
+        elif wire == 5:
+            value = bytes(data[idx:idx + 4])
+            idx += 4
+        else:
+            raise ValueError("unsupported wire type {}".format(wire))
+        if number in fields:
+            msg[fields[number]] = value
+    return msg
+
+
+def _pb_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def pb_encode(msg, fields):
+    """Encode a dict of field name to int, str or bytes value as a protobuf
+    message, fields mapping the field numbers to the names"""
+    out = bytearray()
+    for number, name in sorted(fields.items()):
+        value = msg.get(name)
+        if value is None:
+            continue
+        if isinstance(value, int):
+            out += _pb_varint(number << 3) + _pb_varint(value)
+            continue
+        if isinstance(value, str):
+            value = value.encode()
+        out += _pb_varint(number << 3 | 2) + _pb_varint(len(value)) + value
+    return bytes(out)
+
+
+def _dataplane_envelope(data):
+    try:
+        from vyatta.proto import DataplaneEnvelope_pb2
+    except ImportError:
+        de = pb_decode(data, _DATAPLANE_ENVELOPE)
+        return de.get("type", b"").decode(), de.get("msg", b"")
+    de = DataplaneEnvelope_pb2.DataplaneEnvelope()
+    de.ParseFromString(data)
+    return de.type, de.msg
+
+
+def _dataplane_envelope_bytes(msg_type, msg):
+    try:
+        from vyatta.proto import DataplaneEnvelope_pb2
+    except ImportError:
+        return pb_encode({"type": msg_type, "msg": msg}, _DATAPLANE_ENVELOPE)
+    de = DataplaneEnvelope_pb2.DataplaneEnvelope()
+    de.type = msg_type
+    de.msg = msg
+    return de.SerializeToString()
+
+
+def decode_envelope(cmd):
+    """Decode the "protobuf <base64>" command of a protobuf store leaf into
+    a dict of key, action ("SET" or "DELETE"), interface, type and msg, the
+    serialized command"""
+    data = base64.b64decode(cmd[len("protobuf "):])
+    try:
+        from vyatta.proto import VPlanedEnvelope_pb2
+    except ImportError:
+        ve = pb_decode(data, _VPLANED_ENVELOPE)
+        envelope = {"key": ve.get("key", b"").decode(),
+                    "action": _ACTIONS[ve.get("action", 0)],
+                    "interface": ve.get("interface", b"").decode()}
+        inner = ve.get("msg", b"")
+    else:
+        ve = VPlanedEnvelope_pb2.VPlanedEnvelope()
+        ve.ParseFromString(data)
+        envelope = {"key": ve.key, "action": _ACTIONS[ve.action],
+                    "interface": ve.interface}
+        inner = ve.msg
+    envelope["type"], envelope["msg"] = _dataplane_envelope(inner)
+    return envelope
+
+
+def payload(size):
+    """A JSON reply of about size bytes once encoded"""
+    return {"payload": "x" * max(0, size - len('{"payload": ""}'))}
+
+
+class _FakeServer:
+
+    """Poll loop shared by the fake servers. Subclasses bind their sockets
+    in _bind() and map each of them to a handler, which is called with the
+    request frames (without the routing envelope) and returns the reply
+    frames, or None to not reply."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._ctx = zmq.Context()
+        self._handlers = {}
+        self._delayed = []
+        self._seq = itertools.count()
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _bind(self):
+        raise NotImplementedError
+
+    def _socket(self, endpoint, handler):
+        sock = self._ctx.socket(zmq.ROUTER)
+        sock.bind(endpoint)
+        self._handlers[sock] = handler
+        return sock
+
+    def start(self):
+        self._bind()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._ctx.destroy(linger=0)
+
+    @staticmethod
+    def _split(frames):
+        """Split a request into its routing envelope and its body"""
+        delim = frames.index(b"") + 1
+        return frames[:delim], frames[delim:]
+
+    def _reply(self, sock, frames):
+        envelope, body = self._split(frames)
+        self.messages += 1
+        self.bytes_in += sum(len(f) for f in body)
+        reply = self._handlers[sock](body)
+        if reply is None:
+            return
+        reply = [f if isinstance(f, bytes) else str(f).encode()
+                 for f in reply]
+        self.bytes_out += sum(len(f) for f in reply)
+        due = time.monotonic() + self.latency
+        heapq.heappush(self._delayed,
+                       (due, next(self._seq), sock, envelope + reply))
+
+    def _run(self):
+        poller = zmq.Poller()
+        for sock in self._handlers:
+            poller.register(sock, zmq.POLLIN)
+        while self._running:
+            timeout = 50
+            if self._delayed:
+                wait = self._delayed[0][0] - time.monotonic()
+                timeout = min(timeout, max(0, int(wait * 1000)))
+            for sock, _ in poller.poll(timeout):
+                while sock.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                    self._reply(sock, sock.recv_multipart())
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, sock, frames = heapq.heappop(self._delayed)
+                sock.send_multipart(frames)
+        for sock in self._handlers:
+            sock.close()
+
+
+class FakeController(_FakeServer):
+
+    """Answers store messages with "OK" (or with "FAIL" when reject(path) is
+    true for one of the stored paths) and GETVPCONFIG with the dataplanes
+    list. Every stored leaf is kept in the "stored" dictionary, keyed by
+    path, and the decoded envelope of protobuf leaves in "envelopes"."""
+
+    def __init__(self, directory, dataplanes=None, latency=0.0, reject=None):
+        super().__init__(latency)
+        self.store_endpoint = "ipc://{}/vplaned.socket".format(directory)
+        self.cfg_endpoint = "ipc://{}/vplaned-config.socket".format(directory)
+        self.dataplanes = dataplanes if dataplanes is not None else []
+        self.reject = reject
+        self.stored = {}
+        self.envelopes = {}
+
+    def _bind(self):
+        self._socket(self.store_endpoint, self._store)
+        self._socket(self.cfg_endpoint, self._config)
+
+    def _walk(self, tree, path, out):
+        """Collect the (path, leaf) pairs of a nested store message"""
+        if any(key.startswith("__") for key in tree):
+            out.append((" ".join(path), tree))
+        for key, value in tree.items():
+            if isinstance(value, dict):
+                self._walk(value, path + [key], out)
+
+    def _store(self, body):
+        leaves = []
+        self._walk(json.loads(body[0]), [], leaves)
+        rc = "OK"
+        for path, leaf in leaves:
+            if self.reject is not None and self.reject(path):
+                rc = "FAIL"
+                continue
+            self.stored[path] = leaf
+            if leaf.get("__PROTOBUF__"):
+                cmd = leaf.get("__SET__", leaf.get("__DELETE__"))
+                self.envelopes[path] = decode_envelope(cmd)
+        return [rc]
+
+    def _config(self, body):
+        if body[0] == b"GETVPCONFIG":
+            return ["OK", json.dumps({"dataplanes": self.dataplanes})]
+        return ["OK"]
+
+
+class FakeDataplane(_FakeServer):
+
+    """Answers dataplane commands. "replies" maps a command to its reply: a
+    string is sent as is, anything else JSON encoded; a callable is called
+    with the command and returns the reply. The None entry answers the
+    commands with no entry of their own. Unknown commands, or replies
+    raising KeyError, are answered with an error.
+
+    Protobuf commands are answered from "pb_replies", which maps a message
+    type to the serialized reply message, or to a callable called with the
+    type and the serialized command; by default with an empty message. They
+    are recorded in "pb_commands" as (type, serialized command) tuples."""
+
+    def __init__(self, directory, dp_id=0, replies=None, latency=0.0,
+                 interfaces=(), pb_replies=None):
+        super().__init__(latency)
+        self.id = dp_id
+        self.control = "ipc://{}/vplane{}.socket".format(directory, dp_id)
+        self.replies = replies if replies is not None else {}
+        self.pb_replies = pb_replies if pb_replies is not None else {}
+        self.interfaces = list(interfaces)
+        self.commands = []
+        self.pb_commands = []
+
+    def info(self):
+        """The entry for this dataplane in a GETVPCONFIG reply"""
+        return {"id": self.id, "control": self.control,
+                "local": self.id == 0, "connected": True,
+                "interfaces": self.interfaces}
+
+    def _bind(self):
+        self._socket(self.control, self._command)
+
+    def _protobuf(self, data):
+        msg_type, msg = _dataplane_envelope(data)
+        self.pb_commands.append((msg_type, msg))
+        reply = self.pb_replies.get(msg_type, self.pb_replies.get(None, b""))
+        if callable(reply):
+            reply = reply(msg_type, msg)
+        return [_dataplane_envelope_bytes(msg_type, reply)]
+
+    def _command(self, body):
+        if body[0] == b"protobuf" and len(body) > 1:
+            return self._protobuf(body[1])
+        cmd = body[0].decode()
+        self.commands.append(cmd)
+        reply = self.replies.get(cmd, self.replies.get(None))
+        try:
+            if callable(reply):
+                reply = reply(cmd)
+            elif reply is None:
+                raise KeyError(cmd)
+        except KeyError:
+            return ["ERROR", "Unknown command: {}".format(cmd)]
+        if not isinstance(reply, str):
+            reply = json.dumps(reply)
+        return ["OK", reply]
+
+
+class FakePublisher(_FakeServer):
+
+    """Event publisher and snapshot server. publish() sends an event and
+    records its body as the state of its key within the topic, which the
+    snapshots of the topic return; events without a key are not part of
+    the state. With drop, the event takes a sequence number but is not
+    sent, as if it were lost on its way. restart() starts a new epoch,
+    numbering the events from scratch but keeping the state, as rebuilt
+    from the dataplanes. Events are published from the caller's thread, on
+    an XPUB socket which queues at most queue_size events per
+    subscriber."""
+
+    def __init__(self, directory, latency=0.0, queue_size=1000):
+        super().__init__(latency)
+        self.events_endpoint = "ipc://{}/events.socket".format(directory)
+        self.snapshot_endpoint = "ipc://{}/snapshot.socket".format(directory)
+        self.published = 0
+        self.snapshots = 0
+        self.epoch = time.time_ns()
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._seqs = {}
+        self._state = {}
+        self._pub = None
+
+    def _bind(self):
+        self._pub = self._ctx.socket(zmq.XPUB)
+        self._pub.setsockopt(zmq.SNDHWM, self._queue_size)
+        # Every subscription is seen by wait_subscribed(), not just the first
+        self._pub.setsockopt(zmq.XPUB_VERBOSE, 1)
+        self._pub.bind(self.events_endpoint)
+        self._socket(self.snapshot_endpoint, self._snapshot)
+
+    def _snapshot(self, body):
+        self.snapshots += 1
+        prefix = body[1].decode()
+        with self._lock:
+            return pack_snapshot(self.epoch, [
+                (topic, self._seqs.get(topic, 0),
+                 self._state.get(topic, {}).values())
+                for topic in sorted(set(self._seqs) | set(self._state))
+                if topic.startswith(prefix)])
+
+    def restart(self):
+        with self._lock:
+            self.epoch += 1
+            self._seqs = {}
+
+    def wait_subscribed(self, count=1, timeout=5.0):
+        """Wait for count subscriptions to reach the publisher, which
+        drops the events published before"""
+        deadline = time.monotonic() + timeout
+        while count > 0:
+            wait = deadline - time.monotonic()
+            if wait <= 0 or not self._pub.poll(wait * 1000, zmq.POLLIN):
+                raise TimeoutError("no subscription")
+            if self._pub.recv()[:1] == b"\x01":
+                count -= 1
+
+    def publish(self, topic, body, key=None, drop=False):
+        """Publish body, encoded to JSON unless bytes, and return its
+        sequence number"""
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        with self._lock:
+            seq = self._seqs.get(topic, 0) + 1
+            self._seqs[topic] = seq
+            epoch = self.epoch
+            if key is not None:
+                self._state.setdefault(topic, {})[key] = body
+        if not drop:
+            self._pub.send_multipart(pack_event(topic, epoch, seq, body))
+            self.published += 1
+        return seq
+
+
+def _interfaces(dp_id, dataplanes, interfaces):
+    """GETVPCONFIG entries of the interfaces of a dataplane, the interfaces
+    being spread across the dataplanes"""
+    return [{"index": 10 + port, "name": "dp{}p{}".format(dp_id, port),
+             "state": "up", "mtu": 1500,
+             "mac": "52:54:00:{:02x}:{:02x}:{:02x}".format(
+                 dp_id, port // 256 % 256, port % 256)}
+            for port in range(dp_id, interfaces, dataplanes)]
+
+
+class FakeTopology:
+
+    """A FakeController and the FakeDataplanes it reports, with interfaces
+    spread across the dataplanes. Commands with no entry in replies are
+    answered with a payload() of the given size, when one is given."""
+
+    def __init__(self, directory, dataplanes=1, interfaces=0, latency=0.0,
+                 payload_size=None, replies=None, pb_replies=None):
+        default = {} if payload_size is None else {None: payload(payload_size)}
+        default.update(replies or {})
+        self.dataplanes = [
+            FakeDataplane(directory, dp_id=dp_id, replies=dict(default),
+                          latency=latency, pb_replies=pb_replies,
+                          interfaces=_interfaces(dp_id, dataplanes,
+                                                 interfaces))
+            for dp_id in range(dataplanes)]
+        self.controller = FakeController(
+            directory, dataplanes=[dp.info() for dp in self.dataplanes],
+            latency=latency)
+        self.store_endpoint = self.controller.store_endpoint
+        self.cfg_endpoint = self.controller.cfg_endpoint
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        for dp in self.dataplanes:
+            dp.start()
+        self.controller.start()
+
+    def stop(self):
+        self.controller.stop()
+        for dp in self.dataplanes:
+            dp.stop()
+
+    def stats(self):
+        """Messages and bytes received and sent by all the servers"""
+        servers = [self.controller] + self.dataplanes
+        return {"messages": sum(s.messages for s in servers),
+                "bytes_in": sum(s.bytes_in for s in servers),
+                "bytes_out": sum(s.bytes_out for s in servers)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a fake vplane-controller and dataplanes")
+    parser.add_argument("--dir", default=".",
+                        help="Directory of the ipc sockets")
+    parser.add_argument("--dataplanes", type=int, default=1)
+    parser.add_argument("--interfaces", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Reply delay in seconds")
+    parser.add_argument("--payload", type=int,
+                        help="Answer unknown commands with this many bytes")
+    parser.add_argument("--reply", action="append", default=[],
+                        metavar="COMMAND=JSON",
+                        help="Reply to a dataplane command")
+    args = parser.parse_args()
+
+    replies = {}
+    for reply in args.reply:
+        cmd, _, text = reply.partition("=")
+        replies[cmd] = json.loads(text)
+
+    os.makedirs(args.dir, exist_ok=True)
+    directory = os.path.abspath(args.dir)
+    # Leave the signals to the main thread
+    signals = {signal.SIGINT, signal.SIGTERM}
+    signal.pthread_sigmask(signal.SIG_BLOCK, signals)
+    with FakeTopology(directory, args.dataplanes, args.interfaces,
+                      args.latency, args.payload, replies) as topology:
+        print("store {}".format(topology.store_endpoint))
+        print("config {}".format(topology.cfg_endpoint))
+        for dp in topology.dataplanes:
+            print("dataplane {} {}".format(dp.id, dp.control))
+        sys.stdout.flush()
+        signal.sigwait(signals)
+        print("stats {}".format(json.dumps(topology.stats())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import vplaned
+import asyncio
+import tempfile
+import unittest
+import zmq
+from vplaned.aio import AsyncController
+from vplaned.tests.fakevplaned import FakeController, FakeDataplane
+
+try:
+    vplaned.vplaned._protobuf()
+    HAVE_PROTOBUF = True
+except ImportError:
+    HAVE_PROTOBUF = False
+
+
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dp = FakeDataplane(
+            self._tmp.name, dp_id=0, latency=0.01,
+            replies={"netflow show": {"best": {"json": "ever"}},
+                     "version": "4.2",
+                     "echo 1": lambda cmd: cmd,
+                     "echo 2": lambda cmd: cmd},
+            interfaces=[{"index": 6, "name": "dp0s3", "state": "up"}])
+        self.dp.start()
+        self.fake = FakeController(self._tmp.name,
+                                   dataplanes=[self.dp.info()],
+                                   reject=lambda path: path == "bad path")
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        self.dp.stop()
+        self._tmp.cleanup()
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def controller(self, **kwds):
+        return AsyncController(self.fake.store_endpoint,
+                               self.fake.cfg_endpoint, **kwds)
+
+    async def _dataplanes(self, ctrl):
+        return [dp async for dp in ctrl.get_dataplanes()]
+
+    def test_get_dataplanes(self):
+        async def run():
+            async with self.controller() as ctrl:
+                return await self._dataplanes(ctrl)
+
+        dps = self.run_async(run())
+        self.assertEqual(len(dps), 1)
+        self.assertEqual(dps[0].id, 0)
+        self.assertEqual(dps[0].control, self.dp.control)
+        self.assertEqual(dps[0].interfaces["dp0s3"].state, "up")
+
+    def test_commands(self):
+        async def run():
+            async with self.controller() as ctrl:
+                dp, = await self._dataplanes(ctrl)
+                async with dp:
+                    return await asyncio.gather(
+                        dp.json_command("netflow show"),
+                        dp.string_command("version"),
+                        dp.string_command("echo 1"),
+                        dp.string_command("echo 2"))
+
+        self.assertEqual(self.run_async(run()),
+                         [{"best": {"json": "ever"}}, "4.2",
+                          "echo 1", "echo 2"])
+
+    def test_commands_in_flight(self):
+        async def run():
+            async with self.controller() as ctrl:
+                dp, = await self._dataplanes(ctrl)
+                async with dp:
+                    loop = asyncio.get_running_loop()
+                    start = loop.time()
+                    await asyncio.gather(*(dp.string_command("version")
+                                           for _ in range(50)))
+                    return loop.time() - start
+
+        # 50 round trips of 10ms each, overlapped
+        self.assertLess(self.run_async(run()), 0.25)
+
+    def test_command_fail(self):
+        async def run():
+            async with self.controller() as ctrl:
+                dp, = await self._dataplanes(ctrl)
+                async with dp:
+                    await dp.json_command("no such command")
+
+        with self.assertRaises(vplaned.DataplaneException):
+            self.run_async(run())
+
+    def test_command_timeout(self):
+        async def run():
+            async with self.controller(timeout=1) as ctrl:
+                dp, = await self._dataplanes(ctrl)
+                async with dp:
+                    await dp.json_command("netflow show")
+
+        with self.assertRaises(zmq.Again):
+            self.run_async(run())
+
+    def test_store(self):
+        async def run():
+            async with self.controller() as ctrl:
+                await asyncio.gather(
+                    ctrl.store("path to object", "command 1", action="SET"),
+                    ctrl.store("path to other", "command 2", action="SET"))
+                with self.assertRaises(vplaned.ControllerException):
+                    await ctrl.store("bad path", "command 3", action="SET")
+                with self.assertRaises(vplaned.ControllerException):
+                    await ctrl.store("path", "command 4", action=None)
+
+        self.run_async(run())
+        self.assertEqual(self.fake.stored["path to object"],
+                         {"__INTERFACE__": "ALL", "__SET__": "command 1"})
+        self.assertIn("path to other", self.fake.stored)
+        self.assertNotIn("bad path", self.fake.stored)
+
+    @unittest.skipUnless(HAVE_PROTOBUF,
+                         "needs google.protobuf and vyatta.proto")
+    def test_pb_command(self):
+        _, message, _ = vplaned.vplaned._protobuf()
+        self.dp.pb_replies["vyatta:echo"] = lambda msg_type, msg: msg
+
+        async def run():
+            async with self.controller() as ctrl:
+                dp, = await self._dataplanes(ctrl)
+                async with dp:
+                    return await asyncio.gather(
+                        dp.pb_command("vyatta:echo", message(key="k1"),
+                                      message()),
+                        dp.pb_command("vyatta:echo", b""))
+
+        reply, raw = self.run_async(run())
+        self.assertEqual(reply.key, "k1")
+        self.assertEqual(raw, b"")
+
+    def test_sync_with_fail(self):
+        dp = vplaned.aio.AsyncDataplane(None, {"id": 0})
+        with self.assertRaises(TypeError):
+            with dp:
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
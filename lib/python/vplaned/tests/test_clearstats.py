@@ -0,0 +1,199 @@
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+from vplaned import clearstats
+from vplaned.clearstats import ClearStats, ClearStatsException
+from vplaned.tests.bench_dataplane_stats import PERL_LIB
+from vplaned.tests.test_dataplane_stats import PERL_MISSING
+
+# Run a perl snippet with Vyatta::DataplaneClearStats on the store and
+# legacy directory given on the command line, and the JSON of its result
+# printed on the last line, the snippet reading the JSON of its argument
+# from $arg
+PERL_STORE = r'''
+use strict;
+use warnings;
+use JSON::PP;
+use Vyatta::DataplaneClearStats qw(clear_stats_get clear_stats_update);
+
+my ( $code, $store, $legacy_dir, $arg ) = @ARGV;
+$Vyatta::DataplaneClearStats::store      = $store;
+$Vyatta::DataplaneClearStats::legacy_dir = $legacy_dir;
+$arg = decode_json($arg);
+my $result = eval $code;
+die $@ if $@;
+print "\n", JSON::PP->new->allow_nonref->encode($result), "\n";
+'''
+
+
+def _perl_store_missing():
+    """Why Vyatta::DataplaneClearStats cannot be loaded, or None if it can"""
+    try:
+        proc = subprocess.run(["perl", "-I", PERL_LIB, "-e",
+                               "use Vyatta::DataplaneClearStats"],
+                              stderr=subprocess.PIPE, universal_newlines=True)
+    except OSError as e:
+        return str(e)
+    if proc.returncode != 0:
+        return proc.stderr.splitlines()[0]
+    return None
+
+
+PERL_STORE_MISSING = _perl_store_missing()
+
+
+class TestClearStats(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        self.path = os.path.join(self.dir, "clear-stats")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def update(self, baselines):
+        clearstats.update(baselines, path=self.path, legacy_dir=self.dir)
+
+    def test_missing_store(self):
+        with ClearStats(self.path) as store:
+            self.assertEqual(len(store), 0)
+            self.assertEqual(store.get("dp0s3", 0), {})
+
+    def test_update_and_get(self):
+        self.update({("dp0s3", 0, "stats"): {"rx_packets": 10,
+                                             "q0_tx_bytes": 2 ** 63},
+                     ("dp0s3", 1, "stats"): {"rx_packets": 20},
+                     ("dp0s3", 0, "mpls_stats"): {"rx_packets": 30},
+                     ("dp0s3.100", 0, "stats"): {"rx_packets": 40}})
+        self.update({("dp0s3", 1, "stats"): {"tx_packets": 21},
+                     ("dp0s3.100", 0, "stats"): None})
+
+        with ClearStats(self.path) as store:
+            self.assertEqual(len(store), 4)
+            self.assertEqual(store.get("dp0s3", 0),
+                             {"rx_packets": 10, "q0_tx_bytes": 2 ** 63})
+            self.assertEqual(store.get("dp0s3", 1), {"tx_packets": 21})
+            self.assertEqual(store.get("dp0s3", 0, "mpls_stats"),
+                             {"rx_packets": 30})
+            self.assertEqual(store.get("dp0s3.100", 0), {})
+            self.assertEqual(store.get("dp0s", 0), {})
+
+    def test_many_interfaces(self):
+        self.update({("dp0p{}".format(port), dp_id, "stats"):
+                     {"rx_packets": port, "tx_packets": dp_id}
+                     for port in range(500) for dp_id in range(3)})
+
+        with ClearStats(self.path) as store:
+            self.assertEqual(len(store), 3000)
+            for port in (0, 1, 99, 250, 499):
+                self.assertEqual(store.get("dp0p{}".format(port), 2),
+                                 {"rx_packets": port, "tx_packets": 2})
+
+    def test_migrate_legacy(self):
+        with open(os.path.join(self.dir, "dp0s3.100.dp1.stats"), "w") as f:
+            f.write("XYZZYX\nrx_packets,5\nq1_rx_bytes,6\n")
+        with open(os.path.join(self.dir, "dp0s4.dp0.stats"), "w") as f:
+            f.write("bad magic\nrx_packets,5\n")
+
+        self.update({("dp0s3", 0, "stats"): {"rx_packets": 1}})
+
+        with ClearStats(self.path) as store:
+            self.assertEqual(store.get("dp0s3.100", 1),
+                             {"rx_packets": 5, "q1_rx_bytes": 6})
+            self.assertEqual(store.get("dp0s3", 0), {"rx_packets": 1})
+            self.assertEqual(store.get("dp0s4", 0), {})
+        self.assertFalse(os.path.exists(
+            os.path.join(self.dir, "dp0s3.100.dp1.stats")))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.dir, "dp0s4.dp0.stats")))
+
+    def test_bad_store(self):
+        with open(self.path, "wb") as f:
+            f.write(b"XYZZYX\nrx_packets,5\n")
+        with self.assertRaises(ClearStatsException):
+            ClearStats(self.path)
+
+        self.update({("dp0s3", 0, "stats"): {"rx_packets": 1}})
+        with ClearStats(self.path) as store:
+            self.assertEqual(len(store), 1)
+
+    def test_counter_name_too_long(self):
+        with self.assertRaises(ClearStatsException):
+            self.update({("dp0s3", 0, "stats"): {"x" * 37: 1}})
+        # the limit is on the encoded name
+        with self.assertRaises(ClearStatsException):
+            self.update({("dp0s3", 0, "stats"): {"\u00e9" * 19: 1}})
+        self.update({("dp0s3", 0, "stats"): {"\u00e9" * 18: 1}})
+        with ClearStats(self.path) as store:
+            self.assertEqual(store.get("dp0s3", 0), {"\u00e9" * 18: 1})
+
+
+@unittest.skipIf(PERL_STORE_MISSING, "perl runtime dependencies of "
+                 "Vyatta::DataplaneClearStats missing: {}".format(
+                     PERL_STORE_MISSING))
+class TestPerlClearStats(unittest.TestCase):
+
+    """The perl module, with File::Map, and vplaned.clearstats on the same
+    store"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.dir = self._tmp.name
+        self.path = os.path.join(self.dir, "clear-stats")
+
+    def perl(self, code, arg=None, lib=()):
+        args = ["perl", "-I", PERL_LIB]
+        for module in lib:
+            args += ["-M" + module]
+        out = subprocess.check_output(
+            args + ["-e", PERL_STORE, code, self.path, self.dir,
+                    json.dumps(arg)], universal_newlines=True)
+        return json.loads(out.splitlines()[-1])
+
+    def get(self, ifname, dp_id, which="stats"):
+        return self.perl("+{ clear_stats_get( @$arg ) }",
+                         [ifname, dp_id, which])
+
+    def test_perl_reads_python(self):
+        clearstats.update({("dp0s3", 0, "stats"): {"rx_packets": 10},
+                           ("dp0s3", 1, "stats"): {"rx_packets": 2 ** 63}},
+                          path=self.path, legacy_dir=self.dir)
+        self.assertEqual(self.get("dp0s3", 0), {"rx_packets": 10})
+        self.assertEqual(self.get("dp0s3", 1), {"rx_packets": 2 ** 63})
+        self.assertEqual(self.get("dp0s4", 0), {})
+
+    def test_python_reads_perl(self):
+        self.perl("clear_stats_update($arg); 1",
+                  {"dp0s3": {"0": {"stats": {"rx_packets": 10}},
+                             "1": {"mpls_stats": {"tx_packets": 3}}}})
+        # an update from another process replaces the mapping
+        self.perl("clear_stats_get( 'dp0s3', 0 ); "
+                  "clear_stats_update($arg); +{ clear_stats_get( 'dp0s3', 0 ) }",
+                  {"dp0s3": {"0": {"stats": {"rx_packets": 11}}}})
+        with ClearStats(self.path) as store:
+            self.assertEqual(store.get("dp0s3", 0), {"rx_packets": 11})
+            self.assertEqual(store.get("dp0s3", 1, "mpls_stats"),
+                             {"tx_packets": 3})
+
+    @unittest.skipIf(PERL_MISSING, "perl runtime dependencies of "
+                     "Vyatta::DataplaneStats missing: {}".format(PERL_MISSING))
+    def test_bad_baseline(self):
+        # a baseline above the counters is ignored, and left in the store
+        clearstats.update({("dp0s3", 0, "stats"): {"rx_packets": 10}},
+                          path=self.path, legacy_dir=self.dir)
+        os.chmod(self.path, 0o444)
+        os.chmod(self.dir, 0o555)
+        self.addCleanup(os.chmod, self.dir, 0o755)
+        self.assertEqual(self.perl(
+            "+{ Vyatta::DataplaneStats::get_dataplane_clear_stats( @$arg ) }",
+            ["dp0s3", 0, {"rx_packets": 5}], lib=["Vyatta::DataplaneStats"]),
+            {})
+        self.assertEqual(self.get("dp0s3", 0), {"rx_packets": 10})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from vplaned.commitagent import CommitAgent, run
+
+AGENT = """
+import sys
+from vplaned.commitagent import CommitAgent
+CommitAgent(sys.argv[1], [sys.argv[2]], preload=["json", "logging"]).serve()
+"""
+
+SCRIPT = """#!/usr/bin/env python3
+import json
+import os
+import sys
+
+if hasattr(json, "leak"):
+    sys.exit("state of a previous run")
+json.leak = True
+print(json.dumps({"argv": sys.argv, "action": os.environ.get("COMMIT_ACTION"),
+                  "cwd": os.getcwd(), "umask": os.umask(0),
+                  "stdin": sys.stdin.read(), "name": __name__}))
+sys.exit(int(os.environ.get("STATUS", "0")))
+"""
+
+
+class TestCommitAgent(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = os.path.join(self._tmp.name, "sbin")
+        os.mkdir(self.dir)
+        self.null = os.open(os.devnull, os.O_RDWR)
+        self.addCleanup(os.close, self.null)
+        self.path = os.path.join(self._tmp.name, "agent.socket")
+        self.agent = subprocess.Popen(
+            [sys.executable, "-c", AGENT, self.path, self.dir],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        # the socket exists once bound, but takes requests once listening
+        ready = self.script("ready", "#!/usr/bin/env python3\n")
+        deadline = time.time() + 10
+        while run([ready], fds=(self.null,) * 3, path=self.path) != 0:
+            self.assertIsNone(self.agent.poll())
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.agent.poll() is None:
+            self.agent.kill()
+        self.agent.wait()
+        self._tmp.cleanup()
+
+    def script(self, name, text, directory=None):
+        path = os.path.join(directory or self.dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        os.chmod(path, 0o755)
+        return path
+
+    def run_script(self, argv, stdin=b"", **env):
+        """(status, stdout, stderr) of a run through the agent"""
+        with tempfile.TemporaryFile() as i, tempfile.TemporaryFile() as o, \
+                tempfile.TemporaryFile() as e:
+            i.write(stdin)
+            i.seek(0)
+            status = run(argv, env=dict(os.environ, PATH=self.dir, **env),
+                         cwd=self._tmp.name,
+                         fds=(i.fileno(), o.fileno(), e.fileno()),
+                         path=self.path)
+            o.seek(0)
+            e.seek(0)
+            return status, o.read().decode(), e.read().decode()
+
+    def test_run(self):
+        path = self.script("vplane-test", SCRIPT)
+        umask = os.umask(0o027)
+        self.addCleanup(os.umask, umask)
+        for argv in (["vplane-test", "--dev", "", "dp0xe1"],
+                     [path, "--dev", "", "dp0xe1"]):
+            status, out, err = self.run_script(argv, b"input",
+                                               COMMIT_ACTION="SET", STATUS="3")
+            self.assertEqual((status, err), (3, ""))
+            self.assertEqual(eval(out.replace("true", "True")), {
+                "argv": [path, "--dev", "", "dp0xe1"], "action": "SET",
+                "cwd": self._tmp.name, "umask": 0o027,
+                "stdin": "input", "name": "__main__"})
+
+    def test_errors(self):
+        self.script("exit-message", "#!/usr/bin/python3\nimport sys\n"
+                    "print('out')\nsys.exit('failed')\n")
+        self.script("raise", "#!/usr/bin/env python3\nraise ValueError(42)\n")
+        self.script("killed", "#!/usr/bin/env python3\nimport os, signal\n"
+                    "os.kill(os.getpid(), signal.SIGKILL)\n")
+        self.script("logs", "#!/usr/bin/env python3\nimport atexit, logging\n"
+                    "logging.basicConfig(format='x: %(message)s')\n"
+                    "atexit.register(print, 'bye')\nlogging.error('bad')\n")
+        self.script("thread", "#!/usr/bin/env python3\nimport threading, "
+                    "time\nthreading.Thread(target=lambda: (time.sleep(0.1), "
+                    "print('late'))).start()\n")
+        self.assertEqual(self.run_script(["exit-message"]),
+                         (1, "out\n", "failed\n"))
+        status, _, err = self.run_script(["raise"])
+        self.assertEqual(status, 1)
+        self.assertTrue(err.startswith("Traceback"))
+        self.assertTrue(err.endswith("ValueError: 42\n"))
+        self.assertEqual(self.run_script(["killed"])[0], 128 + signal.SIGKILL)
+        self.assertEqual(self.run_script(["logs"]), (0, "bye\n", "x: bad\n"))
+        # the interpreter waits for the threads of the script
+        self.assertEqual(self.run_script(["thread"]), (0, "late\n", ""))
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_not_served(self):
+        self.script("shell", "#!/bin/sh\necho shell\n")
+        outside = self.script("outside", SCRIPT, self._tmp.name)
+        for argv in (["shell"], [outside], ["missing"]):
+            self.assertIsNone(self.run_script(argv)[0])
+        self.assertIsNone(run(["vplane-test"], path=self.path + ".missing"))
+
+    def test_stop(self):
+        started = os.path.join(self._tmp.name, "started")
+        self.script("slow", "#!/usr/bin/env python3\nimport time\n"
+                    "open({!r}, 'w').close()\n"
+                    "time.sleep(0.5)\nprint('done')\n".format(started))
+        self.script("vplane-test", SCRIPT)
+        self.assertEqual(self.run_script(["vplane-test"])[0], 0)
+        with tempfile.TemporaryFile() as out:
+            client = subprocess.Popen(
+                [sys.executable, "-c",
+                 "import sys; from vplaned.commitagent import run; "
+                 "sys.exit(run(['slow'], path=sys.argv[1]))", self.path],
+                stdout=out, env=dict(os.environ, PATH=self.dir,
+                                     PYTHONPATH=os.pathsep.join(sys.path)))
+            deadline = time.time() + 10
+            while not os.path.exists(started):
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.01)
+            self.agent.send_signal(signal.SIGTERM)
+            self.assertEqual(client.wait(5), 0)
+            out.seek(0)
+            self.assertEqual(out.read(), b"done\n")
+        self.assertEqual(self.agent.wait(5), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestScripts(unittest.TestCase):
+
+    def test_compile_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            agent = CommitAgent(os.path.join(tmp, "socket"), [tmp])
+            path = os.path.join(tmp, "script")
+            with open(path, "w") as f:
+                f.write("#!/usr/bin/env python3\nx = 1\n")
+            code = agent.compile(path)
+            self.assertIs(agent.compile(path), code)
+            with open(path, "w") as f:
+                f.write("#!/bin/sh\nexit 1\n")
+            os.chmod(path, 0o755)
+            self.assertIsNone(agent.compile(path))
+            self.assertEqual(agent.script("script", {"PATH": tmp}, "/"), path)
+            self.assertIsNone(agent.script("/bin/sh", {}, "/"))
+
+
+if __name__ == '__main__':
+    unittest.main()
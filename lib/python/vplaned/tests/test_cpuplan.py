@@ -0,0 +1,158 @@
+import os
+import tempfile
+import unittest
+from vplaned.cpuplan import (
+    CPUTopology, check, format_cpus, parse_cpus, propose, record_topology)
+
+
+def write(root, path, text):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text + "\n")
+
+
+def sysfs(root, packages=2, cores=4, threads=2, nics=None, irqs=None,
+          isolated=""):
+    """Tree of packages NUMA nodes of cores SMT cores each, CPUs numbered as
+    Linux does on x86: the first thread of every core, then the second.
+    nics maps port names to (PCI address, NUMA node), irqs interrupt
+    numbers to their affinity."""
+    ncores = packages * cores
+    ncpus = ncores * threads
+    write(root, "sys/devices/system/cpu/online", "0-{}".format(ncpus - 1))
+    write(root, "sys/devices/system/cpu/isolated", isolated)
+    for cpu in range(ncpus):
+        core = cpu % ncores
+        package = core // cores
+        siblings = [core + ncores * thread for thread in range(threads)]
+        base = "sys/devices/system/cpu/cpu{}/".format(cpu)
+        write(root, base + "topology/physical_package_id", str(package))
+        write(root, base + "topology/core_id", str(core % cores))
+        write(root, base + "topology/thread_siblings_list",
+              format_cpus(siblings))
+        for index, (level, kind, shared) in enumerate((
+                (1, "Data", siblings), (1, "Instruction", siblings),
+                (2, "Unified", siblings),
+                (3, "Unified", [c for c in range(ncpus)
+                                if c % ncores // cores == package]))):
+            cache = base + "cache/index{}/".format(index)
+            write(root, cache + "level", str(level))
+            write(root, cache + "type", kind)
+            write(root, cache + "shared_cpu_list", format_cpus(shared))
+    for package in range(packages):
+        write(root, "sys/devices/system/node/node{}/cpulist".format(package),
+              format_cpus(c for c in range(ncpus)
+                          if c % ncores // cores == package))
+
+    write(root, "proc/irq/default_smp_affinity",
+          "{:x}".format((1 << ncpus) - 1))
+    for irq, affinity in (irqs or {}).items():
+        write(root, "proc/irq/{}/smp_affinity_list".format(irq), affinity)
+
+    for name, (pci, node) in (nics or {}).items():
+        device = os.path.join(root, "sys/bus/pci/devices", pci)
+        write(root, os.path.join(device, "numa_node"), str(node))
+        os.makedirs(os.path.join(root, "sys/class/net", name))
+        os.symlink(os.path.join("../../../bus/pci/devices", pci),
+                   os.path.join(root, "sys/class/net", name, "device"))
+
+
+class TestCPUPlan(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self._tmp.name, "root")
+        # CPUs 0-3,8-11 on node 0, 4-7,12-15 on node 1
+        sysfs(self.root, nics={"dp0p1s0": ("0000:81:00.0", 1),
+                               "dp0p2s0": ("0000:82:00.0", 1)},
+              irqs={30: "0-15", 31: "5"})
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def codes(self, findings):
+        return {finding["code"]: finding["cpus"] for finding in findings}
+
+    def test_masks(self):
+        self.assertEqual(parse_cpus("0-3,7,"), {0, 1, 2, 3, 7})
+        self.assertEqual(parse_cpus("0x8f"), {0, 1, 2, 3, 7})
+        self.assertEqual(parse_cpus("0x1,00000001"), {0, 32})
+        self.assertEqual(format_cpus({9, 1, 2, 3, 5}), "1-3,5,9")
+        self.assertRaises(ValueError, parse_cpus, "1-x")
+
+    def test_read(self):
+        topology = CPUTopology.read(self.root, ["dp0p1s0",
+                                                "dp0p9s0=0000:83:00.0"])
+        self.assertEqual(len(topology.cpus), 16)
+        cpu = topology.cpus[12]
+        self.assertEqual((cpu.package, cpu.core, cpu.node),
+                         (1, 0, 1))
+        self.assertEqual(cpu.siblings, {4, 12})
+        self.assertEqual(cpu.llc, {4, 5, 6, 7, 12, 13, 14, 15})
+        self.assertEqual(topology.irq_cpus, {5})
+        self.assertEqual([(p.name, p.pci, p.node) for p in topology.ports],
+                         [("dp0p1s0", "0000:81:00.0", 1),
+                          ("dp0p9s0", "0000:83:00.0", None)])
+        self.assertEqual(topology.to_json()["nodes"],
+                         {"0": "0-3,8-11", "1": "4-7,12-15"})
+
+    def test_record(self):
+        record = os.path.join(self._tmp.name, "record")
+        topology = record_topology(record, self.root, ["dp0p2s0"])
+        replay = CPUTopology.read(record, ["dp0p2s0"])
+        self.assertEqual(replay.to_json(), topology.to_json())
+        self.assertEqual(replay.ports[0].node, 1)
+
+    def test_propose(self):
+        topology = CPUTopology.read(self.root, ["dp0p1s0", "dp0p2s0"])
+        plan = propose(topology)
+        # control on core 0 and its sibling, forwarding on one thread of
+        # the node 1 cores not handling interrupts
+        self.assertEqual(plan["control_cpumask"], "0,8")
+        self.assertEqual(plan["forwarding"], "4,6-7")
+        self.assertEqual(plan["cpumask"], "0,4,6-8")
+        self.assertEqual(self.codes(plan["findings"]), {})
+
+        plan = propose(topology, smt=True)
+        self.assertEqual(plan["forwarding"], "4,6-7,12,14-15")
+        self.assertEqual(self.codes(plan["findings"])["smt-contention"],
+                         "4,6-7,12,14-15")
+
+    def test_propose_isolated(self):
+        root = os.path.join(self._tmp.name, "isolated")
+        sysfs(root, packages=1, threads=1, isolated="2-3")
+        plan = propose(CPUTopology.read(root))
+        self.assertEqual((plan["control_cpumask"], plan["forwarding"]),
+                         ("0", "2-3"))
+
+    def test_check(self):
+        topology = CPUTopology.read(self.root, ["dp0p1s0", "dp0p2s0"])
+        codes = self.codes(check(topology, "0-3,8", "0"))
+        self.assertEqual(codes["cross-numa-port"], "")
+        self.assertEqual(codes["remote-core"], "1-3,8")
+        self.assertEqual(codes["control-sibling"], "8")
+        self.assertNotIn("smt-contention", codes)
+
+        codes = self.codes(check(topology, "0,4-5,12-13", "0"))
+        self.assertEqual(codes["smt-contention"], "4-5,12-13")
+        self.assertEqual(codes["irq-cpu"], "5")
+        self.assertNotIn("cross-numa-port", codes)
+
+        codes = self.codes(check(topology, "0,3-4", "0"))
+        self.assertEqual(codes["llc-span"], "3-4")
+
+    def test_check_errors(self):
+        topology = CPUTopology.read(self.root)
+        codes = self.codes(check(topology, "0-3", "4"))
+        self.assertEqual(codes["control-not-subset"], "4")
+        codes = self.codes(check(topology, "0-20,1030", "0"))
+        self.assertEqual(codes["offline-cpu"], "16-20,1030")
+        self.assertEqual(codes["cpu-limit"], "1030")
+        self.assertIn("no-forwarding-cpu", self.codes(check(topology, "0",
+                                                            "0")))
+        self.assertIn("invalid-mask", self.codes(check(topology, "0-x")))
+
+
+if __name__ == '__main__':
+    unittest.main()
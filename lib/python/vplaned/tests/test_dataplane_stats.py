@@ -0,0 +1,172 @@
+import contextlib
+import json
+import subprocess
+import tempfile
+import unittest
+from vplaned.tests.bench_dataplane_stats import PERL_LIB, ifinfo
+from vplaned.tests.fakevplaned import FakeDataplane
+
+# Collect the replies to a command for a comma separated list of interfaces
+# with get_dataplane_interfaces(), from the dataplane endpoints on the
+# command line, an empty one being a dataplane that could not be connected
+COLLECT = r'''
+use strict;
+use warnings;
+use JSON qw( encode_json );
+use Vyatta::Dataplane;
+use Vyatta::DataplaneStats;
+
+my ( $cmd, $names, @endpoints ) = @ARGV;
+my ( @dp_ids, @dp_conns );
+for my $dp_id ( 0 .. $#endpoints ) {
+    push @dp_ids, $dp_id;
+    next if $endpoints[$dp_id] eq '';
+    $dp_conns[$dp_id] = new Vyatta::Dataplane( undef, $endpoints[$dp_id] );
+}
+my @names = split( /,/, $names );
+print encode_json( Vyatta::DataplaneStats::get_dataplane_interfaces(
+    \@names, $cmd, \@dp_ids, \@dp_conns ) );
+'''
+
+
+def _perl_missing():
+    """Why Vyatta::DataplaneStats cannot be loaded, or None if it can"""
+    try:
+        proc = subprocess.run(["perl", "-I", PERL_LIB, "-e",
+                               "use Vyatta::DataplaneStats"],
+                              stderr=subprocess.PIPE, universal_newlines=True)
+    except OSError as e:
+        return str(e)
+    if proc.returncode != 0:
+        return proc.stderr.splitlines()[0]
+    return None
+
+
+def interfaces(ports, bulk=True):
+    """ifconfig and slowpath replies of a dataplane with these ports, the
+    command without an interface being unknown unless bulk"""
+    def reply(cmd):
+        args = cmd.split()[1:]
+        if not args and not bulk:
+            raise KeyError(cmd)
+        if args:
+            port = int(args[0][len("dp0p"):])
+            return {"interfaces": [ifinfo(port)] if port in ports else []}
+        return {"interfaces": [ifinfo(port) for port in ports]}
+    return reply
+
+
+def unknown(cmd):
+    """Replies of a dataplane answering every command with an error"""
+    raise KeyError(cmd)
+
+
+PERL_MISSING = _perl_missing()
+
+
+@unittest.skipIf(PERL_MISSING, "perl runtime dependencies of "
+                 "Vyatta::DataplaneStats missing: {}".format(PERL_MISSING))
+class TestGetDataplaneInterfaces(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.stack = stack
+
+    def dataplanes(self, *replies):
+        """A FakeDataplane per replies, None for one not connected"""
+        return [None if r is None else self.stack.enter_context(
+            FakeDataplane(self._tmp.name, dp_id=i, replies={None: r}))
+            for i, r in enumerate(replies)]
+
+    def collect(self, cmd, names, dps):
+        proc = subprocess.run(
+            ["perl", "-I", PERL_LIB, "-e", COLLECT, cmd, ",".join(names)] +
+            ["" if dp is None else dp.control for dp in dps],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        if proc.returncode != 0:
+            return proc.stderr
+        return json.loads(proc.stdout)
+
+    def assertFound(self, results, expected):
+        """expected maps an interface name to the ids of the dataplanes
+        it was found on"""
+        self.assertEqual(
+            {name: [i for i, info in enumerate(by_dp) if info is not None]
+             for name, by_dp in results.items()}, expected)
+        for name, by_dp in results.items():
+            for info in by_dp:
+                if info is not None:
+                    self.assertEqual(info["name"], name)
+
+    def test_bulk(self):
+        # dp1 only has the even ports, dp2 is not connected and no
+        # dataplane has dp0p11
+        dps = self.dataplanes(interfaces(range(10)),
+                              interfaces(range(0, 10, 2)), None)
+        names = ["dp0p{}".format(port) for port in range(12) if port != 10]
+        results = self.collect("ifconfig", names, dps)
+        self.assertFound(results, dict(
+            {"dp0p{}".format(port): [0, 1] for port in range(0, 10, 2)},
+            **{"dp0p{}".format(port): [0] for port in range(1, 10, 2)}))
+        self.assertEqual(results["dp0p3"][0], ifinfo(3))
+        # one full interface list per dataplane
+        self.assertEqual(dps[0].commands, ["ifconfig"])
+        self.assertEqual(dps[1].commands, ["ifconfig"])
+
+    def test_bulk_as_per_interface(self):
+        # the bulk replies give the same results as the per-interface ones
+        dps = self.dataplanes(interfaces(range(10)), interfaces([1, 8]))
+        names = ["dp0p{}".format(port) for port in range(12)]
+        bulk = self.collect("ifconfig", names, dps)
+        per_interface = {}
+        for start in range(0, len(names), 4):
+            per_interface.update(
+                self.collect("ifconfig", names[start:start + 4], dps))
+        self.assertEqual(bulk, per_interface)
+        self.assertEqual(dps[1].commands[:2], ["ifconfig", "ifconfig dp0p0"])
+
+    def test_bulk_unknown(self):
+        # a dataplane not knowing the bulk ifconfig makes all of them fall
+        # back to one ifconfig per interface
+        dps = self.dataplanes(interfaces(range(10)),
+                              interfaces(range(0, 10, 2), bulk=False))
+        names = ["dp0p{}".format(port) for port in range(10)]
+        results = self.collect("ifconfig", names, dps)
+        self.assertFound(results, dict(
+            {"dp0p{}".format(port): [0, 1] for port in range(0, 10, 2)},
+            **{"dp0p{}".format(port): [0] for port in range(1, 10, 2)}))
+        for dp in dps:
+            self.assertEqual(dp.commands, ["ifconfig"] + [
+                "ifconfig {}".format(name) for name in names])
+
+    def test_per_interface(self):
+        dps = self.dataplanes(interfaces([1, 2]), interfaces([2]), None)
+        results = self.collect("ifconfig", ["dp0p1", "dp0p2", "dp0p3"], dps)
+        self.assertFound(results, {"dp0p1": [0], "dp0p2": [0, 1]})
+        self.assertEqual(results["dp0p2"][1], ifinfo(2))
+        for dp in dps[:2]:
+            self.assertEqual(dp.commands,
+                             ["ifconfig dp0p1", "ifconfig dp0p2",
+                              "ifconfig dp0p3"])
+
+        # other commands are sent per interface, however many there are
+        names = ["dp0p{}".format(port) for port in range(10)]
+        results = self.collect("slowpath", names, dps[:1])
+        self.assertFound(results, {"dp0p1": [0], "dp0p2": [0]})
+        self.assertEqual(dps[0].commands[3:],
+                         ["slowpath {}".format(name) for name in names])
+
+    def test_error(self):
+        # the error of the per-interface fallback is reported
+        dps = self.dataplanes(interfaces(range(10)), unknown)
+        for names in (["dp0p1"], ["dp0p{}".format(p) for p in range(1, 11)]):
+            self.assertEqual(self.collect("ifconfig", names, dps),
+                             "Error: Unknown command: ifconfig dp0p1\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import math
+import os
+import tempfile
+import unittest
+from vplaned.domhistory import DOMHistory, DOMFile, DOMHistoryException, \
+    HOURLY, dbm, outliers, rolling_trend, summary, time_to_threshold, trend
+
+DAY = 86400
+
+
+def sfp(name, rx_mw=0.5, tx_mw=0.6, bias=6.0, temp=30.0, **thresholds):
+    xcvr_info = {"temperature_C": temp, "voltage_V": 3.3,
+                 "rx_power_mW": rx_mw, "tx_power_mW": tx_mw,
+                 "laser_bias": bias}
+    xcvr_info.update(thresholds)
+    return {"name": name, "xcvr_info": xcvr_info}
+
+
+def qsfp(name, rx_mw=(0.5, 0.5, 0.5, 0.5)):
+    return {"name": name, "xcvr_info": {
+        "temperature_C": 40.0, "voltage_V": 3.2,
+        "measured_values": [
+            {"channel": str(c), "rx_power_mW": rx, "tx_power_mW": 1.0,
+             "laser_bias": 7.0}
+            for c, rx in reversed(list(enumerate(rx_mw, 1)))]}}
+
+
+class TestDOMHistory(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.history = DOMHistory(self._tmp.name, interval=300,
+                                  capacities=(12, 48))
+
+    def tearDown(self):
+        self.history.close()
+        self._tmp.cleanup()
+
+    def test_record_and_read(self):
+        start = 100 * DAY
+        for n in range(10):
+            self.history.record([sfp("dp0xe1", rx_mw=0.1 * (n + 1)),
+                                 qsfp("dp0ce0"), {"name": "dp0s3"}],
+                                now=start + n * 300)
+            # sampled once per interval
+            self.history.record([sfp("dp0xe1", rx_mw=9.0)],
+                                now=start + n * 300 + 10)
+        self.assertEqual(self.history.interfaces(), ["dp0ce0", "dp0xe1"])
+        with self.history.open("dp0xe1") as dom:
+            self.assertEqual(dom.channels, [0])
+            self.assertEqual(len(dom), 10)
+            times, (rx, temp) = dom.read([("rx_power", 0),
+                                          ("temperature", None)],
+                                         since=start + 600,
+                                         until=start + 1500)
+            self.assertEqual(list(times), [start + 600, start + 900,
+                                           start + 1200])
+            self.assertEqual([round(v, 3) for v in rx], [0.3, 0.4, 0.5])
+            self.assertEqual(list(temp), [30.0] * 3)
+        with self.history.open("dp0ce0") as dom:
+            self.assertEqual(dom.channels, [1, 2, 3, 4])
+            self.assertEqual(list(dom.read([("tx_power", 4)])[1][0]),
+                             [1.0] * 10)
+        self.assertRaises(FileNotFoundError, self.history.open, "dp0s3")
+
+    def test_rings(self):
+        start = 100 * DAY
+        for n in range(30):
+            self.history.record([sfp("dp0xe1", rx_mw=n)],
+                                now=start + n * 1200)
+        with self.history.open("dp0xe1") as dom:
+            times, (rx,) = dom.read([("rx_power", 0)])
+            # the last 12 samples
+            self.assertEqual(list(rx), list(range(18, 30)))
+            self.assertEqual(times[0], start + 18 * 1200)
+            # means of the three samples of each complete hour
+            times, (rx,) = dom.read([("rx_power", 0)], ring=HOURLY)
+            self.assertEqual(list(times),
+                             [start + h * 3600 for h in range(9)])
+            self.assertEqual(list(rx), [3 * h + 1 for h in range(9)])
+
+    def test_module_swap(self):
+        self.history.record([sfp("dp0xe1")], now=DAY)
+        self.history.record([qsfp("dp0xe1")], now=2 * DAY)
+        history = DOMHistory(self._tmp.name)
+        with history.open("dp0xe1") as dom:
+            self.assertEqual(dom.channels, [1, 2, 3, 4])
+            self.assertEqual(len(dom), 1)
+
+    def test_bad_file(self):
+        with open(os.path.join(self._tmp.name, "dp0xe1.dom"), "wb") as f:
+            f.write(b"junk" * 100)
+        with self.assertRaises(DOMHistoryException):
+            self.history.open("dp0xe1")
+        self.history.record([sfp("dp0xe1")], now=DAY)
+        with self.history.open("dp0xe1") as dom:
+            self.assertEqual(len(dom), 1)
+
+    def test_prune(self):
+        self.history.record([sfp("dp0xe1")], now=DAY)
+        self.history.record([sfp("dp0xe2")], now=3 * DAY)
+        self.history.prune(max_age=DAY, now=3 * DAY + 1)
+        self.assertEqual(self.history.interfaces(), ["dp0xe2"])
+        self.history.record([sfp("dp0xe1")], now=3 * DAY + 2)
+        self.assertEqual(self.history.interfaces(), ["dp0xe1", "dp0xe2"])
+
+
+class TestAnalysis(unittest.TestCase):
+
+    def test_dbm(self):
+        self.assertEqual([round(v, 2) for v in dbm([1.0, 0.5, 0, 2.0])],
+                         [0.0, -3.01, -40.0, 3.01])
+
+    def test_trend(self):
+        times = [0, 100, 200, 300]
+        slope, value = trend(times, [1.0, 1.2, 1.4, 1.6])
+        self.assertAlmostEqual(slope, 0.002)
+        self.assertAlmostEqual(value, 1.6)
+        self.assertIsNone(trend([5], [1.0]))
+        self.assertIsNone(trend([5, 5], [1.0, 2.0]))
+
+    def test_rolling_trend(self):
+        times = [n * 300 for n in range(100)]
+        values = [math.sin(n / 7) + n * 0.01 for n in range(100)]
+        slopes = rolling_trend(times, values, 3000)
+        self.assertTrue(math.isnan(slopes[0]))
+        for last in (1, 5, 50, 99):
+            first = max(0, last - 10)
+            expected = trend(times[first:last + 1],
+                             values[first:last + 1])[0]
+            self.assertAlmostEqual(slopes[last], expected)
+
+    def test_time_to_threshold(self):
+        self.assertEqual(time_to_threshold(-0.1, 5.0, (2.0, 9.0)), 30.0)
+        self.assertEqual(time_to_threshold(0.5, 5.0, (2.0, 9.0)), 8.0)
+        self.assertEqual(time_to_threshold(0.5, 1.0, (2.0, 9.0)), 0.0)
+        self.assertIsNone(time_to_threshold(0.0, 5.0, (2.0, 9.0)))
+        self.assertIsNone(time_to_threshold(-1.0, 5.0, (math.nan, 9.0)))
+
+    def test_outliers(self):
+        values = {"dp0xe{}".format(n): 0.01 * (n % 3) for n in range(20)}
+        self.assertEqual(outliers(values), set())
+        values["dp0xe7"] = -2.0
+        self.assertEqual(outliers(values), {"dp0xe7"})
+        self.assertEqual(outliers({"a": 1.0, "b": 50.0}), set())
+        values["dp0xe7"] = 0.1
+        self.assertEqual(outliers(values), {"dp0xe7"})
+        self.assertEqual(outliers(values, min_deviation=0.1), set())
+
+
+class TestSummary(unittest.TestCase):
+
+    def test_degrading_port(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            history = DOMHistory(tmp)
+            start = 100 * DAY
+            # rx power of dp0xe3 falls 0.2 dB a day towards its alarm
+            # threshold, the other ports are steady
+            for hour in range(0, 24 * 7, 2):
+                now = start + hour * 3600
+                status = [sfp("dp0xe{}".format(n),
+                              temp=30.0 + (hour % 3) * 0.1 + n * 0.01)
+                          for n in range(8) if n != 3]
+                status.append(sfp(
+                    "dp0xe3", rx_mw=0.5 * 10 ** (-0.2 * hour / 24 / 10),
+                    low_rx_power_alarm_thresh=0.1,
+                    high_rx_power_alarm_thresh=2.0))
+                history.record(status, now=now)
+            history.close()
+            entries = {e["ifname"]: e for e in summary(history,
+                                                       now=start + 7 * DAY)}
+        self.assertEqual(len(entries), 8)
+        degrading = entries["dp0xe3"]
+        self.assertAlmostEqual(degrading["rx_power-trend"], -0.2, places=3)
+        self.assertEqual(degrading["alarm-measure"], "rx_power")
+        # from -3.01 - 0.2 * 6.9 dBm down to -10 dBm
+        self.assertAlmostEqual(degrading["time-to-alarm"] / DAY,
+                               (10 - 3.0103 - 0.2 * 166 / 24) / 0.2,
+                               places=1)
+        self.assertEqual(degrading["outliers"], ["rx_power"])
+        steady = entries["dp0xe1"]
+        self.assertAlmostEqual(steady["rx_power"], -3.0103, places=3)
+        self.assertIsNone(steady["time-to-alarm"])
+        self.assertEqual(steady["outliers"], [])
+
+    def test_missing_interface(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(summary(DOMHistory(tmp), "dp0xe1"), [])
+            self.assertEqual(summary(DOMHistory(tmp)), [])
+
+
+class TestDOMFile(unittest.TestCase):
+
+    def test_read_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dp0xe1.dom")
+            with DOMFile(path, [0], (4, 4)) as dom:
+                dom.add(10, [30.0, 3.3, 0.5, 0.6, 6.0])
+            os.chmod(path, 0o444)
+            with DOMFile(path) as dom:
+                self.assertEqual(dom.last_time(), 10)
+                self.assertTrue(math.isnan(dom.thresholds("bias")[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
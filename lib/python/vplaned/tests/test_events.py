@@ -0,0 +1,175 @@
+import asyncio
+import tempfile
+import unittest
+from vplaned import Controller
+from vplaned.aio import AsyncController
+from vplaned.tests.fakevplaned import FakeController, FakePublisher
+
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.fake = FakeController(self._tmp.name)
+        self.fake.start()
+        self.pub = FakePublisher(self._tmp.name, queue_size=10)
+        self.pub.start()
+
+    def tearDown(self):
+        self.pub.stop()
+        self.fake.stop()
+        self._tmp.cleanup()
+
+    def controller(self):
+        return Controller(self.fake.store_endpoint, self.fake.cfg_endpoint)
+
+    def subscribe(self, ctrl, topics, **kwds):
+        return ctrl.subscribe(topics, self.pub.events_endpoint,
+                              self.pub.snapshot_endpoint, **kwds)
+
+    def test_topics(self):
+        with self.controller() as ctrl, \
+                self.subscribe(ctrl, ["link", "sfp"]) as events:
+            self.pub.wait_subscribed(2)
+            self.pub.publish("link", {"dp0s3": "up"})
+            self.pub.publish("mpls", {"label": 16})
+            self.pub.publish("sfp", {"dp0s4": "alarm"})
+            received = [events.recv(timeout=5) for _ in range(2)]
+            self.assertIsNone(events.recv(timeout=0.05))
+        self.assertEqual([(e.topic, e.seq, e.json()) for e in received],
+                         [("link", 1, {"dp0s3": "up"}),
+                          ("sfp", 1, {"dp0s4": "alarm"})])
+        self.assertEqual(events.stats(),
+                         {"events": 2, "dropped": 0, "snapshots": 0,
+                          "restarts": 0})
+
+    def test_snapshot(self):
+        self.pub.publish("link", {"dp0s3": "down"}, key="dp0s3")
+        self.pub.publish("link", {"dp0s4": "up"}, key="dp0s4")
+        with self.controller() as ctrl, \
+                self.subscribe(ctrl, ["link"], snapshot=True) as events:
+            self.pub.wait_subscribed()
+            initial = [events.recv(timeout=5) for _ in range(2)]
+            self.pub.publish("link", {"dp0s3": "up"}, key="dp0s3")
+            event = events.recv(timeout=5)
+        self.assertEqual([(e.seq, e.json(), e.snapshot) for e in initial],
+                         [(2, {"dp0s3": "down"}, True),
+                          (2, {"dp0s4": "up"}, True)])
+        self.assertEqual((event.seq, event.snapshot), (3, False))
+
+    def test_snapshot_topics(self):
+        # the snapshot of a prefix covers each of the topics under it
+        self.pub.publish("link.dp0s3", {"state": "down"}, key="state")
+        self.pub.publish("link.dp0s3", {"state": "up"}, key="state")
+        self.pub.publish("link.dp0s4", {"state": "up"}, key="state")
+        with self.controller() as ctrl, \
+                self.subscribe(ctrl, ["link"], snapshot=True) as events:
+            self.pub.wait_subscribed()
+            received = [events.recv(timeout=5) for _ in range(2)]
+            self.pub.publish("link.dp0s4", {"state": "down"}, key="state")
+            received.append(events.recv(timeout=5))
+        self.assertEqual([(e.topic, e.seq, e.snapshot) for e in received],
+                         [("link.dp0s3", 2, True), ("link.dp0s4", 1, True),
+                          ("link.dp0s4", 2, False)])
+        self.assertEqual(events.stats(),
+                         {"events": 1, "dropped": 0, "snapshots": 1,
+                          "restarts": 0})
+
+    def test_resync_after_gap(self):
+        with self.controller() as ctrl, \
+                self.subscribe(ctrl, ["link"]) as events:
+            self.pub.wait_subscribed()
+            self.pub.publish("link", {"dp0s3": "up"}, key="dp0s3")
+            self.assertEqual(events.recv(timeout=5).seq, 1)
+            self.pub.publish("link", {"dp0s3": "down"}, key="dp0s3",
+                             drop=True)
+            self.pub.publish("link", {"dp0s4": "up"}, key="dp0s4",
+                             drop=True)
+            self.pub.publish("link", {"dp0s5": "up"})
+            received = [events.recv(timeout=5) for _ in range(3)]
+            self.pub.publish("link", {"dp0s6": "up"})
+            received.append(events.recv(timeout=5))
+        # the event revealing the gap comes first, the snapshot then wins
+        self.assertEqual([(e.seq, e.json(), e.snapshot) for e in received],
+                         [(4, {"dp0s5": "up"}, False),
+                          (4, {"dp0s3": "down"}, True),
+                          (4, {"dp0s4": "up"}, True),
+                          (5, {"dp0s6": "up"}, False)])
+        self.assertEqual(events.stats(),
+                         {"events": 3, "dropped": 2, "snapshots": 1,
+                          "restarts": 0})
+        self.assertEqual(self.pub.snapshots, 1)
+
+    def test_publisher_restart(self):
+        self.pub.publish("link", {"dp0s3": "up"}, key="dp0s3")
+        self.pub.publish("sfp", {"dp0s3": "ok"}, key="dp0s3")
+        with self.controller() as ctrl, \
+                self.subscribe(ctrl, ["link", "sfp"], snapshot=True) as events:
+            self.pub.wait_subscribed(2)
+            received = [events.recv(timeout=5) for _ in range(2)]
+            self.pub.publish("link", {"dp0s3": "down"}, key="dp0s3")
+            received.append(events.recv(timeout=5))
+            # numbered from scratch, the events are not taken as stale
+            self.pub.restart()
+            self.pub.publish("link", {"dp0s4": "up"}, key="dp0s4")
+            received += [events.recv(timeout=5) for _ in range(4)]
+            self.pub.publish("link", {"dp0s4": "down"}, key="dp0s4")
+            received.append(events.recv(timeout=5))
+        self.assertEqual(
+            [(e.topic, e.seq, e.json(), e.snapshot) for e in received],
+            [("link", 1, {"dp0s3": "up"}, True),
+             ("sfp", 1, {"dp0s3": "ok"}, True),
+             ("link", 2, {"dp0s3": "down"}, False),
+             # every topic is resynchronised after the restart
+             ("link", 1, {"dp0s4": "up"}, False),
+             ("link", 1, {"dp0s3": "down"}, True),
+             ("link", 1, {"dp0s4": "up"}, True),
+             ("sfp", 0, {"dp0s3": "ok"}, True),
+             ("link", 2, {"dp0s4": "down"}, False)])
+        self.assertEqual(events.stats(),
+                         {"events": 3, "dropped": 0, "snapshots": 4,
+                          "restarts": 1})
+
+    def test_queue_overflow(self):
+        with self.controller() as ctrl, \
+                self.subscribe(ctrl, ["link"], queue_size=10) as events:
+            self.pub.wait_subscribed()
+            for n in range(20000):
+                self.pub.publish("link", {"n": n}, key=n % 4)
+            state = {}
+            for event in iter(lambda: events.recv(timeout=0.5), None):
+                n = event.json()["n"]
+                state[n % 4] = n
+        stats = events.stats()
+        self.assertGreater(stats["dropped"], 0)
+        self.assertGreater(stats["snapshots"], 0)
+        self.assertLess(stats["events"], 20000)
+        self.assertEqual(state, {0: 19996, 1: 19997, 2: 19998, 3: 19999})
+
+    def test_async(self):
+        async def run():
+            async with AsyncController(self.fake.store_endpoint,
+                                       self.fake.cfg_endpoint) as ctrl:
+                async with ctrl.subscribe(
+                        ["link"], self.pub.events_endpoint,
+                        self.pub.snapshot_endpoint, snapshot=True) as events:
+                    self.pub.wait_subscribed()
+                    self.pub.publish("link", {"dp0s4": "up"}, key="dp0s4",
+                                     drop=True)
+                    self.pub.publish("link", {"dp0s5": "up"})
+                    received = []
+                    async for event in events:
+                        received.append(event)
+                        if not event.snapshot:
+                            return received, events.stats()
+
+        self.pub.publish("link", {"dp0s3": "up"}, key="dp0s3")
+        received, stats = asyncio.run(run())
+        self.assertEqual([(e.seq, e.snapshot) for e in received],
+                         [(1, True), (3, False)])
+        self.assertEqual(stats, {"events": 1, "dropped": 1, "snapshots": 2,
+                                 "restarts": 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
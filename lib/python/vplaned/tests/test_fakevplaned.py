@@ -0,0 +1,86 @@
+import base64
+import json
+import tempfile
+import unittest
+import zmq
+from vplaned import Controller
+from vplaned.tests.fakevplaned import (
+    FakeDataplane, FakeTopology, decode_envelope, pb_decode, pb_encode,
+    payload)
+
+DATAPLANE_ENVELOPE = {1: "type", 2: "msg"}
+VPLANED_ENVELOPE = {1: "key", 2: "action", 3: "interface", 4: "msg"}
+
+
+class TestFakeVplaned(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_pb_codec(self):
+        msg = {"type": "vyatta:maclimit", "msg": b"\x08\x96\x01" * 100}
+        data = pb_encode(msg, DATAPLANE_ENVELOPE)
+        self.assertEqual(pb_decode(data, DATAPLANE_ENVELOPE),
+                         {"type": b"vyatta:maclimit", "msg": msg["msg"]})
+        self.assertEqual(pb_decode(pb_encode({"action": 300}, {7: "action"}),
+                                   {7: "action"}), {"action": 300})
+
+    def test_decode_envelope(self):
+        de = pb_encode({"type": "vyatta:sfpmonitor", "msg": b"\x10\x01"},
+                       DATAPLANE_ENVELOPE)
+        ve = pb_encode({"key": "sfp-monitor", "action": 1,
+                        "interface": "ALL", "msg": de}, VPLANED_ENVELOPE)
+        cmd = "protobuf " + base64.b64encode(ve).decode()
+        self.assertEqual(decode_envelope(cmd),
+                         {"key": "sfp-monitor", "action": "DELETE",
+                          "interface": "ALL", "type": "vyatta:sfpmonitor",
+                          "msg": b"\x10\x01"})
+
+    def test_topology(self):
+        with FakeTopology(self._tmp.name, dataplanes=3, interfaces=8,
+                          payload_size=1000,
+                          replies={"debug": {"debug": {}}}) as topology:
+            with Controller(topology.store_endpoint, topology.cfg_endpoint,
+                            pool=None) as ctrl:
+                dps = list(ctrl.get_dataplanes())
+                replies = ctrl.broadcast("ifconfig")
+                debug = ctrl.broadcast("debug")
+            stats = topology.stats()
+
+        self.assertEqual([len(dp.interfaces) for dp in dps], [3, 3, 2])
+        self.assertIn("dp1p4", dps[1].interfaces)
+        for reply in replies.values():
+            self.assertEqual(len(json.dumps(reply)), 1000)
+        self.assertEqual(list(debug.values()), [{"debug": {}}] * 3)
+        # GETVPCONFIG for each call, and two commands to each dataplane
+        self.assertEqual(stats["messages"], 9)
+        self.assertGreater(stats["bytes_out"], 6000)
+        self.assertEqual(payload(10), {"payload": ""})
+
+    def test_protobuf_command(self):
+        def echo(msg_type, msg):
+            return msg[::-1]
+
+        with FakeDataplane(self._tmp.name,
+                           pb_replies={"vyatta:echo": echo}) as dp:
+            ctx = zmq.Context()
+            sock = ctx.socket(zmq.REQ)
+            sock.connect(dp.control)
+            for msg_type in ("vyatta:echo", "vyatta:other"):
+                sock.send_multipart([b"protobuf", pb_encode(
+                    {"type": msg_type, "msg": b"abc"}, DATAPLANE_ENVELOPE)])
+                reply = pb_decode(sock.recv(), DATAPLANE_ENVELOPE)
+                self.assertEqual(reply["type"], msg_type.encode())
+                self.assertEqual(reply.get("msg", b""),
+                                 b"cba" if msg_type == "vyatta:echo" else b"")
+            sock.close()
+            ctx.term()
+        self.assertEqual(dp.pb_commands, [("vyatta:echo", b"abc"),
+                                          ("vyatta:other", b"abc")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from vplaned import Controller, DataplaneException
+from vplaned.rates import RateHistory, RateSampler, query_rates
+from vplaned.tests.fakevplaned import FakeController, FakeDataplane
+
+
+class TestRateHistory(unittest.TestCase):
+
+    def test_query(self):
+        history = RateHistory(depth=8)
+        for t in range(5):
+            history.add(float(t), {"dp0s3": (t, 10 * t, 0, 0)})
+
+        stats = history.query(window=2.0, percentiles=(50, 100))
+        self.assertEqual(stats["samples"], 3)
+        self.assertEqual(stats["window"], 2.0)
+        rx_pps = stats["interfaces"]["dp0s3"]["rx_pps"]
+        self.assertEqual(rx_pps["current"], 4)
+        self.assertEqual(rx_pps["peak"], 4)
+        self.assertEqual(rx_pps["mean"], 3)
+        self.assertEqual(rx_pps["p50"], 3)
+        self.assertEqual(rx_pps["p100"], 4)
+        self.assertTrue(3 < rx_pps["ewma"] < 4)
+        self.assertEqual(stats["interfaces"]["dp0s3"]["rx_bps"]["peak"], 40)
+
+    def test_ring_wraps(self):
+        history = RateHistory(depth=4)
+        for t in range(10):
+            history.add(float(t), {"dp0s3": (t, 0, 0, 0)})
+
+        stats = history.query(window=100.0)
+        self.assertEqual(stats["samples"], 4)
+        self.assertEqual(stats["interfaces"]["dp0s3"]["rx_pps"]["mean"], 7.5)
+
+    def test_missing_samples(self):
+        history = RateHistory(depth=8)
+        history.add(0.0, {"dp0s3": (1, 0, 0, 0)})
+        history.add(1.0, {"dp0s3": (2, 0, 0, 0), "dp0s4": (5, 0, 0, 0)})
+        history.add(2.0, {"dp0s4": (6, 0, 0, 0)})
+
+        stats = history.query(window=10.0)["interfaces"]
+        self.assertEqual(stats["dp0s3"]["rx_pps"]["current"], 2)
+        self.assertEqual(stats["dp0s4"]["rx_pps"]["mean"], 5.5)
+        self.assertIsNone(history.query(window=0.5)["interfaces"]
+                          ["dp0s3"]["rx_pps"])
+
+    def test_bounded(self):
+        history = RateHistory(depth=4, max_interfaces=2)
+        history.add(0.0, {"dp0s{}".format(i): (i, 0, 0, 0)
+                          for i in range(5)})
+        self.assertEqual(len(history), 2)
+
+        history.retain({"dp0s0"})
+        self.assertEqual(list(history.query()["interfaces"]), ["dp0s0"])
+
+
+class TestRateSampler(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.start = time.monotonic()
+
+        def ifconfig(cmd):
+            packets = int((time.monotonic() - self.start) * 1000)
+            return {"interfaces": [
+                {"name": "dp0s3",
+                 "statistics": {"rx_packets": packets,
+                                "rx_bytes": packets * 100,
+                                "tx_packets": 0, "tx_bytes": 0}}]}
+
+        self.dps = [FakeDataplane(self._tmp.name, dp_id=i,
+                                  replies={"ifconfig": ifconfig})
+                    for i in range(2)]
+        for dp in self.dps:
+            dp.start()
+        self.fake = FakeController(self._tmp.name,
+                                   dataplanes=[dp.info() for dp in self.dps])
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        for dp in self.dps:
+            dp.stop()
+        self._tmp.cleanup()
+
+    def test_poll_and_serve(self):
+        path = os.path.join(self._tmp.name, "rates.socket")
+        with Controller(self.fake.store_endpoint,
+                        self.fake.cfg_endpoint) as ctrl:
+            sampler = RateSampler(ctrl, interval=0.05, depth=16)
+            for _ in range(4):
+                sampler.poll()
+                time.sleep(0.05)
+        self.assertEqual(sampler.history.samples, 4)
+
+        threading.Thread(target=sampler.serve, args=(path,),
+                         daemon=True).start()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+        stats = query_rates(["dp0s3", "dp0s4"], window=1.0, path=path)
+
+        # 1000 packets/s on each of the two dataplanes
+        rx_pps = stats["interfaces"]["dp0s3"]["rx_pps"]
+        self.assertEqual(stats["samples"], 4)
+        self.assertEqual(list(stats["interfaces"]), ["dp0s3"])
+        self.assertAlmostEqual(rx_pps["mean"], 2000, delta=300)
+        self.assertAlmostEqual(stats["interfaces"]["dp0s3"]["rx_bps"]["mean"],
+                               2000 * 800, delta=300 * 800)
+
+    def test_serve_idle(self):
+        # a listening socket passed in, as by systemd socket activation
+        path = os.path.join(self._tmp.name, "rates.socket")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen()
+        server = threading.Thread(target=RateSampler(None).serve,
+                                  kwargs={"sock": sock, "idle_timeout": 0.3},
+                                  daemon=True)
+        server.start()
+        for _ in range(3):
+            time.sleep(0.2)
+            self.assertEqual(query_rates(path=path)["samples"], 0)
+        self.assertTrue(server.is_alive())
+        server.join(2)
+        self.assertFalse(server.is_alive())
+        self.assertEqual(sock.fileno(), -1)
+
+    def test_poll_failures(self):
+        self.dps[1].replies = {}
+        with Controller(self.fake.store_endpoint,
+                        self.fake.cfg_endpoint) as ctrl:
+            sampler = RateSampler(ctrl)
+            failures = sampler.poll()
+        self.assertEqual(len(failures), 1)
+        self.assertIsInstance(failures[0], DataplaneException)
+        self.assertIn("dataplane 1", str(failures[0]))
+
+    def test_poll_errors_logged(self):
+        class Stop(BaseException):
+            pass
+
+        timeout = DataplaneException("timed out on dataplane 1")
+        results = [[timeout], [timeout], ValueError("bad reply"), [], []]
+
+        class Scripted(RateSampler):
+            def poll(self):
+                if not results:
+                    raise Stop()
+                result = results.pop(0)
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+        with self.assertLogs("vplaned.rates", "INFO") as logs, \
+                self.assertRaises(Stop):
+            Scripted(None, interval=0)._poll_forever()
+        self.assertEqual(logs.output, [
+            "ERROR:vplaned.rates:Error polling interface rates: "
+            "timed out on dataplane 1",
+            "ERROR:vplaned.rates:Error polling interface rates: bad reply",
+            "INFO:vplaned.rates:Polling interface rates again"])
+
+
+if __name__ == '__main__':
+    unittest.main()
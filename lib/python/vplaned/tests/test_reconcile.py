@@ -0,0 +1,43 @@
+import unittest
+from vplaned.reconcile import Changes, diff, read_list, read_lists
+
+
+class FakeClient:
+
+    RUNNING = 0
+    CANDIDATE = 1
+
+    def __init__(self, running, candidate):
+        self.trees = {self.RUNNING: running, self.CANDIDATE: candidate}
+        self.calls = 0
+
+    def tree_get_dict(self, path, db):
+        self.calls += 1
+        return self.trees[db][path]
+
+
+class TestReconcile(unittest.TestCase):
+
+    def test_diff(self):
+        old = {10: "a", 20: "b", 30: "c"}
+        new = {20: "b", 30: "d", 40: "e"}
+        self.assertEqual(diff(old, new),
+                         Changes(added={40: "e"}, changed={30: ("c", "d")},
+                                 deleted={10: "a"}))
+        self.assertEqual(diff(old, old), Changes({}, {}, {}))
+
+    def test_read_list(self):
+        path = "interfaces dataplane dp0p1 storm-control vlan"
+        running = {path: {"vlan": [{"vlan-id": 10, "profile": "a"},
+                                   {"vlan-id": 20}]}}
+        client = FakeClient(running, {})
+        self.assertEqual(read_list(client, path, client.RUNNING,
+                                   "vlan-id", "profile"), {10: "a"})
+        # a missing list reads as empty
+        self.assertEqual(read_lists(client, path, "vlan-id", "profile"),
+                         ({10: "a"}, {}))
+        self.assertEqual(client.calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import unittest
+from vplaned.routesnap import Section, Snapshot, SnapshotException, \
+    SnapshotWriter, decode_key, diff, encode_key
+
+
+def gateway(via, ifname="dp0xe1"):
+    return [{"state": "gateway", "via": via, "ifname": ifname}]
+
+
+def route_reply(tables):
+    """Reply to "pd show dataplane route <subset>": {(vrf, table): routes}"""
+    fields = []
+    for (vrf_id, table), routes in tables.items():
+        fields.append({"vrf_id": vrf_id, "table": table})
+        fields += [{"prefix": prefix, "next_hop": next_hop}
+                   for prefix, next_hop in routes]
+    return json.dumps({"route_show": fields})
+
+
+class TestKeys(unittest.TestCase):
+
+    def test_route(self):
+        for obj, prefix in (("route", "10.1.2.0/24"), ("route", "0.0.0.0/0"),
+                            ("route6", "2001:db8::/64")):
+            key = encode_key(obj, {"prefix": prefix})
+            self.assertEqual(decode_key(obj, key), prefix)
+        self.assertLess(encode_key("route", {"prefix": "9.0.0.0/8"}),
+                        encode_key("route", {"prefix": "10.0.0.0/8"}))
+        self.assertEqual(decode_key("route", encode_key(
+            "route", {"prefix": "10.0.0.1"})), "10.0.0.1/32")
+
+    def test_mroute_and_mpls(self):
+        for source in ("*", "10.0.0.1"):
+            key = encode_key("mroute", {"source": source,
+                                        "group": "239.1.1.1"})
+            self.assertEqual(decode_key("mroute", key),
+                             "{} 239.1.1.1".format(source))
+        key = encode_key("mpls-route", {"address": 1048575})
+        self.assertEqual(decode_key("mpls-route", key), "1048575")
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write(self, name, obj, replies):
+        """Write the snapshot of replies: {(dp_id, state): text}"""
+        writer = SnapshotWriter(obj)
+        for (dp_id, state), text in replies.items():
+            writer.add_reply(dp_id, state, text)
+        path = os.path.join(self._tmp.name, name)
+        writer.write(path)
+        return path
+
+    def test_write_and_read(self):
+        path = self.write("snap", "route", {
+            (0, "full"): route_reply({
+                (1, 254): [("10.0.1.0/24", gateway("1.1.1.1")),
+                           ("10.0.0.0/24", gateway("1.1.1.1"))],
+                (2, 10): [("10.0.0.0/24", gateway("2.2.2.2"))]}),
+            (0, "no_resource"): route_reply({
+                (1, 254): [("10.0.2.0/24", gateway("1.1.1.2"))]}),
+            (1, "full"): route_reply({})})
+        with Snapshot(path) as snap:
+            self.assertEqual(snap.obj, "route")
+            self.assertEqual(len(snap), 4)
+            self.assertEqual(snap.counts(), {
+                Section(0, 1, 254): {"full": 2, "no_resource": 1},
+                Section(0, 2, 10): {"full": 1}})
+            self.assertEqual(list(snap.routes(Section(0, 1, 254))), [
+                ("10.0.0.0/24", "full", gateway("1.1.1.1")),
+                ("10.0.1.0/24", "full", gateway("1.1.1.1")),
+                ("10.0.2.0/24", "no_resource", gateway("1.1.1.2"))])
+            self.assertEqual(list(snap.routes(Section(1, 0, 0))), [])
+
+    def test_mpls(self):
+        text = json.dumps({"objects": [{"lblspc": 0, "mpls_routes": [
+            {"address": 200, "next_hop": gateway("1.1.1.1")},
+            {"address": 100, "next_hop": gateway("1.1.1.1")}]}]})
+        path = self.write("snap", "mpls-route", {(0, "partial"): text})
+        with Snapshot(path) as snap:
+            self.assertEqual([r[:2] for r in snap.routes(Section(0, 0, 0))],
+                             [("100", "partial"), ("200", "partial")])
+
+    def test_diff(self):
+        main = (1, 254)
+        old = self.write("old", "route", {
+            (0, "full"): route_reply({main: [
+                ("10.0.0.0/24", gateway("1.1.1.1")),
+                ("10.0.1.0/24", gateway("1.1.1.1")),
+                ("10.0.2.0/24", gateway("1.1.1.1")),
+                ("10.0.3.0/24", gateway("1.1.1.1"))]}),
+            (1, "full"): route_reply({main: [
+                ("10.0.0.0/24", gateway("1.1.1.1"))]})})
+        new = self.write("new", "route", {
+            (0, "full"): route_reply({main: [
+                ("10.0.0.0/24", gateway("1.1.1.1")),
+                ("10.0.2.0/24", gateway("1.1.1.9")),
+                ("10.0.4.0/24", gateway("1.1.1.1"))]}),
+            (0, "no_resource"): route_reply({main: [
+                ("10.0.3.0/24", gateway("1.1.1.1"))]}),
+            (1, "full"): route_reply({main: [
+                ("10.0.0.0/24", gateway("1.1.1.1"))]})})
+        with Snapshot(old) as before, Snapshot(new) as after:
+            changes = list(diff(before, after))
+            self.assertEqual(list(diff(after, after)), [])
+        self.assertEqual([c.section for c in changes],
+                         [Section(0, 1, 254)] * 4)
+        self.assertEqual([(c.route, c.old_state, c.new_state)
+                          for c in changes],
+                         [("10.0.1.0/24", "full", None),
+                          ("10.0.2.0/24", "full", "full"),
+                          ("10.0.3.0/24", "full", "no_resource"),
+                          ("10.0.4.0/24", None, "full")])
+        self.assertEqual(changes[1].old_next_hop, gateway("1.1.1.1"))
+        self.assertEqual(changes[1].new_next_hop, gateway("1.1.1.9"))
+        self.assertIsNone(changes[3].old_next_hop)
+
+    def test_bad_snapshot(self):
+        path = os.path.join(self._tmp.name, "junk")
+        with open(path, "wb") as f:
+            f.write(b"junk" * 100)
+        self.assertRaises(SnapshotException, Snapshot, path)
+        path = self.write("snap", "route", {(0, "full"): route_reply({
+            (1, 254): [("10.0.0.0/24", gateway("1.1.1.1"))]})})
+        os.truncate(path, os.path.getsize(path) - 1)
+        self.assertRaises(SnapshotException, Snapshot, path)
+        self.assertRaises(SnapshotException, SnapshotWriter, "arp")
+
+    def test_different_objects(self):
+        route = self.write("route", "route", {})
+        route6 = self.write("route6", "route6", {})
+        with Snapshot(route) as old, Snapshot(route6) as new:
+            with self.assertRaises(SnapshotException):
+                list(diff(old, new))
+
+
+if __name__ == '__main__':
+    unittest.main()
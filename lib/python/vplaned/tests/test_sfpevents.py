@@ -0,0 +1,128 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from vplaned import sfpevents
+from vplaned.sfpevents import SFPEvents, SFPEventsException, format_event
+
+
+def export(entries):
+    """"journalctl --output=json" of the (cursor, usec, message) entries"""
+    out = io.BytesIO()
+    for cursor, usec, message in entries:
+        if isinstance(message, str):
+            message = message.encode()
+        try:
+            message = message.decode()
+        except UnicodeDecodeError:
+            message = list(message)
+        out.write(json.dumps({
+            "__CURSOR": cursor, "__REALTIME_TIMESTAMP": str(usec),
+            "_HOSTNAME": "vrouter", "SYSLOG_IDENTIFIER": "dataplane",
+            "_PID": "42", "MESSAGE": message}).encode() + b"\n")
+    out.seek(0)
+    return out
+
+
+def journal(start, count):
+    """Entries of a dataplane journal, every third one an SFP_MON event on
+    one of three interfaces, one second apart"""
+    entries = []
+    for n in range(start, start + count):
+        if n % 3:
+            message = "dataplane: port {} link up".format(n)
+        else:
+            message = "SFP_MON: dp0xe{}: rx power low warning {}".format(
+                n // 3 % 3, n)
+        entries.append(("s=1;i={:x}".format(n), n * 1000000, message))
+    return entries
+
+
+class TestSFPEvents(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, "sfp-events")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def update(self, entries):
+        return sfpevents.update(export(entries),
+                                path=self.path)
+
+    def test_binary_message(self):
+        self.update([("c1", 5, b"SFP_MON: dp0xe1: multi\nline \xff")])
+        with SFPEvents(self.path) as store:
+            self.assertEqual(store.events("dp0xe1")[0].text,
+                             "vrouter dataplane[42]: SFP_MON: dp0xe1: multi"
+                             "\nline \ufffd")
+
+    def test_missing_index(self):
+        with SFPEvents(self.path) as store:
+            self.assertEqual(len(store), 0)
+            self.assertIsNone(store.cursor)
+            self.assertEqual(store.events(), [])
+
+    def test_queries(self):
+        self.assertEqual(self.update(journal(0, 300)), 100)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+        with SFPEvents(self.path) as store:
+            self.assertEqual(store.cursor, "s=1;i=12b")
+            events = store.events("dp0xe1")
+            self.assertEqual([e.time // 1000000 for e in events],
+                             list(range(3, 300, 9)))
+            self.assertEqual(events[0].text, "vrouter dataplane[42]: "
+                             "SFP_MON: dp0xe1: rx power low warning 3")
+            self.assertTrue(format_event(events[0]).endswith(events[0].text))
+            self.assertEqual(
+                [e.time // 1000000
+                 for e in store.events("dp0xe2", 60 * 1000000, 120 * 1000000)],
+                [60, 69, 78, 87, 96, 105, 114])
+            self.assertEqual([e.time // 1000000 for e in store.events(
+                since=30 * 1000000, until=40 * 1000000)], [30, 33, 36, 39])
+            self.assertEqual(len(store.events()), 100)
+            self.assertEqual(store.events("dp0xe"), [])
+            self.assertEqual(store.events("dp0xe10"), [])
+
+    def test_incremental(self):
+        self.update(journal(0, 30))
+        self.assertEqual(self.update(journal(30, 2)), 1)
+        # the cursor moves without rewriting the index
+        inode = os.stat(self.path).st_ino
+        self.assertEqual(self.update(journal(31, 2)), 0)
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(self.update([]), 0)
+        with SFPEvents(self.path) as store:
+            self.assertEqual(store.cursor, "s=1;i=20")
+            self.assertEqual(len(store), 11)
+            self.assertEqual(store.events("dp0xe1")[-1].time, 30000000)
+
+    def test_no_interface(self):
+        self.update([("c1", 1, "SFP_MON: module inserted"),
+                     ("c2", 2, "SFP_MON: dp0p1s2.100 rx los"),
+                     ("c3", 3, "SFP_MON: xdp0s3 removed")])
+        with SFPEvents(self.path) as store:
+            self.assertEqual([(e.time, e.ifname) for e in store.events()],
+                             [(1, ""), (2, "dp0p1s2.100"), (3, "")])
+
+    def test_max_events(self):
+        sfpevents.update(export(journal(0, 300)),
+                         path=self.path, max_events=10)
+        with SFPEvents(self.path) as store:
+            self.assertEqual([e.time // 1000000 for e in store.events()],
+                             list(range(270, 300, 3)))
+
+    def test_bad_index(self):
+        with open(self.path, "wb") as f:
+            f.write(b"garbage" * 100)
+        with self.assertRaises(SFPEventsException):
+            SFPEvents(self.path)
+        self.update(journal(0, 3))
+        with SFPEvents(self.path) as store:
+            self.assertEqual(len(store), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
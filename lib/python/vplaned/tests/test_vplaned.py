@@ -1,8 +1,23 @@
 import vplaned
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import zmq
 import unittest
 from unittest.mock import patch
 from unittest.mock import MagicMock
+from vplaned.tests.fakevplaned import (FakeController, FakeDataplane,
+                                       FakeTopology)
+
+try:
+    vplaned.vplaned._protobuf()
+    HAVE_PROTOBUF = True
+except ImportError:
+    HAVE_PROTOBUF = False
 
 
 class MockZmqSocket(MagicMock):
@@ -63,12 +78,25 @@ class TestController(unittest.TestCase):
             with self.assertRaises(vplaned.ControllerException):
                 ctrl.store("path to object", "command 2", action="DELETE")
 
+    @patch.dict(os.environ)
     def test_store_action_exception(self):
+        os.environ.pop("COMMIT_ACTION", None)
         with self.assertRaises(vplaned.ControllerException):
             with vplaned.Controller() as ctrl:
                 ctrl._store_socket.recv_string.return_value = "OK"
                 ctrl.store("path to object", "command 2")
 
+    @patch.dict(os.environ, {"COMMIT_ACTION": "DELETE"})
+    def test_store_action_environment(self):
+        # read when storing, not when vplaned was imported
+        out = {"path": {"to": {"object": {"__DELETE__": "command 2",
+                                          "__INTERFACE__": "ALL"}}}}
+        with vplaned.Controller() as ctrl:
+            ctrl._store_socket.send_json.side_effect = \
+                lambda json: self.assertEqual(json, out)
+            ctrl._store_socket.recv_string.return_value = "OK"
+            ctrl.store("path to object", "command 2")
+
     def test_get_dataplanes_success(self):
         data = {"dataplanes": [{"id": 0, "control": "ipc:///dev/null"},
                                {"id": 1, "control": "ipc:///dev/nuller"}]}
@@ -102,6 +130,464 @@ class TestController(unittest.TestCase):
                 dps = list(ctrl.get_dataplanes())
 
 
+class TestControllerBatch(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.fake = FakeController(self._tmp.name,
+                                   reject=lambda path: path.endswith(" 13"))
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        self._tmp.cleanup()
+
+    def controller(self):
+        return vplaned.Controller(self.fake.store_endpoint,
+                                  self.fake.cfg_endpoint)
+
+    def test_batch_merges_entries(self):
+        with self.controller() as ctrl:
+            with ctrl.batch(max_entries=4) as batch:
+                for vlan in range(10):
+                    ctrl.store("storm-ctl dp0s3 {}".format(vlan),
+                               "storm-ctl SET dp0s3 vlan {}".format(vlan),
+                               "dp0s3", "SET")
+                self.assertEqual(self.fake.messages, 0)
+        self.assertEqual(batch.messages, 3)
+        self.assertEqual(self.fake.messages, 3)
+        self.assertEqual(len(self.fake.stored), 10)
+        self.assertEqual(self.fake.stored["storm-ctl dp0s3 7"],
+                         {"__INTERFACE__": "dp0s3",
+                          "__SET__": "storm-ctl SET dp0s3 vlan 7"})
+
+    def test_batch_keeps_order_of_same_path(self):
+        with self.controller() as ctrl:
+            with ctrl.batch() as batch:
+                ctrl.store("storm-ctl dp0s3 1", "delete", "dp0s3", "DELETE")
+                ctrl.store("storm-ctl dp0s3 2", "delete", "dp0s3", "DELETE")
+                ctrl.store("storm-ctl dp0s3 1", "set", "dp0s3", "SET")
+                ctrl.store("storm-ctl dp0s3", "set", "dp0s3", "SET")
+        self.assertEqual(batch.messages, 3)
+        self.assertEqual(self.fake.stored["storm-ctl dp0s3 1"]["__SET__"],
+                         "set")
+
+    def test_batch_reports_failed_entries(self):
+        with self.controller() as ctrl:
+            with self.assertRaises(vplaned.BatchException) as cm:
+                with ctrl.batch():
+                    for vlan in range(10, 20):
+                        ctrl.store("storm-ctl dp0s3 {}".format(vlan),
+                                   "cmd {}".format(vlan), "dp0s3", "SET")
+        self.assertEqual(cm.exception.failures,
+                         [("storm-ctl dp0s3 13", "cmd 13", "FAIL")])
+        self.assertEqual(len(self.fake.stored), 9)
+
+    def test_batch_discarded_on_exception(self):
+        with self.controller() as ctrl:
+            with self.assertRaises(KeyError):
+                with ctrl.batch():
+                    ctrl.store("storm-ctl dp0s3 1", "cmd", "dp0s3", "SET")
+                    raise KeyError()
+            ctrl.store("storm-ctl dp0s3 2", "cmd", "dp0s3", "SET")
+        self.assertEqual(list(self.fake.stored), ["storm-ctl dp0s3 2"])
+
+    def test_batch_nested_fail(self):
+        with self.controller() as ctrl:
+            with ctrl.batch():
+                with self.assertRaises(vplaned.ControllerException):
+                    with ctrl.batch():
+                        pass
+
+
+class TestControllerBroadcast(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        replies = {"debug": {"debug": {"dp": ["npf"]}}, "version": "4.2"}
+        self.dps = [FakeDataplane(self._tmp.name, dp_id=0, latency=0.05,
+                                  replies=replies),
+                    FakeDataplane(self._tmp.name, dp_id=1, latency=0.01,
+                                  replies=replies),
+                    FakeDataplane(self._tmp.name, dp_id=2, latency=0.01),
+                    FakeDataplane(self._tmp.name, dp_id=3, latency=5,
+                                  replies=replies)]
+        for dp in self.dps:
+            dp.start()
+        self.fake = FakeController(self._tmp.name,
+                                   dataplanes=[dp.info() for dp in self.dps])
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        for dp in self.dps:
+            dp.stop()
+        self._tmp.cleanup()
+
+    def controller(self):
+        return vplaned.Controller(self.fake.store_endpoint,
+                                  self.fake.cfg_endpoint)
+
+    def test_broadcast(self):
+        with self.controller() as ctrl:
+            replies = ctrl.broadcast("debug", timeout=500)
+        self.assertEqual(list(replies), [0, 1, 2, 3])
+        self.assertEqual(replies[0], {"debug": {"dp": ["npf"]}})
+        self.assertEqual(replies[1], {"debug": {"dp": ["npf"]}})
+        self.assertIsInstance(replies[2], vplaned.DataplaneException)
+        self.assertIsInstance(replies[3], vplaned.DataplaneException)
+        self.assertIn("timed out", str(replies[3]))
+
+    def test_broadcast_iter_completion_order(self):
+        with self.controller() as ctrl:
+            dps = list(ctrl.get_dataplanes())[:2]
+            replies = list(ctrl.broadcast_iter("version", string=True,
+                                               dataplanes=dps))
+        self.assertEqual([(dp.id, reply) for dp, reply in replies],
+                         [(1, "4.2"), (0, "4.2")])
+
+
+class TestCommandStats(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.topology = FakeTopology(
+            self._tmp.name, dataplanes=2,
+            replies={"debug": {"debug": {}}, "version": "4.2"})
+        self.topology.start()
+        self.records = []
+        self.stats = vplaned.enable_command_stats(
+            lambda name, record: self.records.append((name, record)))
+
+    def tearDown(self):
+        vplaned.disable_command_stats()
+        self.topology.stop()
+        self._tmp.cleanup()
+
+    def controller(self):
+        return vplaned.Controller(self.topology.store_endpoint,
+                                  self.topology.cfg_endpoint, pool=None)
+
+    def test_commands(self):
+        with self.controller() as ctrl:
+            dps = list(ctrl.get_dataplanes())
+            with dps[0]:
+                self.assertEqual(dps[0].json_command("debug"),
+                                 {"debug": {}})
+                self.assertEqual(dps[0].string_command("version"), "4.2")
+                with self.assertRaises(vplaned.DataplaneException):
+                    dps[0].string_command("unknown")
+            ctrl.broadcast("debug", dataplanes=dps)
+            ctrl.store("a b", "cmd", action="SET")
+            with ctrl.batch():
+                for n in range(3):
+                    ctrl.store("c {}".format(n), "cmd", action="SET")
+            ctrl.config([b"SETVPCONFIG", b"x"])
+
+        stats = self.stats.stats()
+        self.assertEqual(sorted(stats), ["GETVPCONFIG", "SETVPCONFIG",
+                                         "debug", "store", "unknown",
+                                         "version"])
+        self.assertEqual(stats["debug"]["count"], 3)
+        self.assertEqual(stats["debug"]["wait"]["count"], 3)
+        self.assertEqual(stats["debug"]["decode"]["buckets"][-1], 3)
+        self.assertEqual(stats["debug"]["request_bytes"], 3 * len("debug"))
+        self.assertEqual(stats["debug"]["response_bytes"],
+                         3 * len('OK{"debug": {}}'))
+        self.assertEqual(stats["unknown"]["errors"], 1)
+        # a single store, and a single batched message
+        self.assertEqual(stats["store"]["count"], 2)
+        self.assertEqual(stats["SETVPCONFIG"]["request_bytes"], 12)
+        self.assertEqual(len(self.records), 9)
+        self.assertEqual(self.records[0][0], "GETVPCONFIG")
+
+        text = self.stats.prometheus()
+        self.assertIn('vplaned_command_seconds_count{command="debug",'
+                      'phase="wait"} 3\n', text)
+        self.assertIn('vplaned_command_seconds_bucket{command="debug",'
+                      'phase="send",le="+Inf"} 3\n', text)
+        self.assertIn('vplaned_command_errors_total{command="unknown"} 1\n',
+                      text)
+        self.assertEqual(json.loads(self.stats.json())["commands"], stats)
+
+        self.stats.reset()
+        self.assertEqual(self.stats.stats(), {})
+
+    def test_topology_cache(self):
+        for cache in (vplaned.TopologyCache(ttl=0),
+                      vplaned.TopologyCache(ttl=60)):
+            self.stats.reset()
+            with vplaned.Controller(self.topology.store_endpoint,
+                                    self.topology.cfg_endpoint, pool=None,
+                                    topology_cache=cache) as ctrl:
+                for _ in range(3):
+                    self.assertEqual(len(list(ctrl.get_dataplanes())), 2)
+            # every fetch is recorded, cache hits are not fetches
+            stats = self.stats.stats()["GETVPCONFIG"]
+            self.assertEqual(stats["count"],
+                             cache.unchanged + cache.refreshes)
+            self.assertGreater(stats["response_bytes"], 0)
+        self.assertEqual(stats["count"], 1)
+
+    def test_timeout(self):
+        self.topology.dataplanes[1].latency = 1
+        with self.controller() as ctrl:
+            ctrl.broadcast("version", timeout=100)
+        stats = self.stats.stats()["version"]
+        self.assertEqual(stats["count"], 2)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["wait"]["count"], 1)
+
+    def test_environment(self):
+        path = os.path.join(self._tmp.name, "stats.prom")
+        script = ("import vplaned\n"
+                  "with vplaned.Controller({!r}, {!r}) as ctrl:\n"
+                  "    ctrl.broadcast('version')\n").format(
+                      self.topology.store_endpoint,
+                      self.topology.cfg_endpoint)
+        env = dict(os.environ, VPLANED_STATS=path,
+                   PYTHONPATH=os.path.dirname(os.path.dirname(
+                       os.path.dirname(os.path.abspath(__file__)))))
+        subprocess.run([sys.executable, "-c", script], env=env, check=True)
+        with open(path) as f:
+            text = f.read()
+        self.assertIn('vplaned_command_requests_total{command="version"} 2',
+                      text)
+
+
+@unittest.skipUnless(HAVE_PROTOBUF, "needs google.protobuf and vyatta.proto")
+class TestProtobuf(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+        def echo(msg_type, msg):
+            return msg
+
+        self.topology = FakeTopology(self._tmp.name,
+                                     pb_replies={"vyatta:echo": echo})
+        self.topology.start()
+        # Any message type does as a command
+        _, self.message, _ = vplaned.vplaned._protobuf()
+
+    def tearDown(self):
+        vplaned.disable_command_stats()
+        self.topology.stop()
+        self._tmp.cleanup()
+
+    def controller(self):
+        return vplaned.Controller(self.topology.store_endpoint,
+                                  self.topology.cfg_endpoint)
+
+    def test_store(self):
+        cmd = self.message(key="inner")
+        with self.controller() as ctrl:
+            ctrl.store("mac-limit profile p1 limit", cmd, "ALL", "SET",
+                       cmd_name="vyatta:maclimit")
+            ctrl.store("mac-limit profile p2 limit", cmd, "dp0s3", "DELETE",
+                       cmd_name="vyatta:maclimit")
+        envelopes = self.topology.controller.envelopes
+        self.assertEqual(envelopes["mac-limit profile p1 limit"],
+                         {"key": "mac-limit profile p1 limit",
+                          "action": "SET", "interface": "ALL",
+                          "type": "vyatta:maclimit",
+                          "msg": cmd.SerializeToString()})
+        self.assertEqual(envelopes["mac-limit profile p2 limit"]["action"],
+                         "DELETE")
+        self.assertEqual(envelopes["mac-limit profile p2 limit"]["interface"],
+                         "dp0s3")
+
+    def test_pb_command(self):
+        stats = vplaned.enable_command_stats()
+        with self.controller() as ctrl:
+            dp, = ctrl.get_dataplanes()
+            with dp:
+                reply = dp.pb_command("vyatta:echo", self.message(key="k1"),
+                                      self.message())
+                raw = dp.pb_command("vyatta:echo",
+                                    self.message(key="k2").SerializeToString())
+                empty = dp.pb_command("vyatta:other", b"x")
+        self.assertEqual(reply.key, "k1")
+        self.assertEqual(raw, self.message(key="k2").SerializeToString())
+        self.assertEqual(empty, b"")
+        self.assertEqual([t for t, _ in self.topology.dataplanes[0].pb_commands],
+                         ["vyatta:echo", "vyatta:echo", "vyatta:other"])
+        self.assertEqual(stats.stats()["vyatta:echo"]["count"], 2)
+
+
+class TestSocketPool(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+        def slow(cmd):
+            time.sleep(0.3)
+            return "slow"
+
+        self.dp = FakeDataplane(self._tmp.name,
+                                replies={"version": "4.2", "slow": slow})
+        self.dp.start()
+        self.fake = FakeController(self._tmp.name,
+                                   dataplanes=[self.dp.info()])
+        self.fake.start()
+        self.pool = vplaned.SocketPool()
+
+    def tearDown(self):
+        self.pool.clear()
+        self.fake.stop()
+        self.dp.stop()
+        self._tmp.cleanup()
+
+    def controller(self):
+        return vplaned.Controller(self.fake.store_endpoint,
+                                  self.fake.cfg_endpoint, pool=self.pool)
+
+    def test_reuse(self):
+        for _ in range(3):
+            with self.controller() as ctrl:
+                for _ in range(2):
+                    for dp in ctrl.get_dataplanes():
+                        with dp:
+                            self.assertEqual(dp.string_command("version"),
+                                             "4.2")
+        # store, config and dataplane sockets are only connected once
+        self.assertEqual(self.pool.stats(),
+                         {"hits": 9, "misses": 3, "resets": 0, "idle": 3})
+
+    def test_reset_after_timeout(self):
+        with self.controller() as ctrl:
+            dp, = ctrl.get_dataplanes()
+            ctrl._ctx.RCVTIMEO = 100
+            with dp:
+                with self.assertRaises(zmq.Again):
+                    dp.string_command("slow")
+            ctrl._ctx.RCVTIMEO = 5000
+            with dp:
+                self.assertEqual(dp.string_command("version"), "4.2")
+        self.assertEqual(self.pool.resets, 1)
+
+    def test_no_pool(self):
+        with vplaned.Controller(self.fake.store_endpoint,
+                                self.fake.cfg_endpoint, pool=None) as ctrl:
+            for dp in ctrl.get_dataplanes():
+                with dp:
+                    self.assertEqual(dp.string_command("version"), "4.2")
+        self.assertEqual(self.pool.misses, 0)
+
+
+class TestTopologyCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.fake = FakeController(self._tmp.name, dataplanes=[
+            {"id": 0, "control": "ipc:///dev/null",
+             "interfaces": [{"index": 6, "name": "dp0s3", "state": "up"}]}])
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        self._tmp.cleanup()
+
+    def get_dataplanes(self, cache):
+        with vplaned.Controller(self.fake.store_endpoint,
+                                self.fake.cfg_endpoint,
+                                topology_cache=cache) as ctrl:
+            return list(ctrl.get_dataplanes())
+
+    def test_ttl(self):
+        cache = vplaned.TopologyCache(ttl=60)
+        first = self.get_dataplanes(cache)
+        self.fake.dataplanes[0]["interfaces"][0]["state"] = "down"
+        self.assertIs(self.get_dataplanes(cache)[0], first[0])
+        self.assertEqual(self.fake.messages, 1)
+        self.assertEqual(first[0].interfaces["dp0s3"].state, "up")
+
+        cache.invalidate()
+        dps = self.get_dataplanes(cache)
+        self.assertEqual(dps[0].interfaces["dp0s3"].state, "down")
+        self.assertEqual(cache.stats(),
+                         {"hits": 1, "unchanged": 0, "refreshes": 2})
+
+    def test_unchanged_not_parsed(self):
+        cache = vplaned.TopologyCache(ttl=0)
+        first = self.get_dataplanes(cache)
+        self.assertIs(self.get_dataplanes(cache)[0], first[0])
+        self.assertEqual(self.fake.messages, 2)
+
+        self.fake.dataplanes.append({"id": 1, "control": "ipc:///dev/null"})
+        dps = self.get_dataplanes(cache)
+        self.assertEqual([dp.id for dp in dps], [0, 1])
+        self.assertEqual(cache.stats(),
+                         {"hits": 0, "unchanged": 1, "refreshes": 2})
+
+
+class TestStoreShadow(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, "store.shadow")
+        self.fake = FakeController(self._tmp.name,
+                                   reject=lambda path: path.endswith(" 13"))
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        self._tmp.cleanup()
+
+    def store(self, entries, batch=False):
+        """Store entries with a new shadow, as a script run would, and
+        return the shadow"""
+        shadow = vplaned.StoreShadow(self.path)
+        with vplaned.Controller(self.fake.store_endpoint,
+                                self.fake.cfg_endpoint,
+                                store_shadow=shadow) as ctrl:
+            with ctrl.batch() if batch else contextlib.nullcontext():
+                for path, cmd, action in entries:
+                    ctrl.store(path, cmd, "dp0s3", action)
+        return shadow
+
+    def test_skip_unchanged(self):
+        entries = [("storm-ctl dp0s3 {}".format(vlan), "profile p1", "SET")
+                   for vlan in range(4)]
+        self.assertEqual(self.store(entries).stats(),
+                         {"skipped": 0, "stored": 4})
+        entries[1] = ("storm-ctl dp0s3 1", "profile p2", "SET")
+        entries[2] = ("storm-ctl dp0s3 2", "profile p1", "DELETE")
+        self.assertEqual(self.store(entries, batch=True).stats(),
+                         {"skipped": 2, "stored": 2})
+        self.assertEqual(self.fake.messages, 5)
+        self.assertEqual(self.fake.stored["storm-ctl dp0s3 1"]["__SET__"],
+                         "profile p2")
+
+    def test_controller_restart(self):
+        entries = [("storm-ctl dp0s3", "profile p1", "SET")]
+        self.store(entries)
+        self.fake.stop()
+        time.sleep(0.01)
+        self.fake = FakeController(self._tmp.name)
+        self.fake.start()
+        self.assertEqual(self.store(entries).stats(),
+                         {"skipped": 0, "stored": 1})
+        self.assertEqual(self.store(entries).stats(),
+                         {"skipped": 1, "stored": 0})
+
+    def test_failures_forgotten(self):
+        entries = [("storm-ctl dp0s3 {}".format(vlan), "cmd", "SET")
+                   for vlan in (12, 13)]
+        with self.assertRaises(vplaned.BatchException):
+            self.store(entries, batch=True)
+        with self.assertRaises(vplaned.ControllerException):
+            self.store(entries)
+        # the merged message and its replay, then both entries again
+        self.assertEqual(self.fake.messages, 5)
+
+    def test_delete_forgets_paths_below(self):
+        self.store([("storm-ctl dp0s3 1", "cmd", "SET"),
+                    ("storm-ctl dp0s3", "cmd", "DELETE")])
+        shadow = self.store([("storm-ctl dp0s3 1", "cmd", "SET")])
+        self.assertEqual(shadow.stats(), {"skipped": 0, "stored": 1})
+
+
 @patch.object(zmq.Context, "instance", MockZmqContext)
 class TestDataplane(unittest.TestCase):
 
@@ -178,6 +664,37 @@ class TestDataplane(unittest.TestCase):
                     dps[0].json_command("command")
 
 
+class TestJsonIter(unittest.TestCase):
+
+    doc = {"skip": {"s": "a]}\"[{", "l": [{"k": "v\\\"]"}]},
+           "route_show": [{"vrf_id": 1, "table": 254},
+                          {"prefix": "10.0.0.0/8", "next_hop": []}],
+           "empty": [],
+           "scalar": 1.5}
+
+    def test_path(self):
+        for indent in (None, 2):
+            text = json.dumps(self.doc, indent=indent)
+            self.assertEqual(list(vplaned.json_iter(text, ["route_show"])),
+                             self.doc["route_show"])
+            self.assertEqual(list(vplaned.json_iter(text, ["*"])),
+                             self.doc["route_show"])
+            self.assertEqual(list(vplaned.json_iter(text, ["skip", "l"])),
+                             self.doc["skip"]["l"])
+            self.assertEqual(list(vplaned.json_iter(text, ["missing"])), [])
+
+    def test_top_level_array(self):
+        self.assertEqual(list(vplaned.json_iter(" [1, [2], {}] ")),
+                         [1, [2], {}])
+        self.assertEqual(list(vplaned.json_iter("[]")), [])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            list(vplaned.json_iter('{"a": [1 2]}', ["a"]))
+        with self.assertRaises(ValueError):
+            list(vplaned.json_iter('{"a": {"b": [}', ["c"]))
+
+
 @patch.object(zmq.Context, "instance", MockZmqContext)
 class TestInterface(unittest.TestCase):
 
@@ -221,6 +738,23 @@ class TestInterface(unittest.TestCase):
         with self.assertRaises(vplaned.InterfaceException):
             vplaned.Interface({"index": 6, "name": "not_a_real_name"})
         self.assertEqual(vplaned.Interface.get_dp_id("not_a_real_name"), None)
+        self.assertEqual(vplaned.Interface.get_dp_id("dp12xe1.100"), 12)
+
+    def test_lazy_interfaces(self):
+        dp = vplaned.Dataplane(None, {"id": 0, "interfaces": [
+            {"index": 6, "name": "dp0s3", "state": "up"},
+            {"index": 7, "name": "not_a_real_name", "state": "up"}]})
+        self.assertFalse(dp.interfaces._interfaces)
+        self.assertIn("dp0s3", dp.interfaces)
+        self.assertEqual(sorted(dp.interfaces), ["dp0s3", "not_a_real_name"])
+        intf = dp.interfaces["dp0s3"]
+        self.assertIs(dp.interfaces["dp0s3"], intf)
+        self.assertEqual(intf.index, 6)
+        self.assertFalse(hasattr(intf, "__dict__"))
+        with self.assertRaises(AttributeError):
+            intf.mtu
+        with self.assertRaises(vplaned.InterfaceException):
+            dp.interfaces["not_a_real_name"]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,46 @@
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import unittest
+from vplaned.xcvr import query_xcvr_cache
+
+
+class TestQueryXcvrCache(unittest.TestCase):
+
+    def serve(self, reply):
+        """Serve reply on a unix socket, return its path and the requests"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "xcvr.socket")
+        requests = []
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                requests.append(json.loads(self.rfile.read()))
+                self.wfile.write(reply)
+
+        server = socketserver.UnixStreamServer(path, Handler)
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        return path, requests
+
+    def test_query(self):
+        status = {"xcvr-status": [{"name": "dp0xe1"}]}
+        path, requests = self.serve(json.dumps(status).encode())
+        self.assertEqual(query_xcvr_cache({"name": "dp0xe1"}, path), status)
+        self.assertEqual(query_xcvr_cache(path=path), status)
+        self.assertEqual(requests, [{"name": "dp0xe1"}, {}])
+
+    def test_not_running(self):
+        path, _ = self.serve(b"")
+        self.assertIsNone(query_xcvr_cache(path=path))
+        self.assertIsNone(query_xcvr_cache(path=path + ".missing"))
+
+
+if __name__ == '__main__':
+    unittest.main()
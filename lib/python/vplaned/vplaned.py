@@ -10,9 +10,10 @@ The Controller can be used to store config command to the dataplane(s), or to
 generate a Dataplane object for each connected dataplane(s) (local/remote).
 The Dataplane object will have all the information returned by the Controller
 as attributes. EG: dataplane.local, dataplane.control, etc.
-The "interfaces" attribute is a dictionary keyed on interface name associated
+The "interfaces" attribute is a mapping keyed on interface name associated
 with a corresponding Interface object, which similarly holds state in
-attributes like index, state, name, etc.
+attributes like index, state, name, etc. Interface objects are only created
+when looked up.
 Generate is intended in the Python sense, so the Dataplane class should not be
 instantiated manually. Instead the Controller.get_dataplanes() generator should
 be used. Examples:
@@ -26,27 +27,199 @@ with Controller() as controller:
         with dp:
             dp.json_command("netflow show")
 
+with Controller() as controller:
+    for dp, reply in controller.broadcast_iter("route show", string=True):
+        for route in json_iter(reply, ["*"]):
+            print(route)
+
+with Controller() as controller:
+    for dp_id, reply in controller.broadcast("netflow show").items():
+        if isinstance(reply, DataplaneException):
+            print("dataplane {} failed: {}".format(dp_id, reply))
+
 with Controller(store_endpoint="tcp://1.2.3.4:5678") as controller:
     controller.store("interface dataplane netflow dp1s12",
                      "netflow disable dp1s12")
 
+Many store() calls can be grouped in a batch. The entries are merged into as
+few messages as possible and pipelined to the controller when the "with" block
+exits; a BatchException lists every entry that was rejected:
+
+with Controller() as controller:
+    with controller.batch():
+        for vlan in vlans:
+            controller.store("storm-ctl dp0s3 {}".format(vlan),
+                             "storm-ctl SET dp0s3 vlan {} profile p1".format(vlan),
+                             "dp0s3", "SET")
+
 Note that the store function now supports two messaging modes: the old space
 delimited text command (as shown above). And the 'new' messaging mode using
 protocol buffers. The protocol buffers use of the store() function requires an
 additional argument: cmd_name.
 
+Protobuf op commands are sent to a dataplane with pb_command(), in raw frames:
+
+with Controller() as controller:
+    for dp in controller.get_dataplanes():
+        with dp:
+            status = dp.pb_command("vyatta:sfpmonitor", request,
+                                   SFPMonitor_pb2.SfpMonitorStatus())
+
 In case of errors with the controller or dataplane runtime commands,
 ControllerException or DataplaneException will be raised respectively.
 In case of connectivity errors, ZMQError will be raised.
 
 Note that thanks to Python's ContextManager pattern, no cleanup/disconnect is
 required. The "with" statement will take care of everything automagically.
+
+Sockets are not closed when a "with" block exits, but handed back to
+socket_pool and reused by the next Controller or Dataplane talking to the
+same endpoint. socket_pool.stats() reports its hit, miss and reset counters;
+pass pool=None to Controller to connect fresh sockets every time.
+
+Callers polling get_dataplanes() can pass a TopologyCache to Controller, so
+that the topology is only fetched once per TTL, and only parsed when it has
+changed.
+
+Config scripts which store their whole state on every commit can pass a
+StoreShadow to Controller, so that commands identical to the last one stored
+at their path are skipped rather than sent to the controller, which would
+program the dataplanes again:
+
+with Controller(store_shadow=StoreShadow()) as controller:
+    controller.store("storm-ctl dp0s3", "storm-ctl SET dp0s3 profile p1")
+
+Events pushed by the dataplanes, such as interface state changes, are
+received through a subscription rather than by polling json_command(); see
+vplaned.events:
+
+with Controller() as controller:
+    with controller.subscribe(["link"], snapshot=True) as events:
+        for event in events:
+            print(event.topic, event.json())
+
+An asyncio flavour of this API, which can keep many commands in flight at
+once, is available in the vplaned.aio module.
+
+Statistics of the requests sent by the blocking API can be recorded by
+calling enable_command_stats(), or for a whole script by setting the
+VPLANED_STATS environment variable to the file they are written to when the
+script exits, as Prometheus text if its name ends in ".prom", else as JSON:
+
+stats = enable_command_stats()
+with Controller() as controller:
+    controller.broadcast("ifconfig")
+print(stats.prometheus())
 """
 import sys
 import os
 import re
+import atexit
+import base64
+import bisect
+import collections.abc
+import contextlib
+import fcntl
+import functools
+import hashlib
+import itertools
+import json
+import threading
+import time
 import zmq
 
+from vplaned.events import EVENTS_ENDPOINT, SNAPSHOT_ENDPOINT, Subscription
+
+# Control socket of the local dataplane, for controllers that do not report it
+_LOCAL_CONTROL = "ipc:///var/run/vplane.socket"
+
+# Receive timeout in milliseconds, so this is 10 sec
+_TIMEOUT = 10000
+
+# Default file of StoreShadow, next to the controller sockets
+_STORE_SHADOW = "/var/run/vyatta/vplaned-store.shadow"
+
+_DP_ID_RE = re.compile(r"^[a-z]+(\d+)")
+
+# Tokens for json_iter(), which walks json text without decoding it all
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WS = re.compile(r"[ \t\n\r]*")
+_JSON_BRACKET = re.compile(r'["\[\]{}]')
+_JSON_STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+def json_iter(text, path=()):
+    """Iterate over the elements of the arrays found at path in a json
+    document, decoding them one at a time rather than building the whole
+    document. path is a sequence of object keys, where "*" matches any key;
+    values not matching it are skipped without being decoded. EG:
+    json_iter('{"a": [1, 2], "b": {"c": [3]}}', ["*"]) yields 1 and 2.
+    """
+    yield from _json_iter(text, _JSON_WS.match(text).end(), tuple(path))
+
+
+def _json_skip(text, idx):
+    """Return the index past the json value starting at idx"""
+    if text[idx] not in "[{":
+        return _JSON_DECODER.raw_decode(text, idx)[1]
+
+    depth = 0
+    while True:
+        m = _JSON_BRACKET.search(text, idx)
+        if m is None:
+            raise ValueError("Unterminated json value")
+        idx = m.end()
+        if m.group() == '"':
+            idx = _JSON_STRING_END.match(text, idx).end()
+        elif m.group() in "[{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return idx
+
+
+def _json_expect(text, idx, token):
+    if text[idx:idx + 1] != token:
+        raise ValueError("Expecting '{}' at char {}".format(token, idx))
+    return _JSON_WS.match(text, idx + 1).end()
+
+
+def _json_iter(text, idx, path):
+    """Generator behind json_iter(), for the value at idx. Returns the index
+    past that value."""
+    if not path:
+        if text[idx] != "[":
+            return _json_skip(text, idx)
+        idx = _JSON_WS.match(text, idx + 1).end()
+        if text[idx] == "]":
+            return idx + 1
+        while True:
+            value, idx = _JSON_DECODER.raw_decode(text, idx)
+            yield value
+            idx = _JSON_WS.match(text, idx).end()
+            if text[idx] == "]":
+                return idx + 1
+            idx = _json_expect(text, idx, ",")
+
+    if text[idx] != "{":
+        return _json_skip(text, idx)
+    idx = _JSON_WS.match(text, idx + 1).end()
+    if text[idx] == "}":
+        return idx + 1
+    while True:
+        key, idx = _JSON_DECODER.raw_decode(text, idx)
+        idx = _json_expect(text, _JSON_WS.match(text, idx).end(), ":")
+        if path[0] == "*" or path[0] == key:
+            idx = yield from _json_iter(text, idx, path[1:])
+        else:
+            idx = _json_skip(text, idx)
+        idx = _JSON_WS.match(text, idx).end()
+        if text[idx] == "}":
+            return idx + 1
+        idx = _json_expect(text, idx, ",")
+
+
 class InterfaceException(Exception):
     pass
 
@@ -59,27 +232,407 @@ class ControllerException(Exception):
     pass
 
 
+class BatchException(ControllerException):
+
+    """Raised when a Controller.batch() is flushed and some of its entries
+    were rejected. The "failures" attribute is a list of (path, cmd, rc)
+    tuples, in the order the entries were stored."""
+
+    def __init__(self, failures):
+        super().__init__("{} batched config entries failed: {}".format(
+            len(failures), ", ".join(path for path, _, _ in failures)))
+        self.failures = failures
+
+
+class SocketPool:
+
+    """Pool of connected REQ sockets, keyed by ZMQ context and endpoint.
+    Sockets handed back through release() are reused by the next acquire()
+    for the same endpoint, which saves the connection setup of each "with"
+    block. A socket that cannot send, because its last request timed out or
+    was abandoned midway, or it never got connected, is closed instead of
+    pooled: this resets the REQ state machine. The hits, misses and resets
+    counters are reported by stats().
+
+    Controller, and the Dataplane objects it generates, use the module's
+    socket_pool by default."""
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.hits = 0
+        self.misses = 0
+        self.resets = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _healthy(sock):
+        return not sock.closed and sock.getsockopt(zmq.EVENTS) & zmq.POLLOUT
+
+    def acquire(self, ctx, endpoint):
+        """Return a REQ socket connected to endpoint"""
+        with self._lock:
+            idle = self._idle.get((ctx, endpoint), [])
+            while idle:
+                sock = idle.pop()
+                if self._healthy(sock):
+                    self.hits += 1
+                    return sock
+                self.resets += 1
+                sock.close()
+            self.misses += 1
+
+        sock = ctx.socket(zmq.REQ)
+        sock.connect(endpoint)
+        return sock
+
+    def release(self, ctx, endpoint, sock):
+        """Hand a socket back to the pool once done with it"""
+        with self._lock:
+            if not self._healthy(sock):
+                self.resets += 1
+            else:
+                idle = self._idle.setdefault((ctx, endpoint), [])
+                if len(idle) < self.max_idle:
+                    idle.append(sock)
+                    return
+        sock.close()
+
+    def discard(self, sock):
+        """Close a socket which is known to be unusable"""
+        with self._lock:
+            self.resets += 1
+        sock.close()
+
+    def clear(self):
+        """Close all the idle sockets"""
+        with self._lock:
+            for idle in self._idle.values():
+                for sock in idle:
+                    sock.close()
+            self._idle.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "resets": self.resets,
+                    "idle": sum(len(idle) for idle in self._idle.values())}
+
+
+socket_pool = SocketPool()
+
+
+class CommandStats:
+
+    """Latency, size and failure statistics of the requests sent by the
+    client, keyed by command name: the first word of dataplane commands,
+    "store" for store messages, and the first frame of config requests
+    (e.g. GETVPCONFIG). The time taken by each request is recorded in three
+    histograms: "send", to hand the request over to ZMQ, "wait", until the
+    reply status arrives, and "decode", to receive and decode the reply
+    body. Requests answered with an error, or not at all within the receive
+    timeout, are counted as errors and timeouts.
+
+    callback, if given, is called with the command name and a dict of the
+    send, wait and decode times (in seconds), the request and reply sizes
+    (in bytes) and error and timeout flags of every request.
+
+    Use enable_command_stats() to record the statistics of all requests."""
+
+    # Histogram bucket upper bounds, in seconds
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+               0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PHASES = ("send", "wait", "decode")
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def _command(self, name):
+        command = self._commands.get(name)
+        if command is None:
+            command = self._commands[name] = {
+                "count": 0, "errors": 0, "timeouts": 0,
+                "request_bytes": 0, "response_bytes": 0}
+            for phase in self.PHASES:
+                command[phase] = {"count": 0, "sum": 0.0,
+                                  "buckets": [0] * (len(self.BUCKETS) + 1)}
+        return command
+
+    def record(self, name, send=None, wait=None, decode=None, sent=0,
+               received=0, error=False, timeout=False):
+        """Record a request. Phases it did not go through are None."""
+        with self._lock:
+            command = self._command(name)
+            command["count"] += 1
+            command["errors"] += error
+            command["timeouts"] += timeout
+            command["request_bytes"] += sent
+            command["response_bytes"] += received
+            for phase, elapsed in zip(self.PHASES, (send, wait, decode)):
+                if elapsed is None:
+                    continue
+                histogram = command[phase]
+                histogram["count"] += 1
+                histogram["sum"] += elapsed
+                histogram["buckets"][bisect.bisect_left(self.BUCKETS,
+                                                        elapsed)] += 1
+        if self.callback is not None:
+            self.callback(name, {"send": send, "wait": wait,
+                                 "decode": decode, "sent": sent,
+                                 "received": received, "error": error,
+                                 "timeout": timeout})
+
+    def reset(self):
+        with self._lock:
+            self._commands.clear()
+
+    def stats(self):
+        """The statistics of each command, as a dict keyed by command name.
+        The histogram buckets are cumulative counts, one per bound of
+        BUCKETS followed by the total."""
+        result = {}
+        with self._lock:
+            for name, command in self._commands.items():
+                result[name] = dict(command)
+                for phase in self.PHASES:
+                    histogram = command[phase]
+                    result[name][phase] = {
+                        "count": histogram["count"], "sum": histogram["sum"],
+                        "buckets": list(
+                            itertools.accumulate(histogram["buckets"]))}
+        return result
+
+    def json(self):
+        return json.dumps({"buckets": self.BUCKETS, "commands": self.stats()},
+                          sort_keys=True)
+
+    def prometheus(self):
+        """The statistics in the Prometheus text exposition format"""
+        def label(value):
+            return value.replace("\\", "\\\\").replace('"', '\\"') \
+                .replace("\n", "\\n")
+
+        stats = self.stats()
+        lines = ["# HELP vplaned_command_seconds Time spent in each phase of "
+                 "the requests to vplaned and the dataplanes",
+                 "# TYPE vplaned_command_seconds histogram"]
+        for name, command in sorted(stats.items()):
+            for phase in self.PHASES:
+                labels = 'command="{}",phase="{}"'.format(label(name), phase)
+                histogram = command[phase]
+                bounds = ["{:g}".format(b) for b in self.BUCKETS] + ["+Inf"]
+                for bound, count in zip(bounds, histogram["buckets"]):
+                    lines.append('vplaned_command_seconds_bucket{{{},le="{}"}} '
+                                 '{}'.format(labels, bound, count))
+                lines.append("vplaned_command_seconds_sum{{{}}} {!r}".format(
+                    labels, histogram["sum"]))
+                lines.append("vplaned_command_seconds_count{{{}}} {}".format(
+                    labels, histogram["count"]))
+        for key, metric, help_text in (
+                ("count", "requests", "Requests sent"),
+                ("errors", "errors", "Requests answered with an error"),
+                ("timeouts", "timeouts", "Requests not answered in time"),
+                ("request_bytes", "request_bytes", "Bytes sent"),
+                ("response_bytes", "response_bytes", "Bytes received")):
+            lines.append("# HELP vplaned_command_{}_total {}".format(
+                metric, help_text))
+            lines.append("# TYPE vplaned_command_{}_total counter".format(
+                metric))
+            for name, command in sorted(stats.items()):
+                lines.append('vplaned_command_{}_total{{command="{}"}} '
+                             '{}'.format(metric, label(name), command[key]))
+        return "\n".join(lines) + "\n"
+
+
+# CommandStats recording the requests, if enabled
+command_stats = None
+
+
+def enable_command_stats(callback=None):
+    """Record the statistics of every request from now on in a new
+    CommandStats, which is returned"""
+    global command_stats
+    command_stats = CommandStats(callback)
+    return command_stats
+
+
+def disable_command_stats():
+    global command_stats
+    command_stats = None
+
+
+def _write_command_stats(path):
+    stats = command_stats
+    if stats is None:
+        return
+    text = stats.prometheus() if path.endswith(".prom") else stats.json()
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.rename(tmp, path)
+
+
+def _command_stats_from_environment():
+    if os.getenv("VPLANED_STATS"):
+        enable_command_stats()
+        atexit.register(_write_command_stats, os.environ["VPLANED_STATS"])
+
+
+_command_stats_from_environment()
+
+
+def _command_name(cmd):
+    """Name the statistics of a command are recorded under"""
+    if isinstance(cmd, bytes):
+        cmd = cmd.decode(errors="replace")
+    return cmd.split(" ", 1)[0]
+
+
+def _timed_request(stats, sock, name, frames, decode=None, status=True):
+    """Send the request frames on a REQ socket and receive the reply status
+    and, if it is OK and decode is given, the reply body, which is returned
+    decoded with it. Replies without a status frame (status=False) are a
+    single body frame. The request is recorded in stats."""
+    sent = sum(len(frame) for frame in frames)
+    start = time.perf_counter()
+    try:
+        sock.send_multipart(frames)
+        sent_at = time.perf_counter()
+        if status:
+            rc = sock.recv_string()
+            received = len(rc)
+        else:
+            rc, raw = "OK", sock.recv()
+            received = len(raw)
+        status_at = time.perf_counter()
+        reply = None
+        if rc == "OK" and decode is not None:
+            if status:
+                raw = sock.recv()
+                received += len(raw)
+            reply = decode(raw)
+    except zmq.Again:
+        stats.record(name, sent=sent, timeout=True)
+        raise
+    stats.record(name, sent_at - start, status_at - sent_at,
+                 time.perf_counter() - status_at, sent, received,
+                 error=rc != "OK")
+    return rc, reply
+
+
+@functools.lru_cache(maxsize=None)
+def _protobuf():
+    """The envelope classes and the decoding error of protocol buffers,
+    imported once, on first use"""
+    from google.protobuf.message import DecodeError
+    from vyatta.proto.DataplaneEnvelope_pb2 import DataplaneEnvelope
+    from vyatta.proto.VPlanedEnvelope_pb2 import VPlanedEnvelope
+    return DataplaneEnvelope, VPlanedEnvelope, DecodeError
+
+
+def _serialize(msg):
+    return msg if isinstance(msg, bytes) else msg.SerializeToString()
+
+
+def _dataplane_envelope(msg_type, msg):
+    """Serialized DataplaneEnvelope of a protobuf message, or of its
+    serialization"""
+    dataplane_envelope, _, _ = _protobuf()
+    return dataplane_envelope(type=msg_type,
+                              msg=_serialize(msg)).SerializeToString()
+
+
+def _open_envelope(data, reply=None):
+    """The message of a serialized DataplaneEnvelope reply, parsed into the
+    reply message if given, else serialized"""
+    dataplane_envelope, _, decode_error = _protobuf()
+    envelope = dataplane_envelope()
+    try:
+        envelope.ParseFromString(data)
+        if reply is None:
+            return envelope.msg
+        reply.ParseFromString(envelope.msg)
+    except decode_error as e:
+        raise DataplaneException("Invalid protobuf reply: {}".format(e))
+    return reply
+
+
 class Interface:
 
     """Interface object. This will be automatically generated and added to a
-    Dataplane object's "interfaces" attribute dictionary, keyed by the name."""
+    Dataplane object's "interfaces" attribute mapping, keyed by the name.
+    The attributes are looked up in the json object the interface was built
+    from, which is kept as is rather than copied."""
+
+    __slots__ = ("_json", "dp_id")
 
     def __init__(self, json):
-        for key, value in json.items():
-            setattr(self, key, value)
+        self._json = json
 
-        self.dp_id = Interface.get_dp_id(self.name)
+        self.dp_id = _get_dp_id(self.name)
         if self.dp_id is None:
             raise InterfaceException("Invalid name: {}".format(self.name))
 
+    def __getattr__(self, key):
+        if key == "_json":
+            raise AttributeError(key)
+        try:
+            return self._json[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
     @classmethod
     def get_dp_id(cls, interface_name):
         """Parse an interface name and return the dataplane ID as an integer"""
-        m = re.match("^[a-z]+(\d+)", interface_name)
-        if m is None:
-            return None
+        return _get_dp_id(interface_name)
 
-        return int(m.group(1))
+
+@functools.lru_cache(maxsize=65536)
+def _get_dp_id(interface_name):
+    m = _DP_ID_RE.match(interface_name)
+    if m is None:
+        return None
+
+    return int(m.group(1))
+
+
+class InterfaceMap(collections.abc.Mapping):
+
+    """Read-only mapping of interface names to Interface objects, built from
+    the controller's array of interface json objects. The name index is only
+    built on first use, and each Interface object is only created when it is
+    looked up, then kept. An interface with an invalid name therefore raises
+    InterfaceException when it is accessed."""
+
+    __slots__ = ("_entries", "_index", "_interfaces")
+
+    def __init__(self, entries):
+        self._entries = entries
+        self._index = None
+        self._interfaces = {}
+
+    def _names(self):
+        if self._index is None:
+            self._index = {intf["name"]: intf for intf in self._entries}
+        return self._index
+
+    def __getitem__(self, name):
+        intf = self._interfaces.get(name)
+        if intf is None:
+            intf = Interface(self._names()[name])
+            self._interfaces[name] = intf
+        return intf
+
+    def __contains__(self, name):
+        return name in self._names()
+
+    def __iter__(self):
+        return iter(self._names())
+
+    def __len__(self):
+        return len(self._names())
 
 
 class Dataplane:
@@ -88,39 +641,58 @@ class Dataplane:
     object manually. Instead, use the Controller.get_dataplanes() generator.
     All the information that vplane-controller has about a dataplane will be
     stored in this object as attributes. EG: dp.local, dp.control, etc.
-    The "interfaces" attribute will be a dictionary with interface names as key
-    and Interface objects as values.
+    The "interfaces" attribute will be a mapping with interface names as key
+    and Interface objects as values, which are only created when looked up.
 
     Implements ContextManager pattern, so use through "with" statement."""
 
-    def __init__(self, ctx, json):
+    def __init__(self, ctx, json, pool=None):
         self._ctx = ctx
         self._socket = None
-        self.interfaces = {}
+        self._pool = pool
+        self.interfaces = InterfaceMap(())
         for key, value in json.items():
             # The interfaces json object is treated differently by the
             # controller, it returns as an array of flat json objects so we
             # need this bit of magic string matching to make it work
             if key == "interfaces":
-                for intf in value:
-                    self.interfaces[intf["name"]] = Interface(intf)
+                self.interfaces = InterfaceMap(value)
             else:
                 setattr(self, key, value)
 
-    def __enter__(self):
-        self._socket = self._ctx.socket(zmq.REQ)
+    def _endpoint(self):
         # Dataplane/Controller in 2.0.0 do not return "control"
-        if hasattr(self, "control"):
-            self._socket.connect(self.control)
+        return getattr(self, "control", _LOCAL_CONTROL)
+
+    def __enter__(self):
+        if self._pool is not None:
+            self._socket = self._pool.acquire(self._ctx, self._endpoint())
         else:
-            self._socket.connect("ipc:///var/run/vplane.socket")
+            self._socket = self._ctx.socket(zmq.REQ)
+            self._socket.connect(self._endpoint())
         return self
 
     def __exit__(self, *exc):
-        self._socket.close()
+        if self._pool is not None:
+            self._pool.release(self._ctx, self._endpoint(), self._socket)
+        else:
+            self._socket.close()
+
+    def _timed_command(self, string, decode):
+        rc, reply = _timed_request(command_stats, self._socket,
+                                   _command_name(string), [string.encode()],
+                                   decode)
+        if rc != "OK":
+            raise DataplaneException("Command {} returned {}".format(string,
+                                                                     rc))
+
+        return reply
 
     def string_command(self, string):
         """send a command and return the dataplane response as a string"""
+        if command_stats is not None:
+            return self._timed_command(string, bytes.decode)
+
         self._socket.send_string(string)
         rc = self._socket.recv_string()
         if rc != "OK":
@@ -131,6 +703,9 @@ class Dataplane:
 
     def json_command(self, string):
         """send a command and return the dataplane response as a json object"""
+        if command_stats is not None:
+            return self._timed_command(string, json.loads)
+
         self._socket.send_string(string)
         rc = self._socket.recv_string()
         if rc != "OK":
@@ -139,6 +714,365 @@ class Dataplane:
 
         return self._socket.recv_json()
 
+    def pb_command(self, msg_type, msg, reply=None):
+        """send a protobuf command, as raw "protobuf" and DataplaneEnvelope
+        frames: msg, a protobuf message or its serialization, is sent in an
+        envelope of type msg_type. Return the message of the dataplane's
+        reply envelope, parsed into the reply message if given, else
+        serialized."""
+        request = [b"protobuf", _dataplane_envelope(msg_type, msg)]
+        if command_stats is not None:
+            _, result = _timed_request(
+                command_stats, self._socket, msg_type, request,
+                functools.partial(_open_envelope, reply=reply), status=False)
+            return result
+
+        self._socket.send_multipart(request)
+        return _open_envelope(self._socket.recv(), reply)
+
+
+class TopologyCache:
+
+    """Opt-in cache of the dataplanes returned by GETVPCONFIG, for callers
+    that call Controller.get_dataplanes() in a loop. Pass it to Controller
+    as topology_cache.
+    Within ttl seconds of the last fetch the cached Dataplane objects are
+    returned without asking the controller. After that the topology is
+    fetched again, but only parsed if the reply differs from the cached one.
+    invalidate() forces the next call to fetch and parse."""
+
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.unchanged = 0
+        self.refreshes = 0
+        self._key = None
+        self._raw = None
+        self._dataplanes = None
+        self._expires = 0
+
+    def invalidate(self):
+        self._key = None
+        self._raw = None
+        self._dataplanes = None
+
+    def dataplanes(self, controller):
+        """Return the list of Dataplane objects for the controller"""
+        key = (controller._ctx, controller._cfg_endpoint)
+        now = time.monotonic()
+        if key == self._key and now < self._expires:
+            self.hits += 1
+            return self._dataplanes
+
+        raw = controller._get_vpconfig(raw=True)
+        self._expires = now + self.ttl
+        if key == self._key and raw == self._raw:
+            self.unchanged += 1
+            return self._dataplanes
+
+        config = json.loads(raw)
+        if config is None:
+            raise ControllerException("GETVPCONFIG returned empty response")
+
+        self._dataplanes = [Dataplane(controller._ctx, dp, controller._pool)
+                            for dp in config["dataplanes"]]
+        self._key = key
+        self._raw = raw
+        self.refreshes += 1
+        return self._dataplanes
+
+    def stats(self):
+        return {"hits": self.hits, "unchanged": self.unchanged,
+                "refreshes": self.refreshes}
+
+
+def _socket_generation(controller):
+    """Generation of the controller: the identity of its ipc store socket,
+    which it binds anew each time it starts. None for other endpoints."""
+    endpoint = controller._store_endpoint
+    if not endpoint.startswith("ipc://"):
+        return None
+    try:
+        st = os.stat(endpoint[len("ipc://"):])
+    except OSError:
+        return None
+    return [endpoint, st.st_ino, st.st_mtime_ns]
+
+
+class StoreShadow:
+
+    """Opt-in shadow of the last command stored at each path, for config
+    scripts that store their whole state on every commit. Pass it to
+    Controller as store_shadow.
+    store() skips a command identical to the last one stored at its path,
+    interface and action included, and counts it as skipped. A digest of
+    every leaf stored is kept in the file at path when the Controller exits,
+    so the shadow lasts across script runs; the file is locked while it is
+    updated, and only the paths stored by this shadow are written to it.
+    The shadow is only trusted under the controller generation it was
+    recorded in: generation(controller) returns it, by default the identity
+    of the ipc store socket, which changes when the controller restarts.
+    When it returns None nothing is skipped. Paths whose last store failed,
+    or was part of a failed batch, are forgotten, as are the paths below a
+    deleted one. invalidate() forgets every path."""
+
+    def __init__(self, path=_STORE_SHADOW, generation=_socket_generation):
+        self.path = path
+        self.skipped = 0
+        self.stored = 0
+        self._generation = generation
+        # path -> leaf digest, read from the file on first use
+        self._digests = None
+        self._current = None
+        # path -> digest, or None to remove it, not saved yet
+        self._dirty = {}
+
+    @staticmethod
+    def _digest(leaf):
+        return hashlib.blake2b(json.dumps(leaf, sort_keys=True).encode(),
+                               digest_size=16).hexdigest()
+
+    def _read(self):
+        """Entries of the file if recorded under the current generation"""
+        try:
+            with open(self.path) as f:
+                shadow = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if shadow.get("generation") != self._current:
+            return {}
+        return shadow.get("entries", {})
+
+    def _load(self, controller):
+        if self._digests is None:
+            self._current = self._generation(controller)
+            self._digests = {} if self._current is None else self._read()
+
+    def unchanged(self, controller, path, leaf):
+        """Whether leaf is what was last stored at path, counted as skipped
+        if so"""
+        self._load(controller)
+        if self._current is None:
+            return False
+        if self._digests.get(path) != self._digest(leaf):
+            return False
+        self.skipped += 1
+        return True
+
+    def record(self, path, leaf):
+        """Note leaf as stored at path"""
+        if self._current is None:
+            return
+        if "__DELETE__" in leaf:
+            below = path + " "
+            self.forget([p for p in self._digests if p.startswith(below)])
+        digest = self._digest(leaf)
+        self._digests[path] = digest
+        self._dirty[path] = digest
+        self.stored += 1
+
+    def forget(self, paths):
+        if self._digests is None:
+            return
+        for path in paths:
+            self._digests.pop(path, None)
+            self._dirty[path] = None
+
+    def invalidate(self):
+        """Forget every path, in the file too"""
+        self._digests = {}
+        self._dirty = {}
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        """Merge the paths stored since the last save into the file. If it
+        cannot be written, it is removed, so that it is not trusted."""
+        if not self._dirty:
+            return
+        try:
+            with open(self.path + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                entries = self._read()
+                for path, digest in self._dirty.items():
+                    if digest is None:
+                        entries.pop(path, None)
+                    else:
+                        entries[path] = digest
+                tmp = "{}.{}".format(self.path, os.getpid())
+                with open(tmp, "w") as f:
+                    json.dump({"generation": self._current,
+                               "entries": entries}, f)
+                os.replace(tmp, self.path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.unlink(self.path)
+        self._dirty = {}
+
+    def stats(self):
+        return {"skipped": self.skipped, "stored": self.stored}
+
+
+def _store_leaf(path, cmd, interface, action, cmd_name):
+    """Build the bottom object of a store message: the command, keyed by the
+    commit action, and its attributes. The action defaults to COMMIT_ACTION,
+    read on each store rather than once, as the process may be forked from
+    one which imported this module outside of a commit."""
+    if action is None:
+        action = os.getenv("COMMIT_ACTION")
+    if action is None:
+        raise ControllerException(
+            "COMMIT_ACTION not found. Not in commit mode?")
+
+    # The dataplane expect the path to be passed as nested JSON objects,
+    # with the actual command as a value in the bottom object.
+    leaf = {'__INTERFACE__': interface}
+
+    # cmd_name if defined is used to send a protocol buffers form
+    # of the command: a DataplaneEnvelope wrapped in a VPlanedEnvelope,
+    # encoded in base64.
+    if cmd_name is not None:
+        _, vplaned_envelope, _ = _protobuf()
+        ve = vplaned_envelope(
+            key=path, interface=interface,
+            action=(vplaned_envelope.SET if action == "SET" else
+                    vplaned_envelope.DELETE),
+            msg=_dataplane_envelope(cmd_name, cmd))
+        cmd = 'protobuf ' + base64.b64encode(ve.SerializeToString()).decode()
+        leaf["__PROTOBUF__"] = True
+
+    leaf["__" + action + "__"] = cmd
+
+    return leaf
+
+
+def _to_tree(entries):
+    """Build the nested JSON store message for a list of (path, cmd, leaf)"""
+    # Create a dictionary, and use a reference to work on it recursively.
+    msg = {}
+    for path, _, leaf in entries:
+        temp = msg
+        for item in path.split(" "):
+            temp = temp.setdefault(item, {})
+        temp.update(leaf)
+    return msg
+
+
+class _StoreBatch:
+
+    """Accumulates Controller.store() entries and sends them as merged,
+    pipelined messages. Created through Controller.batch()."""
+
+    def __init__(self, controller, max_entries, window):
+        self._controller = controller
+        self._max_entries = max(1, max_entries)
+        self._window = max(1, window)
+        self.entries = []
+        self.failures = []
+        self.messages = 0
+
+    def add(self, path, cmd, leaf):
+        self.entries.append((path, cmd, leaf))
+
+    def _merge(self):
+        """Group the entries into messages. An entry can only share a message
+        with entries whose path is neither equal to, nor a prefix of its own,
+        otherwise the two would collide in the JSON tree; such an entry starts
+        a new message, which also preserves ordering for repeated paths."""
+        groups = []
+        entries, leaves, prefixes = [], set(), set()
+        for entry in self.entries:
+            items = tuple(entry[0].split(" "))
+            heads = [items[:i] for i in range(1, len(items))]
+            if (len(entries) >= self._max_entries or items in prefixes or
+                    items in leaves or any(h in leaves for h in heads)):
+                groups.append(entries)
+                entries, leaves, prefixes = [], set(), set()
+            entries.append(entry)
+            leaves.add(items)
+            prefixes.update(heads)
+        if entries:
+            groups.append(entries)
+        return groups
+
+    def _pipeline(self, groups):
+        """Send the messages on a DEALER socket, keeping up to window requests
+        in flight, and return the controller's reply to each of them"""
+        stats = command_stats
+        sock = self._controller._ctx.socket(zmq.DEALER)
+        sock.connect(self._controller._store_endpoint)
+        replies = []
+        # (send start, sent, size) of the messages in flight, for stats
+        in_flight = collections.deque()
+        try:
+            sent = 0
+            while len(replies) < len(groups):
+                while sent < len(groups) and sent - len(replies) < self._window:
+                    msg = json.dumps(_to_tree(groups[sent])).encode()
+                    start = time.perf_counter()
+                    # Empty delimiter frame, as a REQ socket would send
+                    sock.send(b"", zmq.SNDMORE)
+                    sock.send(msg)
+                    if stats is not None:
+                        in_flight.append((start, time.perf_counter(),
+                                          len(msg)))
+                    sent += 1
+                frames = sock.recv_multipart()
+                replies.append(frames[-1].decode())
+                if stats is not None:
+                    # The controller answers in order
+                    start, sent_at, size = in_flight.popleft()
+                    received = time.perf_counter()
+                    stats.record("store", sent_at - start, received - sent_at,
+                                 0.0, size, len(frames[-1]),
+                                 error=replies[-1] != "OK")
+        finally:
+            sock.close()
+        return replies
+
+    def flush(self):
+        groups = self._merge()
+        self.messages = len(groups)
+        if not groups:
+            return
+
+        replies = self._pipeline(groups)
+
+        # Paths stored again by a later message must not be replayed, or the
+        # replay would undo the later state.
+        last = {}
+        for i, entries in enumerate(groups):
+            for entry in entries:
+                last[entry[0]] = i
+
+        for i, (entries, rc) in enumerate(zip(groups, replies)):
+            if rc == "OK":
+                continue
+            if len(entries) == 1:
+                self.failures.append((entries[0][0], entries[0][1], rc))
+                continue
+            # The controller answers once per message: replay the entries one
+            # by one to find out which of them were rejected.
+            for entry in entries:
+                if last[entry[0]] != i:
+                    self.failures.append((entry[0], entry[1], rc))
+                    continue
+                sock = self._controller._store_socket
+                if command_stats is not None:
+                    entry_rc, _ = _timed_request(
+                        command_stats, sock, "store",
+                        [json.dumps(_to_tree([entry])).encode()])
+                else:
+                    sock.send_json(_to_tree([entry]))
+                    entry_rc = sock.recv_string()
+                if entry_rc != "OK":
+                    self.failures.append((entry[0], entry[1], entry_rc))
+
+        if self.failures:
+            raise BatchException(self.failures)
+
 
 class Controller:
 
@@ -148,107 +1082,250 @@ class Controller:
     """
 
     def __init__(self, store_endpoint="ipc:///var/run/vyatta/vplaned.socket",
-                 cfg_endpoint="ipc:///var/run/vyatta/vplaned-config.socket"):
+                 cfg_endpoint="ipc:///var/run/vyatta/vplaned-config.socket",
+                 pool=socket_pool, topology_cache=None, store_shadow=None):
         self._ctx = None
         self._store_socket = None
         self._cfg_socket = None
         self._store_endpoint = store_endpoint
         self._cfg_endpoint = cfg_endpoint
+        self._pool = pool
+        self._topology = topology_cache
+        self._shadow = store_shadow
+        self._batch = None
 
     def __enter__(self):
         self._ctx = zmq.Context.instance()
         # ZMQ sockopts set in the context will be used by all sockets
         self._ctx.IPV6 = 1
-        self._ctx.RCVTIMEO = 10000
+        self._ctx.RCVTIMEO = _TIMEOUT
         # All messages are ACK'ed so no need to wait when the socket is closed
         self._ctx.LINGER = 0
-        self._store_socket = self._ctx.socket(zmq.REQ)
-        self._store_socket.connect(self._store_endpoint)
-        self._cfg_socket = self._ctx.socket(zmq.REQ)
-        self._cfg_socket.connect(self._cfg_endpoint)
+        self._store_socket = self._acquire(self._store_endpoint)
+        self._cfg_socket = self._acquire(self._cfg_endpoint)
         return self
 
     def __exit__(self, *exc):
-        self._store_socket.close()
-        self._cfg_socket.close()
+        self._release(self._store_endpoint, self._store_socket)
+        self._release(self._cfg_endpoint, self._cfg_socket)
+        if self._shadow is not None:
+            self._shadow.save()
+
+    def _acquire(self, endpoint):
+        if self._pool is not None:
+            return self._pool.acquire(self._ctx, endpoint)
+
+        sock = self._ctx.socket(zmq.REQ)
+        sock.connect(endpoint)
+        return sock
+
+    def _release(self, endpoint, sock):
+        if self._pool is not None:
+            self._pool.release(self._ctx, endpoint, sock)
+        else:
+            sock.close()
+
+    def _get_vpconfig(self, raw=False):
+        """Fetch the topology with GETVPCONFIG, recorded in command_stats.
+        Return the json reply decoded or, if raw, as bytes."""
+        if command_stats is not None:
+            rc, config = _timed_request(command_stats, self._cfg_socket,
+                                        "GETVPCONFIG", [b"GETVPCONFIG"],
+                                        bytes if raw else json.loads)
+        else:
+            self._cfg_socket.send_string("GETVPCONFIG")
+            rc = self._cfg_socket.recv_string()
+            if rc == "OK":
+                config = (self._cfg_socket.recv() if raw else
+                          self._cfg_socket.recv_json())
+        if rc != "OK":
+            raise ControllerException("GETVPCONFIG returned {}".format(rc))
+        return config
 
     def get_dataplanes(self):
         """Generator for dataplanes. Will fetch info from the controller about
         all dataplanes, and create an object each and yield it.
+        With a topology_cache, the cached objects are yielded while valid.
         """
-        self._cfg_socket.send_string("GETVPCONFIG")
-        rc = self._cfg_socket.recv_string()
-        if rc != "OK":
-            raise ControllerException("GETVPCONFIG returned {}".format(rc))
+        if self._topology is not None:
+            yield from self._topology.dataplanes(self)
+            return
 
-        json = self._cfg_socket.recv_json()
-        if json is None:
+        config = self._get_vpconfig()
+        if config is None:
             raise ControllerException("GETVPCONFIG returned empty response")
 
-        for dp in json["dataplanes"]:
-            yield Dataplane(self._ctx, dp)
+        for dp in config["dataplanes"]:
+            yield Dataplane(self._ctx, dp, self._pool)
+
+    def broadcast_iter(self, cmd, timeout=_TIMEOUT, string=False,
+                       dataplanes=None):
+        """Send a command to all dataplanes at once, and yield a (Dataplane,
+        reply) tuple for each of them, in the order the replies arrive.
+        The reply is decoded as json, or as a string if "string" is set.
+        When a dataplane returns an error, or does not reply within timeout
+        milliseconds, the reply is a DataplaneException describing the
+        failure instead. "dataplanes" defaults to get_dataplanes().
+        """
+        if dataplanes is None:
+            dataplanes = self.get_dataplanes()
+
+        stats = command_stats
+        poller = zmq.Poller()
+        pending = {}
+        sent_at = {}
+        try:
+            for dp in dataplanes:
+                sock = self._acquire(dp._endpoint())
+                start = time.perf_counter()
+                sock.send_string(cmd)
+                if stats is not None:
+                    sent_at[sock] = (start, time.perf_counter())
+                poller.register(sock, zmq.POLLIN)
+                pending[sock] = dp
+
+            deadline = time.monotonic() + timeout / 1000
+            while pending:
+                wait = deadline - time.monotonic()
+                events = poller.poll(wait * 1000) if wait > 0 else []
+                if not events:
+                    break
+                for sock, _ in events:
+                    poller.unregister(sock)
+                    dp = pending.pop(sock)
+                    received = time.perf_counter()
+                    rc, *reply = sock.recv_multipart()
+                    self._release(dp._endpoint(), sock)
+                    size = len(rc) + sum(len(frame) for frame in reply)
+                    if rc != b"OK":
+                        reply = DataplaneException(
+                            "Command {} returned {} on dataplane {}".format(
+                                cmd, rc.decode(), getattr(dp, "id", None)))
+                    elif string:
+                        reply = reply[0].decode()
+                    else:
+                        reply = json.loads(reply[0])
+                    if stats is not None:
+                        start, sent = sent_at[sock]
+                        stats.record(_command_name(cmd), sent - start,
+                                     received - sent,
+                                     time.perf_counter() - received,
+                                     len(cmd), size,
+                                     error=isinstance(reply, Exception))
+                    yield dp, reply
+        finally:
+            # Requests still pending have timed out
+            for sock in pending:
+                if self._pool is not None:
+                    self._pool.discard(sock)
+                else:
+                    sock.close()
+
+        for dp in pending.values():
+            if stats is not None:
+                stats.record(_command_name(cmd), sent=len(cmd), timeout=True)
+            yield dp, DataplaneException(
+                "Command {} timed out on dataplane {}".format(
+                    cmd, getattr(dp, "id", None)))
+
+    def broadcast(self, cmd, timeout=_TIMEOUT, string=False,
+                  dataplanes=None):
+        """Send a command to all dataplanes at once, and return a dictionary
+        of their replies keyed by dataplane ID, in get_dataplanes() order.
+        Same arguments and per-dataplane failure reporting as
+        broadcast_iter().
+        """
+        if dataplanes is None:
+            dataplanes = list(self.get_dataplanes())
+
+        replies = {dp: reply for dp, reply in
+                   self.broadcast_iter(cmd, timeout, string, dataplanes)}
+        return {getattr(dp, "id", None): replies[dp] for dp in dataplanes}
 
     def store(self, path, cmd, interface="ALL",
-              action=os.getenv("COMMIT_ACTION"),
-              cmd_name=None):
+              action=None, cmd_name=None):
         """Send command to dataplane(s) and store it, associated with the path.
         By default it will apply to all interfaces, "interface" parameter to
         override.
         By default it will use the action defined by the COMMIT_ACTION env
         variable, which is set when in commit mode, "action" parameter to
         override.
+        Inside a batch() block the command is queued and only sent when the
+        block exits.
+        With a store_shadow, a command identical to the last one stored at
+        path is skipped.
         """
-        if action is None:
-            raise ControllerException(
-                "COMMIT_ACTION not found. Not in commit mode?")
-
-        # Create a dictionary, and use a reference to work on it recursively.
-        # The dataplane expect the path to be passed as nested JSON objects,
-        # with the actual command as a value in the bottom object.
-        msg = {}
-        temp = msg
-        for item in path.split(" "):
-            temp = temp.setdefault(item, {})
-        temp['__INTERFACE__'] = interface
-
-        # cmd_name if defined is used to send a protocol buffers form
-        # of the command.
-        if cmd_name is not None:
-            import base64
-            import google.protobuf
-            import vyatta.proto.DataplaneEnvelope_pb2
-            import vyatta.proto.VPlanedEnvelope_pb2
-
-            # Build up the Dataplane Envelope here
-            de = vyatta.proto.DataplaneEnvelope_pb2.DataplaneEnvelope()
-            de.type = cmd_name
-            de.msg = cmd.SerializeToString()
-
-            # Build up the VPlaned Envelope here
-            ve = vyatta.proto.VPlanedEnvelope_pb2.VPlanedEnvelope()
-            ve.key = path
-            ve.interface = interface
-
-            if action == "SET":
-                ve.action = vyatta.proto.VPlanedEnvelope_pb2.VPlanedEnvelope.SET
-            else:
-                ve.action = vyatta.proto.VPlanedEnvelope_pb2.VPlanedEnvelope.DELETE
+        leaf = _store_leaf(path, cmd, interface, action, cmd_name)
+        shadow = self._shadow
+        if shadow is not None and shadow.unchanged(self, path, leaf):
+            return
 
-            ve.msg = de.SerializeToString()
+        if self._batch is not None:
+            self._batch.add(path, cmd, leaf)
+            if shadow is not None:
+                shadow.record(path, leaf)
+            return
 
-            # Convert to base64
-            cmd = 'protobuf ' + base64.b64encode(ve.SerializeToString()).decode()
-            temp["__PROTOBUF__"] = True
-
-        temp["__" + action + "__"] = cmd
-
-        self._store_socket.send_json(msg)
-        rc = self._store_socket.recv_string()
+        msg = _to_tree([(path, cmd, leaf)])
+        if command_stats is not None:
+            rc, _ = _timed_request(command_stats, self._store_socket, "store",
+                                   [json.dumps(msg).encode()])
+        else:
+            self._store_socket.send_json(msg)
+            rc = self._store_socket.recv_string()
         if rc != "OK":
+            if shadow is not None:
+                shadow.forget([path])
             raise ControllerException("Config {} returned {}".format(msg, rc))
+        if shadow is not None:
+            shadow.record(path, leaf)
+
+    @contextlib.contextmanager
+    def batch(self, max_entries=1000, window=32):
+        """Queue every store() issued inside the "with" block and send them
+        when it exits. Entries with distinct paths are merged into multi-entry
+        messages of at most max_entries each, and up to window messages are
+        kept in flight on the store socket. Entries are applied in the order
+        they were stored whenever they share a path.
+        If the block raises, nothing is sent. If the controller rejects
+        entries, BatchException is raised once all messages were sent.
+        With a store_shadow, the paths of a batch which raised are forgotten.
+        """
+        if self._batch is not None:
+            raise ControllerException("Controller batches cannot be nested")
+
+        batch = _StoreBatch(self, max_entries, window)
+        self._batch = batch
+        try:
+            yield batch
+            self._batch = None
+            batch.flush()
+        except BaseException:
+            if self._shadow is not None:
+                self._shadow.forget([path for path, _, _ in batch.entries])
+            raise
+        finally:
+            self._batch = None
+
+    def subscribe(self, topics, endpoint=EVENTS_ENDPOINT,
+                  snapshot_endpoint=SNAPSHOT_ENDPOINT, queue_size=1000,
+                  snapshot=False):
+        """Subscription to the events of topics, prefixes of the topics of
+        the events published on endpoint; all events if topics is empty.
+        At most queue_size events are queued for the subscriber, and topics
+        that lost events are resynchronised from a snapshot requested from
+        snapshot_endpoint, when it is not None. With snapshot, the current
+        state of every topic is delivered first.
+        """
+        return Subscription(self._ctx, topics, endpoint, snapshot_endpoint,
+                            queue_size, snapshot)
 
     def config(self, cmd):
-        self._cfg_socket.send_multipart(cmd)
-        rc = self._cfg_socket.recv_string()
+        if command_stats is not None:
+            rc, _ = _timed_request(command_stats, self._cfg_socket,
+                                   _command_name(cmd[0]), cmd)
+        else:
+            self._cfg_socket.send_multipart(cmd)
+            rc = self._cfg_socket.recv_string()
         if rc != "OK":
             raise ControllerException("Config cmd returned {}".format(rc))
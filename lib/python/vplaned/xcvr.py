@@ -0,0 +1,36 @@
+# Copyright (c) 2021, AT&T Intellectual Property. All rights reserved.
+#
+# SPDX-License-Identifier: LGPL-2.1-only
+"""Client of the resident transceiver status cache.
+
+"vyatta-xcvr --daemon" polls the transceivers of every dataplane and serves
+the output of the xcvr-status RPC on a local unix socket. Clients send the
+JSON RPC input, then read the JSON RPC output back. Example:
+
+from vplaned.xcvr import query_xcvr_cache
+
+status = query_xcvr_cache({"name": "dp0xe1"})
+if status is None:
+    ...  # the cache is not running, ask the dataplanes
+for intf in status["xcvr-status"]:
+    intf["name"]
+"""
+import json
+import socket
+
+CACHE_SOCKET = "/var/run/vyatta/xcvr.socket"
+
+
+def query_xcvr_cache(rpc_input=None, path=CACHE_SOCKET, timeout=1):
+    """Return the xcvr-status RPC output served by the resident cache at
+    path, decoded, or None if the cache is not running or did not reply"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(json.dumps(rpc_input or {}).encode())
+            sock.shutdown(socket.SHUT_WR)
+            reply = b"".join(iter(lambda: sock.recv(65536), b""))
+        return json.loads(reply)
+    except (OSError, ValueError):
+        return None
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 #
 
+import csv
+import json
+import sys
 from argparse import ArgumentParser
-from vplaned import Controller
+from vplaned import Controller, json_iter
+from vplaned.routesnap import STATES, Snapshot, SnapshotWriter, diff
 
 try:
     from vrfmanager import VrfManager
 except ImportError:
     pass
 
+SUMMARY_COUNTERS = ['full', 'partial', 'no_resource', 'no_support', 'not_needed', 'error']
+
 
 def print_summary_header():
     print("{:>23} {:>9} {:>9} {:>9} {:>9} {:>9}".format("full",
@@ -19,58 +25,62 @@ def print_summary_header():
                                                         "error"))
 
 
-def find_dps(objects):
-    '''Find all the dataplanes that are in this json.
+def index_summary(objects, index=None):
+    '''Index the summary objects in a single pass.
     The json is an array of top level feature objects, with each entry
     in this array being an object that contains the dataplane name
     and feature details for that dataplane.
+    Returns a dictionary keyed by dataplane name, in the order the dataplanes
+    are first seen, of dictionaries keyed by feature of the list of counter
+    entries for that dataplane and feature. Entries are added to index if
+    given, so that several responses can be aggregated.
     '''
+    if index is None:
+        index = {}
 
-    dps = []
     for feat in objects:
-        for data in feat:
-            vals = feat[data]
+        for key, vals in feat.items():
             for k in vals:
-                if not k['dp'] in dps:
-                    dps.append(k['dp'])
-    return dps
-
+                index.setdefault(k['dp'], {}).setdefault(key, []).append(k)
+    return index
 
-def find_feats(objects):
-    feats = []
 
-    for feat in objects:
-        for f in feat:
-            if f not in feats:
-                feats.append(f)
-    return sorted(feats)
-
-
-def print_feat_summary_for_dp(obj, dp, in_feat):
-    for feat in obj:
-        for key in feat:
-            vals = feat[key]
-            for k in vals:
-                if (k['dp'] == dp) and key == in_feat:
-                    print("  {:11} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(in_feat,
-                                                                               k['full'],
-                                                                               k['partial'],
-                                                                               k['no_resource'],
-                                                                               k['no_support'],
-                                                                               k['not_needed'],
-                                                                               k['error']))
+def summary_records(index):
+    '''Flatten an index into one record per counter entry'''
+    for dp, feats in index.items():
+        for feat in sorted(feats):
+            for k in feats[feat]:
+                record = {'dp': dp, 'feature': feat}
+                record.update((c, k[c]) for c in SUMMARY_COUNTERS)
+                yield record
 
 
 def print_summary_data(data):
-    obj = data['objects']
-    dps = find_dps(obj)
-    feats = find_feats(obj)
+    index = index_summary(data['objects'])
 
     print_summary_header()
-    for dp in dps:
+    for dp, feats in index.items():
         print("{}:".format(dp))
-        for feat in feats:
-            print_feat_summary_for_dp(obj, dp, feat)
+        for feat in sorted(feats):
+            for k in feats[feat]:
+                print("  {:11} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(feat,
+                                                                           k['full'],
+                                                                           k['partial'],
+                                                                           k['no_resource'],
+                                                                           k['no_support'],
+                                                                           k['not_needed'],
+                                                                           k['error']))
+
+
+def write_summary_records(index, fmt):
+    '''Write the summary in a machine readable format, json or csv'''
+    records = summary_records(index)
+    if fmt == 'json':
+        print(json.dumps(list(records)))
+    else:
+        writer = csv.DictWriter(sys.stdout, ['dp', 'feature'] + SUMMARY_COUNTERS)
+        writer.writeheader()
+        writer.writerows(records)
 
 
 def show_route_nexthops(nh):
@@ -98,36 +108,35 @@ def show_route_prefix(prefix):
     print("    {}".format(prefix), end='')
 
 
-def print_route_subset_data(subset, data):
+def print_route_subset_data(subset, fields):
     try:
         vrf_manager = VrfManager()
     except Exception:
         pass
     header_needed = True
 
-    for val in data:
-        for field in data[val]:
-            if 'vrf_id' in field:
-                if field['table'] >= 254:
-                    table = 'MAIN'
-                else:
-                    table = field['table']
-                # If we have a vrf manager then show routing instance name.
-                # Otherwise ignore it, as everthng is in the default vrf.
-                try:
-                    vrf_name = vrf_manager.get_vrf_name(field['vrf_id'])
-                    vrf_header = "  routing-instance: {}, table: {}".format(vrf_name, table)
-                except Exception:
-                    vrf_header = "  table: {}".format(table)
-
-                header_needed = True
+    for field in fields:
+        if 'vrf_id' in field:
+            if field['table'] >= 254:
+                table = 'MAIN'
             else:
-                if header_needed:
-                    print(vrf_header)
-                    header_needed = False
+                table = field['table']
+            # If we have a vrf manager then show routing instance name.
+            # Otherwise ignore it, as everthng is in the default vrf.
+            try:
+                vrf_name = vrf_manager.get_vrf_name(field['vrf_id'])
+                vrf_header = "  routing-instance: {}, table: {}".format(vrf_name, table)
+            except Exception:
+                vrf_header = "  table: {}".format(table)
+
+            header_needed = True
+        else:
+            if header_needed:
+                print(vrf_header)
+                header_needed = False
 
-                show_route_prefix(field['prefix'])
-                show_route_nexthops(field['next_hop'])
+            show_route_prefix(field['prefix'])
+            show_route_nexthops(field['next_hop'])
 
 
 def show_mroute_field(field):
@@ -138,40 +147,39 @@ def show_last_mroute_field(field):
     print("  {}".format(field))
 
 
-def print_mroute_subset_data(subset, data):
+def print_mroute_subset_data(subset, fields):
     try:
         vrf_manager = VrfManager()
     except Exception:
         pass
     header_needed = True
 
-    for val in data:
-        for field in data[val]:
-            if 'vrf_id' in field:
-                # If we have a vrf manager then show routing instance name.
-                # Otherwise ignore it, as everthng is in the default vrf.
-                try:
-                    vrf_name = vrf_manager.get_vrf_name(field['vrf_id'])
-                    vrf_header = "  routing-instance: {}".format(vrf_name)
-                except Exception:
-                    vrf_header = "  "
-
-                header_needed = True
-            else:
-                if header_needed:
-                    print(vrf_header)
-                    header_needed = False
+    for field in fields:
+        if 'vrf_id' in field:
+            # If we have a vrf manager then show routing instance name.
+            # Otherwise ignore it, as everthng is in the default vrf.
+            try:
+                vrf_name = vrf_manager.get_vrf_name(field['vrf_id'])
+                vrf_header = "  routing-instance: {}".format(vrf_name)
+            except Exception:
+                vrf_header = "  "
+
+            header_needed = True
+        else:
+            if header_needed:
+                print(vrf_header)
+                header_needed = False
 
-                show_route_prefix(field['source'])
-                show_mroute_field(field['group'])
-                show_mroute_field(field['ifindex'])
-                show_last_mroute_field(field['ifname'])
+            show_route_prefix(field['source'])
+            show_mroute_field(field['group'])
+            show_mroute_field(field['ifindex'])
+            show_last_mroute_field(field['ifname'])
 
 
-def print_mpls_route_subset_data(subset, data):
+def print_mpls_route_subset_data(subset, tables):
     header_needed = False
 
-    for table in data['objects']:
+    for table in tables:
         if 'lblspc' not in table or 'mpls_routes' not in table:
             continue
 
@@ -188,17 +196,115 @@ def print_mpls_route_subset_data(subset, data):
             show_route_nexthops(route['next_hop'])
 
 
-def print_subset_data(feat, subset, data):
+def print_subset_data(feat, subset, text):
+    """Print the subset from the json text of the dataplane response. Route
+    tables can be huge, so the entries are decoded and printed one by one,
+    rather than after decoding the whole response."""
     if feat == 'route':
-        print_route_subset_data(subset, data)
+        print_route_subset_data(subset, json_iter(text, ['*']))
     elif feat == 'route6':
-        print_route_subset_data(subset, data)
+        print_route_subset_data(subset, json_iter(text, ['*']))
     elif feat == 'mroute':
-        print_mroute_subset_data(subset, data)
+        print_mroute_subset_data(subset, json_iter(text, ['*']))
     elif feat == 'mroute6':
-        print_mroute_subset_data(subset, data)
+        print_mroute_subset_data(subset, json_iter(text, ['*']))
     elif feat == 'mpls-route':
-        print_mpls_route_subset_data(subset, data)
+        print_mpls_route_subset_data(subset, json_iter(text, ['objects']))
+
+
+def write_snapshot(controller, obj, path):
+    """Snapshot the programming state of the routes of obj, from the
+    replies for every subset. Each reply is added, and released, as it
+    arrives."""
+    writer = SnapshotWriter(obj)
+    for state in STATES:
+        cmd = "pd show dataplane {} {}".format(obj, state)
+        for dp, data in controller.broadcast_iter(cmd, string=True):
+            if isinstance(data, Exception):
+                raise data
+            writer.add_reply(dp.id, state, data)
+    writer.write(path)
+
+
+def replies_in_order(controller, cmd, string=False):
+    """Yield the reply of each dataplane to cmd, in the order of
+    get_dataplanes(). A reply is yielded as soon as those of the dataplanes
+    before it have been, so only the replies arriving early are held."""
+    dataplanes = list(controller.get_dataplanes())
+    early = {}
+    pending = iter(dataplanes)
+    expected = next(pending, None)
+    for dp, data in controller.broadcast_iter(cmd, string=string,
+                                              dataplanes=dataplanes):
+        early[dp.id] = data
+        while expected is not None and expected.id in early:
+            yield early.pop(expected.id)
+            expected = next(pending, None)
+
+
+def section_header(obj, section, vrf_manager):
+    if obj == 'mpls-route':
+        return "  label space: {}".format(section.vrf_id)
+    try:
+        vrf_name = vrf_manager.get_vrf_name(section.vrf_id)
+        header = "  routing-instance: {}".format(vrf_name)
+    except Exception:
+        header = "  "
+    if obj.startswith('mroute'):
+        return header
+    table = 'MAIN' if section.table >= 254 else section.table
+    if header == "  ":
+        return "  table: {}".format(table)
+    return "{}, table: {}".format(header, table)
+
+
+def print_snapshot_diff(old_path, new_path, fmt):
+    """Print the routes added, removed or whose state or next hops changed
+    between two snapshots"""
+    try:
+        vrf_manager = VrfManager()
+    except Exception:
+        vrf_manager = None
+
+    with Snapshot(old_path) as old, Snapshot(new_path) as new:
+        changes = diff(old, new)
+        if fmt != 'text':
+            records = ({'dp': change.section.dp_id,
+                        'vrf_id': change.section.vrf_id,
+                        'table': change.section.table,
+                        'route': change.route,
+                        'old_state': change.old_state,
+                        'new_state': change.new_state,
+                        'old_next_hop': change.old_next_hop,
+                        'new_next_hop': change.new_next_hop}
+                       for change in changes)
+            if fmt == 'json':
+                print(json.dumps(list(records)))
+            else:
+                # next hops as their json text
+                records = (dict(record,
+                                old_next_hop=json.dumps(record['old_next_hop']),
+                                new_next_hop=json.dumps(record['new_next_hop']))
+                           for record in records)
+                writer = csv.DictWriter(sys.stdout, ['dp', 'vrf_id', 'table', 'route',
+                                                     'old_state', 'new_state',
+                                                     'old_next_hop', 'new_next_hop'])
+                writer.writeheader()
+                writer.writerows(records)
+            return
+
+        section = None
+        for change in changes:
+            if change.section != section:
+                section = change.section
+                print("dp{}:".format(section.dp_id))
+                print(section_header(old.obj, section, vrf_manager))
+            if change.old_state == change.new_state:
+                what = "{} next hops changed".format(change.new_state)
+            else:
+                what = "{} -> {}".format(change.old_state or "added",
+                                         change.new_state or "removed")
+            print("    {:43} {}".format(change.route, what))
 
 
 def main():
@@ -206,9 +312,27 @@ def main():
     parser.add_argument("--obj", choices=['route', 'route6', 'mroute', 'mroute6', 'mpls-route'])
     parser.add_argument("--subset", choices=['no_resource', 'no_support', 'not_needed', 'partial',
                                              'error', 'full'])
+    parser.add_argument("--format", choices=['text', 'json', 'csv'], default='text',
+                        help="Output format of the summary or differences")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="Save the programming state of the routes of --obj to FILE")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"),
+                        help="Show the routes whose programming state changed "
+                        "between two snapshots")
 
     args = parser.parse_args()
 
+    if args.diff:
+        print_snapshot_diff(args.diff[0], args.diff[1], args.format)
+        return
+
+    if args.snapshot:
+        if not args.obj:
+            parser.error("--snapshot requires --obj")
+        with Controller() as controller:
+            write_snapshot(controller, args.obj, args.snapshot)
+        return
+
     if args.obj:
         obj = args.obj
     else:
@@ -219,15 +343,24 @@ def main():
     else:
         subset = ""
 
+    index = {}
     with Controller() as controller:
-        for dp in controller.get_dataplanes():
-            with dp:
-                data = dp.json_command("pd show dataplane {} {}".format(obj, subset))
-
-                if (subset):
-                    print_subset_data(obj, subset, data)
-                else:
-                    print_summary_data(data)
+        cmd = "pd show dataplane {} {}".format(obj, subset)
+        # Each reply is printed, and released, as soon as those of the
+        # dataplanes before it are, rather than holding every reply at once
+        for data in replies_in_order(controller, cmd, string=bool(subset)):
+            if isinstance(data, Exception):
+                raise data
+
+            if (subset):
+                print_subset_data(obj, subset, data)
+            elif args.format != 'text':
+                index_summary(data['objects'], index)
+            else:
+                print_summary_data(data)
+
+    if not subset and args.format != 'text':
+        write_summary_records(index, args.format)
 
 
 if __name__ == '__main__':